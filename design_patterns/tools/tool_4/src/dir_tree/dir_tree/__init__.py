@@ -1,6 +1,21 @@
 """DirTree module for managing directory tree structures."""
 
-from .dir_tree_class import DirTree, Node_Dir, File, State
+from .dir_tree_class import (DirTree, Node_Dir, File, LazyFile, State, Stats, StoreResult, ChangeSet,
+                             Blob, ContentStore, DEFAULT_IGNORE)
+from .dir_tree_view import VisibilityView
+from .dir_tree_snapshot import SnapshotFile
+from .dir_tree_diff import Hunk, TreeDiff, MergeResult
+from .dir_tree_budget import BudgetedFiles, estimate_tokens
+from .dir_tree_ingest import JsonIngester
+from .dir_tree_search import TextIndex
+from .dir_tree_array import ArrayDirTree, ArrayNode
+from .dir_tree_concurrent import ConcurrentDirTree
+from .dir_tree_persistent import PersistentDirTree, PersistentDir, PersistentFile
 
-__all__ = ['DirTree', 'Node_Dir', 'File', 'State']
+__all__ = ['DirTree', 'Node_Dir', 'File', 'LazyFile', 'State', 'Stats', 'StoreResult', 'ChangeSet',
+           'Blob', 'ContentStore', 'DEFAULT_IGNORE', 'VisibilityView',
+           'SnapshotFile', 'Hunk', 'TreeDiff', 'MergeResult',
+           'BudgetedFiles', 'estimate_tokens', 'JsonIngester', 'TextIndex',
+           'ArrayDirTree', 'ArrayNode', 'ConcurrentDirTree',
+           'PersistentDirTree', 'PersistentDir', 'PersistentFile']
 
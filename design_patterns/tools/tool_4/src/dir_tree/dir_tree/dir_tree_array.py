@@ -0,0 +1,348 @@
+"""Array-backed preorder layout of a DirTree.
+
+Nodes are stored in preorder in parallel arrays, so every directory's
+subtree is the contiguous interval [index, end[index]). Subtree state
+changes become slice assignments, aggregates become prefix-sum differences
+and generate_file_dict skips hidden subtrees by jumping to their end.
+NumPy is used when it is installed; otherwise the same layout is kept in
+Python lists and arrays.
+"""
+
+import copy
+import itertools
+from array import array
+from typing import Dict, Iterator, List, Optional
+
+from .dir_tree_class import DirTree, File, Node_Dir, State, Stats, _PATH_ONLY_CONTENT
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+_STATE_CODES = {state: code for code, state in enumerate(State)}
+_CODE_STATES = list(State)
+_HIDDEN = _STATE_CODES[State.HIDDEN]
+_VISIBLE = _STATE_CODES[State.VISIBLE]
+_VISIBLE_PATH = _STATE_CODES[State.VISIBLE_PATH]
+_NO_PARENT = -1
+
+
+class ArrayNode:
+    """Lightweight view of one node of an ArrayDirTree.
+
+    Offers the read side of the Node_Dir and File API (name, path, state,
+    parent, children, files, content, stats); setting state changes only
+    this node, like Node_Dir.state and File.state.
+    """
+
+    __slots__ = ('_layout', '_index')
+
+    def __init__(self, layout: 'ArrayDirTree', index: int):
+        self._layout = layout
+        self._index = index
+
+    def __repr__(self) -> str:
+        kind = "file" if self.is_file else "dir"
+        return f"ArrayNode({kind} '{self.path}', state={self.state.value})"
+
+    def __eq__(self, other) -> bool:
+        return (isinstance(other, ArrayNode) and self._layout is other._layout
+                and self._index == other._index)
+
+    def __hash__(self) -> int:
+        return hash((id(self._layout), self._index))
+
+    @property
+    def is_file(self) -> bool:
+        return bool(self._layout._is_file[self._index])
+
+    @property
+    def name(self) -> str:
+        return self._layout._names[self._index]
+
+    @property
+    def path(self) -> str:
+        return self._layout._paths[self._index]
+
+    @property
+    def state(self) -> State:
+        return _CODE_STATES[self._layout._codes[self._index]]
+
+    @state.setter
+    def state(self, value: State) -> None:
+        self._layout._codes[self._index] = _STATE_CODES[value]
+
+    @property
+    def parent(self) -> Optional['ArrayNode']:
+        parent = int(self._layout._parent[self._index])
+        return ArrayNode(self._layout, parent) if parent != _NO_PARENT else None
+
+    @property
+    def files(self) -> Dict[str, 'ArrayNode']:
+        """Files directly in this directory, by name."""
+        return {node.name: node for node in self._layout._child_nodes(self._index) if node.is_file}
+
+    @property
+    def children(self) -> Dict[str, 'ArrayNode']:
+        """Subdirectories directly in this directory, by name."""
+        return {node.name: node for node in self._layout._child_nodes(self._index) if not node.is_file}
+
+    @property
+    def content(self) -> str:
+        """Content of a file node."""
+        file_obj = self._layout._objects[self._index]
+        if not isinstance(file_obj, File):
+            raise ValueError(f"'{self.path}' is a directory")
+        return file_obj.content
+
+    @property
+    def stats(self) -> Stats:
+        """Counters of the file, or of the whole subtree for a directory."""
+        return self._layout._interval_stats(self._index, int(self._layout._end[self._index]))
+
+
+class ArrayDirTree:
+    """DirTree stored as parallel preorder arrays for very large trees.
+
+    Arrays per node: parent index, subtree end, file flag, state code and
+    the word, byte and line counts of files. The structure is fixed when the
+    layout is built (DirTree.to_array); states can be changed, and to_tree
+    turns the layout back into a DirTree with the current states. File
+    contents are shared with the source tree, not copied.
+    """
+
+    def __init__(self, tree: DirTree):
+        """Lay out tree in preorder (each directory, its files, then its subdirectories)."""
+        names: List[str] = []
+        paths: List[str] = []
+        objects: List = []
+        parent: List[int] = []
+        is_file: List[bool] = []
+        codes = array('B')
+        words: List[int] = []
+        sizes: List[int] = []
+        lines: List[int] = []
+        position: Dict[int, int] = {}
+        self._dir_index: Dict[str, int] = {}
+        self._file_index: Dict[str, int] = {}
+
+        for path, obj, _ in tree._walk(tree.root):
+            index = len(objects)
+            position[id(obj)] = index
+            names.append(obj._name)
+            paths.append(path)
+            objects.append(obj)
+            parent.append(position[id(obj.parent)] if obj.parent is not None else _NO_PARENT)
+            codes.append(_STATE_CODES[obj.state])
+            if isinstance(obj, File):
+                stats = obj.stats
+                is_file.append(True)
+                words.append(stats.words)
+                sizes.append(stats.bytes)
+                lines.append(stats.lines)
+                self._file_index[path] = index
+            else:
+                is_file.append(False)
+                words.append(0)
+                sizes.append(0)
+                lines.append(0)
+                self._dir_index[path] = index
+
+        # Subtree ends: children always come after their parent in preorder
+        size = [1] * len(objects)
+        for index in range(len(objects) - 1, 0, -1):
+            size[parent[index]] += size[index]
+        end = [index + size[index] for index in range(len(objects))]
+
+        self._names = names
+        self._paths = paths
+        self._objects = objects
+        if np is not None:
+            self._parent = np.array(parent, dtype=np.int64)
+            self._end = np.array(end, dtype=np.int64)
+            self._is_file = np.array(is_file, dtype=bool)
+            self._codes = np.frombuffer(codes.tobytes(), dtype=np.uint8).copy()
+            self._counters = np.array([words, sizes, lines, is_file], dtype=np.int64)
+        else:
+            self._parent = parent
+            self._end = end
+            self._is_file = is_file
+            self._codes = codes
+            self._counters = [words, sizes, lines, [int(flag) for flag in is_file]]
+        self._prefix = None
+
+    def __len__(self) -> int:
+        """Number of nodes (directories and files)."""
+        return len(self._objects)
+
+    def _dir(self, path: str) -> int:
+        """Index of a directory path; "" is the root.
+
+        Raises:
+            ValueError: If the directory path does not exist
+        """
+        key = '/'.join(p for p in path.split('/') if p != "")
+        index = self._dir_index.get(key) if key else 0
+        if index is None:
+            raise ValueError(f"Directory path '{path}' does not exist")
+        return index
+
+    def _child_nodes(self, index: int) -> Iterator[ArrayNode]:
+        """Direct children of a directory, jumping over each child's subtree."""
+        child = index + 1
+        end = int(self._end[index])
+        while child < end:
+            yield ArrayNode(self, child)
+            child = int(self._end[child])
+
+    def _interval_stats(self, start: int, end: int) -> Stats:
+        """Sum of the counters over [start, end) from the prefix sums."""
+        if self._prefix is None:
+            if np is not None:
+                self._prefix = np.concatenate(
+                    (np.zeros((4, 1), dtype=np.int64), np.cumsum(self._counters, axis=1)), axis=1)
+            else:
+                self._prefix = [[0, *itertools.accumulate(row)] for row in self._counters]
+        words, sizes, lines, files = (int(row[end]) - int(row[start]) for row in self._prefix)
+        return Stats(words=words, bytes=sizes, lines=lines, files=files)
+
+    def node(self, path: str) -> ArrayNode:
+        """View of the file or directory at path.
+
+        Raises:
+            ValueError: If the path does not exist
+        """
+        key = '/'.join(p for p in path.split('/') if p != "")
+        index = self._file_index.get(key)
+        if index is None:
+            index = self._dir(key)
+        return ArrayNode(self, index)
+
+    @property
+    def root(self) -> ArrayNode:
+        return ArrayNode(self, 0)
+
+    def dir_exists(self, dirpath: str) -> bool:
+        """Check if a directory exists in the layout."""
+        key = '/'.join(p for p in dirpath.split('/') if p != "")
+        return not key or key in self._dir_index
+
+    def get_stats(self, dirpath: str = "") -> Stats:
+        """Aggregate counters of a directory subtree as a prefix-sum difference.
+
+        Raises:
+            ValueError: If the directory path does not exist
+        """
+        index = self._dir(dirpath)
+        return self._interval_stats(index, int(self._end[index]))
+
+    def change_dir_state(self, path: str, state: State) -> int:
+        """Set a directory and its whole subtree to state with one slice assignment.
+
+        Returns:
+            Total number of states updated (directory + all subdirectories + all files)
+
+        Raises:
+            ValueError: If the directory path does not exist
+        """
+        start = self._dir(path)
+        end = int(self._end[start])
+        code = _STATE_CODES[state]
+        if np is not None:
+            self._codes[start:end] = code
+        else:
+            self._codes[start:end] = array('B', bytes((code,)) * (end - start))
+        return end - start
+
+    def change_file_state(self, path: str, state: State) -> int:
+        """Change the state of a file, unhiding its parents when set to VISIBLE.
+
+        Returns:
+            Number of states updated (file + parent directories, only counting actual changes)
+
+        Raises:
+            ValueError: If the file path does not exist
+        """
+        index = self._file_index.get(path)
+        if index is None:
+            raise ValueError(f"File path '{path}' does not exist")
+        count = 0
+        code = _STATE_CODES[state]
+        if self._codes[index] != code:
+            self._codes[index] = code
+            count += 1
+        if state == State.VISIBLE:
+            parent = int(self._parent[index])
+            while parent != _NO_PARENT:
+                if self._codes[parent] == _HIDDEN:
+                    self._codes[parent] = _VISIBLE
+                    count += 1
+                parent = int(self._parent[parent])
+        return count
+
+    def _shown_files(self, start: int) -> List[int]:
+        """Indices of the VISIBLE and VISIBLE_PATH files in start's subtree, not below a HIDDEN dir."""
+        end = int(self._end[start])
+        if np is not None:
+            codes = self._codes[start:end]
+            is_file = self._is_file[start:end]
+            # Each HIDDEN directory covers its interval: +1 at its start, -1 at its end
+            hidden = np.flatnonzero((codes == _HIDDEN) & ~is_file) + start
+            delta = np.zeros(end - start + 1, dtype=np.int64)
+            np.add.at(delta, hidden - start, 1)
+            np.add.at(delta, self._end[hidden] - start, -1)
+            covered = np.cumsum(delta[:-1]) > 0
+            mask = is_file & ~covered & ((codes == _VISIBLE) | (codes == _VISIBLE_PATH))
+            return (np.flatnonzero(mask) + start).tolist()
+
+        shown = []
+        codes, is_file, ends = self._codes, self._is_file, self._end
+        index = start
+        while index < end:
+            code = codes[index]
+            if code == _HIDDEN:
+                # A hidden directory prunes its whole interval, a hidden file only itself
+                index = index + 1 if is_file[index] else ends[index]
+                continue
+            if is_file[index]:
+                shown.append(index)
+            index += 1
+        return shown
+
+    def generate_file_dict(self, dir: Optional[str] = None) -> Dict[str, str]:
+        """Same result as DirTree.generate_file_dict, gathered from the shown-file mask.
+
+        Raises:
+            ValueError: If the directory path does not exist
+        """
+        file_dict = {}
+        for index in self._shown_files(self._dir(dir) if dir is not None else 0):
+            if self._codes[index] == _VISIBLE_PATH:
+                file_dict[self._paths[index]] = _PATH_ONLY_CONTENT
+            else:
+                file_dict[self._paths[index]] = self._objects[index].content
+        return file_dict
+
+    def to_tree(self) -> DirTree:
+        """Build a DirTree with this layout's structure and current states.
+
+        File contents are shared with the source tree.
+        """
+        nodes: List[Node_Dir] = []
+        for index, obj in enumerate(self._objects):
+            state = _CODE_STATES[self._codes[index]]
+            parent = int(self._parent[index])
+            if isinstance(obj, File):
+                file_obj = copy.copy(obj)
+                file_obj._state = state
+                file_obj.parent = nodes[parent]
+                nodes[parent].files[file_obj._name] = file_obj
+                nodes.append(None)
+                continue
+            node = Node_Dir(path=obj._name, state=state)
+            if parent != _NO_PARENT:
+                node.parent = nodes[parent]
+                nodes[parent].children[node._name] = node
+            nodes.append(node)
+        return DirTree(nodes[0])
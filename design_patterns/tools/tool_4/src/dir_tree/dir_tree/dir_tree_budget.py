@@ -0,0 +1,152 @@
+"""Budgeted export of DirTree file contents for prompts."""
+
+import re
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Union
+
+from .dir_tree_class import DirTree, State, _PATH_ONLY_CONTENT
+
+# Lines kept when a Python file is summarized
+_OUTLINE_RE = re.compile(r'^\s*(?:async\s+def|def|class)\s')
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the token count of text at ~4 characters per token."""
+    if not text:
+        return 0
+    return max(1, len(text) // 4)
+
+
+def _utf8_size(text: str) -> int:
+    return len(text.encode('utf-8'))
+
+
+_UNITS: Dict[str, Callable[[str], int]] = {"tokens": estimate_tokens, "bytes": _utf8_size}
+
+
+@dataclass
+class BudgetedFiles:
+    """Outcome of DirTree.generate_budgeted_file_dict.
+
+    Every shown file ends up in exactly one of the path lists.
+    """
+    files: Dict[str, str]
+    budget: int
+    used: int = 0
+    full: List[str] = field(default_factory=list)
+    summarized: List[str] = field(default_factory=list)
+    truncated: List[str] = field(default_factory=list)
+    path_only: List[str] = field(default_factory=list)
+    dropped: List[str] = field(default_factory=list)
+
+
+def _priority_lookup(priorities) -> Callable[[str], float]:
+    """Turn a priorities argument into a function of the file path.
+
+    Dict keys may be file or directory paths; the longest matching key wins.
+    """
+    if priorities is None:
+        return lambda path: 0
+    if callable(priorities):
+        return priorities
+
+    def lookup(path: str) -> float:
+        parts = path.split('/')
+        for i in range(len(parts), -1, -1):
+            key = '/'.join(parts[:i])
+            if key in priorities:
+                return priorities[key]
+        return 0
+    return lookup
+
+
+def _summarize(content: str) -> Optional[str]:
+    """Outline of a Python file: its def and class lines, or None if it has none."""
+    lines = content.splitlines()
+    outline = [line for line in lines if _OUTLINE_RE.match(line)]
+    if not outline:
+        return None
+    return '\n'.join(outline) + f"\n[SUMMARY OF {len(lines)} LINES, BODIES OMITTED, DO NOT EDIT]"
+
+
+def _truncate(content: str, room: int, cost: Callable[[str], int]) -> Optional[str]:
+    """Longest head of content (whole lines) that fits room with its marker, or None."""
+    lines = content.splitlines(keepends=True)
+
+    def head(k: int) -> str:
+        text = ''.join(lines[:k])
+        if not text.endswith('\n'):
+            text += '\n'
+        return text + f"[TRUNCATED: {len(lines) - k} MORE LINES, DO NOT EDIT]"
+
+    # Binary search for the largest k that fits
+    low, high = 0, len(lines) - 1
+    while low < high:
+        mid = (low + high + 1) // 2
+        if cost(head(mid)) <= room:
+            low = mid
+        else:
+            high = mid - 1
+    if low == 0:
+        return None
+    return head(low)
+
+
+def budget_file_dict(tree: DirTree, budget: int, unit: Union[str, Callable[[str], int]] = "tokens",
+                     priorities=None, dir: Optional[str] = None, view=None,
+                     summarize: bool = True) -> BudgetedFiles:
+    """Fill budget with the shown files of tree, see DirTree.generate_budgeted_file_dict."""
+    if isinstance(unit, str):
+        if unit not in _UNITS:
+            raise ValueError(f"Unknown unit '{unit}'")
+        cost = _UNITS[unit]
+    else:
+        cost = unit
+    priority = _priority_lookup(priorities)
+    entries = list(tree._iter_shown_files(tree._start_dir(dir), view))
+    result = BudgetedFiles(files={}, budget=budget)
+
+    # Highest priority first; equal priorities keep the tree order
+    order = sorted(range(len(entries)), key=lambda i: -priority(entries[i][0]))
+
+    # Pass 1: every file that fits gets at least its path
+    placeholder_cost = cost(_PATH_ONLY_CONTENT)
+    chosen: Dict[int, str] = {}
+    kept = []
+    for i in order:
+        path = entries[i][0]
+        entry_cost = cost(path) + placeholder_cost
+        if result.used + entry_cost > budget:
+            result.dropped.append(path)
+            continue
+        result.used += entry_cost
+        chosen[i] = _PATH_ONLY_CONTENT
+        kept.append(i)
+
+    # Pass 2: upgrade paths to contents in priority order while they fit
+    for i in kept:
+        path, file_obj, state = entries[i]
+        if state == State.VISIBLE_PATH:
+            result.path_only.append(path)
+            continue
+        content = file_obj.content
+        room = budget - result.used + placeholder_cost
+        if cost(content) <= room:
+            text, kind = content, result.full
+        else:
+            text, kind = None, result.path_only
+            if summarize and path.endswith('.py'):
+                summary = _summarize(content)
+                if summary is not None and cost(summary) <= room:
+                    text, kind = summary, result.summarized
+            if text is None:
+                truncated = _truncate(content, room, cost)
+                if truncated is not None:
+                    text, kind = truncated, result.truncated
+        kind.append(path)
+        if text is not None:
+            chosen[i] = text
+            result.used += cost(text) - placeholder_cost
+
+    result.files = {entries[i][0]: chosen[i] for i in range(len(entries)) if i in chosen}
+    return result
@@ -1,10 +1,18 @@
 """Directory tree implementation with File and Node_Dir classes."""
 
+import fnmatch
+import hashlib
+import json
 import os
+import re
+import shutil
 import stat
+import sys
+import weakref
 from dataclasses import dataclass, field
 from enum import Enum
-from typing import Dict, Optional, List, Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, Optional, List, TextIO, Tuple, Union
 
 
 class State(Enum):
@@ -14,21 +22,685 @@ class State(Enum):
     VISIBLE_PATH = "visible_path"
 
 
-@dataclass
+@dataclass(frozen=True)
+class Stats:
+    """Aggregate counters for a file or a directory subtree."""
+    words: int = 0
+    bytes: int = 0
+    lines: int = 0
+    files: int = 0
+    
+    @classmethod
+    def from_content(cls, content: str) -> 'Stats':
+        """Compute the counters for a single file's content."""
+        if not content:
+            return cls(files=1)
+        lines = content.count('\n')
+        if not content.endswith('\n'):
+            lines += 1
+        return cls(words=len(content.split()),
+                   bytes=len(content.encode('utf-8')),
+                   lines=lines,
+                   files=1)
+    
+    def __add__(self, other: 'Stats') -> 'Stats':
+        return Stats(words=self.words + other.words,
+                     bytes=self.bytes + other.bytes,
+                     lines=self.lines + other.lines,
+                     files=self.files + other.files)
+
+
+class Blob:
+    """Immutable file content shared by every File with the same content.
+    
+    The SHA-256 digest and the counters are computed once per distinct content.
+    """
+    __slots__ = ('data', 'digest', '_stats', '__weakref__')
+    
+    def __init__(self, data: str, digest: bytes):
+        self.data = data
+        self.digest = digest
+        self._stats: Optional[Stats] = None
+    
+    @property
+    def stats(self) -> Stats:
+        """Counters of the content, computed on first use."""
+        if self._stats is None:
+            self._stats = Stats.from_content(self.data)
+        return self._stats
+    
+    def __hash__(self) -> int:
+        return hash(self.digest)
+    
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Blob):
+            return NotImplemented
+        return self.digest == other.digest
+    
+    def __repr__(self) -> str:
+        return f"Blob(digest={self.digest.hex()[:12]!r}, size={len(self.data)})"
+
+
+class ContentStore:
+    """Content-addressed store of Blobs keyed by SHA-256 digest.
+    
+    Blobs are held weakly: a blob lives as long as some File references it,
+    so equal contents are stored once without the store growing forever.
+    """
+    
+    def __init__(self):
+        self._blobs: 'weakref.WeakValueDictionary[bytes, Blob]' = weakref.WeakValueDictionary()
+    
+    def put(self, data: str, digest: Optional[bytes] = None) -> Blob:
+        """Return the shared Blob for data, adding it if it is new.
+        
+        Args:
+            data: Content to store
+            digest: SHA-256 of the UTF-8 encoded data, if already known
+        """
+        if digest is None:
+            digest = hashlib.sha256(data.encode('utf-8')).digest()
+        blob = self._blobs.get(digest)
+        if blob is None:
+            blob = Blob(data, digest)
+            self._blobs[digest] = blob
+        return blob
+    
+    def get(self, digest: bytes) -> Optional[Blob]:
+        """Return the Blob with the given digest, or None."""
+        return self._blobs.get(digest)
+    
+    def __contains__(self, digest: bytes) -> bool:
+        return digest in self._blobs
+    
+    def __len__(self) -> int:
+        return len(self._blobs)
+    
+    @property
+    def size(self) -> int:
+        """Total number of characters held by the distinct blobs."""
+        return sum(len(blob.data) for blob in list(self._blobs.values()))
+
+
+# Process-wide store shared by all files, so identical templates added to
+# different directories (or different trees) share one Blob
+content_store = ContentStore()
+
+# Held here so the store keeps it: the content of files created without one
+_EMPTY_BLOB = content_store.put("")
+
+
+def _join_path(parent: Optional['Node_Dir'], name: str) -> str:
+    """Build a full path from the parent chain and a name relative to it.
+    
+    The name of the topmost directory (the root) is not part of the path.
+    """
+    names = [name]
+    node = parent
+    while node.parent is not None:
+        names.append(node._name)
+        node = node.parent
+    return '/'.join(reversed(names))
+
+
+def _tree_path(node: 'Node_Dir') -> str:
+    """Path of a directory below its root; the root itself is ""."""
+    return "" if node.parent is None else node.path
+
+
 class File:
-    """File node in the directory tree."""
-    path: str
-    content: str
-    state: State = State.VISIBLE
+    """File node in the directory tree.
+    
+    Uses __slots__ and stores only its (interned) name relative to the
+    parent directory; the full path is computed on demand. A File that is
+    not attached to a directory keeps the path it was created with.
+    
+    The content is kept in a Blob from the shared content_store, so files
+    with equal content share one string, digest and set of counters. A
+    content of None is stored as "".
+    """
+    __slots__ = ('_name', '_blob', '_state', 'parent')
+    __hash__ = None
+    
+    def __init__(self, path: str, content: Optional[str], state: State = State.VISIBLE,
+                 parent: Optional['Node_Dir'] = None):
+        self._name = sys.intern(path)
+        self._blob: Optional[Blob] = content_store.put(content) if content is not None else _EMPTY_BLOB
+        self._state = state
+        self.parent = parent
+    
+    @property
+    def name(self) -> str:
+        """File name (the full path while the file is detached)."""
+        return self._name
+    
+    @property
+    def path(self) -> str:
+        """Full path of the file, computed from the parent chain.
+        
+        The root's own name is not part of the path.
+        """
+        if self.parent is None:
+            return self._name
+        return _join_path(self.parent, self._name)
+    
+    @path.setter
+    def path(self, value: str) -> None:
+        if self.parent is not None:
+            raise AttributeError("Cannot set path of a file attached to a directory")
+        self._name = sys.intern(value)
+    
+    @property
+    def content(self) -> str:
+        """Content of the file."""
+        return self._blob.data
+    
+    @content.setter
+    def content(self, value: str) -> None:
+        # Assigning equal content is not a change; otherwise the cached
+        # counters are invalidated up to the root
+        blob = content_store.put(value)
+        if blob is self._blob:
+            return
+        self._blob = blob
+        if self.parent is not None:
+            self.parent._changed(self)
+    
+    @property
+    def digest(self) -> bytes:
+        """SHA-256 digest of the UTF-8 encoded content."""
+        return self._blob.digest
+    
+    @property
+    def state(self) -> State:
+        """State of the file."""
+        return self._state
+    
+    @state.setter
+    def state(self, value: State) -> None:
+        if value != self._state:
+            self._state = value
+            if self.parent is not None:
+                self.parent._changed(self, stats=False)
+    
+    @property
+    def stats(self) -> Stats:
+        """Counters for this file, computed once per distinct content."""
+        return self._blob.stats
+    
+    def __repr__(self) -> str:
+        return f"File(path={self.path!r}, content={self.content!r}, state={self.state!r})"
+    
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, File):
+            return NotImplemented
+        # Contents are compared by digest instead of character by character
+        return (self.state == other.state and self.path == other.path and
+                ((self._blob is not None and self._blob is other._blob) or
+                 self.digest == other.digest))
+
+
+class LazyFile(File):
+    """File whose content stays on disk until it is accessed.
+    
+    Only the on-disk path, size and mtime are recorded. Reading `content`
+    reads the file each time (nothing is kept in memory); assigning
+    `content` turns it into a regular in-memory file. The digest and
+    counters are cached and computed again once the file on disk shows a
+    different size or mtime.
+    """
+    __slots__ = ('disk_path', 'size', 'mtime', '_stats', '_digest')
+    
+    def __init__(self, path: str, disk_path: str, state: State = State.VISIBLE,
+                 size: Optional[int] = None, mtime: Optional[float] = None,
+                 parent: Optional['Node_Dir'] = None):
+        super().__init__(path, None, state, parent)
+        # No blob until content is assigned
+        self._blob = None
+        if size is None or mtime is None:
+            st = os.stat(disk_path)
+            size, mtime = st.st_size, st.st_mtime
+        self.disk_path = disk_path
+        self.size = size
+        self.mtime = mtime
+        self._stats: Optional[Stats] = None
+        self._digest: Optional[bytes] = None
+    
+    @property
+    def is_loaded(self) -> bool:
+        """True once content has been assigned and lives in memory."""
+        return self._blob is not None
+    
+    @property
+    def content(self) -> str:
+        """Content of the file, read from disk unless it was assigned."""
+        if self._blob is not None:
+            return self._blob.data
+        with open(self.disk_path, 'r', encoding='utf-8', errors='replace') as f:
+            return f.read()
+    
+    @content.setter
+    def content(self, value: str) -> None:
+        if self._blob is None:
+            # Always a change, the disk content was never compared
+            self._blob = content_store.put(value)
+            if self.parent is not None:
+                self.parent._changed(self)
+            return
+        File.content.fset(self, value)
+    
+    def _check_disk(self) -> None:
+        """Drop the cached digest and counters if the disk file changed size or mtime.
+        
+        The change is propagated like an assignment, so the directories above
+        drop their cached counters and hashes as well.
+        """
+        st = os.stat(self.disk_path)
+        if (st.st_size, st.st_mtime) != (self.size, self.mtime):
+            self.size, self.mtime = st.st_size, st.st_mtime
+            self._stats = None
+            self._digest = None
+            if self.parent is not None:
+                self.parent._changed(self)
+    
+    @property
+    def digest(self) -> bytes:
+        """SHA-256 digest of the content, cached until the disk file changes (or the blob's).
+        
+        Unloaded content is hashed as the raw bytes on disk, which equals the
+        digest of the decoded text for UTF-8 files.
+        """
+        if self._blob is not None:
+            return self._blob.digest
+        self._check_disk()
+        if self._digest is None:
+            with open(self.disk_path, 'rb') as f:
+                self._digest = hashlib.sha256(f.read()).digest()
+        return self._digest
+    
+    @property
+    def stats(self) -> Stats:
+        """Counters for this file, cached until the disk file changes (or the blob's)."""
+        if self._blob is not None:
+            return self._blob.stats
+        self._check_disk()
+        if self._stats is None:
+            self._stats = Stats.from_content(self.content)
+        return self._stats
+    
+    def __repr__(self) -> str:
+        return (f"LazyFile(path={self.path!r}, disk_path={self.disk_path!r}, "
+                f"size={self.size!r}, state={self.state!r})")
+
+
+def _fill_stats(start) -> None:
+    """Compute the cached counters of start and of every directory below it missing them.
+    
+    Post-order over the directories whose cache was dropped; works on any
+    node with children, files and a _stats slot.
+    """
+    stack = [(start, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if not expanded:
+            stack.append((node, True))
+            stack.extend((child_dir, False) for child_dir in node.children.values()
+                         if child_dir._stats is None)
+            continue
+        total = Stats()
+        for file_obj in node.files.values():
+            total += file_obj.stats
+        for child_dir in node.children.values():
+            total += child_dir._stats
+        node._stats = total
+
+
+def _fill_hashes(start) -> None:
+    """Compute the cached Merkle hash of start and of every directory below it missing one.
+    
+    Post-order over the directories whose hash was dropped; works on any
+    node with _state, children, files and a _hash slot.
+    """
+    stack = [(start, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if not expanded:
+            stack.append((node, True))
+            stack.extend((child_dir, False) for child_dir in node.children.values()
+                         if child_dir._hash is None)
+            continue
+        h = hashlib.sha256(node._state.value.encode())
+        for name in sorted(node.files):
+            file_obj = node.files[name]
+            h.update(b"\0F" + name.encode('utf-8') + b"\0" + file_obj._state.value.encode())
+            h.update(file_obj.digest)
+        for name in sorted(node.children):
+            h.update(b"\0D" + name.encode('utf-8') + b"\0")
+            h.update(node.children[name]._hash)
+        node._hash = h.digest()
 
 
-@dataclass
 class Node_Dir:
-    """Directory node in the directory tree."""
+    """Directory node in the directory tree.
+    
+    Uses __slots__ and stores only its (interned) name relative to the
+    parent directory; the full path is computed on demand.
+    """
+    __slots__ = ('_name', '_state', 'children', 'files', 'parent', '_stats', '_hash', '_owner')
+    __hash__ = None
+    
+    def __init__(self, path: str, state: State = State.VISIBLE,
+                 children: Optional[Dict[str, 'Node_Dir']] = None,
+                 files: Optional[Dict[str, File]] = None,
+                 parent: Optional['Node_Dir'] = None):
+        self._name = sys.intern(path)
+        self._state = state
+        self.children: Dict[str, 'Node_Dir'] = children if children is not None else {}
+        self.files: Dict[str, File] = files if files is not None else {}
+        self.parent = parent
+        self._stats: Optional[Stats] = None
+        self._hash: Optional[bytes] = None
+        self._owner: Optional['DirTree'] = None
+        for name, child in self.children.items():
+            child._name = sys.intern(name)
+            child.parent = self
+        for name, file_obj in self.files.items():
+            file_obj._name = sys.intern(name)
+            file_obj.parent = self
+    
+    @property
+    def name(self) -> str:
+        """Directory name (the full path for a root or detached directory)."""
+        return self._name
+    
+    @property
+    def path(self) -> str:
+        """Full path of the directory, computed from the parent chain.
+        
+        The root's own name is not part of the paths below it.
+        """
+        if self.parent is None:
+            return self._name
+        return _join_path(self.parent, self._name)
+    
+    @path.setter
+    def path(self, value: str) -> None:
+        if self.parent is not None:
+            raise AttributeError("Cannot set path of a directory attached to a parent")
+        self._name = sys.intern(value)
+    
+    @property
+    def stats(self) -> Stats:
+        """Aggregate counters (words, bytes, lines, files) of this subtree.
+        
+        The value is cached and only recomputed for directories on the path
+        from a mutated file up to the root.
+        """
+        if self._stats is None:
+            _fill_stats(self)
+        return self._stats
+    
+    @property
+    def digest(self) -> bytes:
+        """Merkle hash of this subtree: states, names, file digests and child hashes.
+        
+        Entries are hashed in name order, so equal subtrees have equal hashes
+        regardless of insertion order. The value is cached and only recomputed
+        for directories on the path from a mutation up to the root.
+        """
+        if self._hash is None:
+            _fill_hashes(self)
+        return self._hash
+    
+    @property
+    def state(self) -> State:
+        """State of the directory."""
+        return self._state
+    
+    @state.setter
+    def state(self, value: State) -> None:
+        old = self._state
+        if value == old:
+            return
+        self._state = value
+        # Only hiding or unhiding changes what gets stored
+        if (old == State.HIDDEN) != (value == State.HIDDEN):
+            self._changed(self, stats=False)
+        else:
+            self._invalidate_hash()
+    
+    def _invalidate_hash(self) -> None:
+        """Drop the cached Merkle hashes from this directory up to the root.
+        
+        A directory's hash is only computed after its children's, so the walk
+        stops at the first directory whose hash is already dropped.
+        """
+        node = self
+        while node is not None and node._hash is not None:
+            node._hash = None
+            node = node.parent
+    
+    def _changed(self, obj: Union[File, 'Node_Dir'], stats: bool = True) -> None:
+        """Propagate a mutation of obj (a file here, this directory or a new child) to the root.
+        
+        Drops the cached Merkle hashes on the way up, and the cached counters
+        when stats is True, and reports
+        obj to the DirTree owning the root, if any, for dirty tracking.
+        """
+        node = self
+        while True:
+            node._hash = None
+            if stats:
+                node._stats = None
+            if node.parent is None:
+                break
+            node = node.parent
+        if node._owner is not None:
+            node._owner._mark_dirty(obj)
+    
+    def _attach_file(self, name: str, file_obj: File) -> None:
+        """Insert or replace a file in this directory."""
+        name = sys.intern(name)
+        file_obj._name = name
+        file_obj.parent = self
+        self.files[name] = file_obj
+        self._changed(file_obj)
+    
+    def _attach_dir(self, name: str, child: 'Node_Dir') -> None:
+        """Insert or replace a child directory of this directory."""
+        name = sys.intern(name)
+        child._name = name
+        child.parent = self
+        self.children[name] = child
+        self._changed(child)
+    
+    def _detach(self, obj: Union[File, 'Node_Dir']) -> None:
+        """Unlink a file or child directory, dropping the cached hashes and counters up to the root."""
+        if isinstance(obj, File):
+            del self.files[obj._name]
+        else:
+            del self.children[obj._name]
+        obj.parent = None
+        node = self
+        while node is not None:
+            node._hash = None
+            node._stats = None
+            node = node.parent
+    
+    def __repr__(self) -> str:
+        return (f"Node_Dir(path={self.path!r}, state={self.state!r}, "
+                f"children={self.children!r}, files={self.files!r})")
+    
+    def __eq__(self, other) -> bool:
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return ((self.path, self.state, self.children, self.files) ==
+                (other.path, other.state, other.children, other.files))
+
+
+# States that generate_file_dict and store_files descend into
+_SHOWN_STATES = frozenset((State.VISIBLE, State.VISIBLE_PATH))
+
+def _glob_to_regex(pattern: str) -> 're.Pattern':
+    """Compile a glob pattern over '/' separated paths.
+    
+    '*', '?' and '[...]' match within one path segment, a '**' segment
+    matches zero or more directories.
+    """
+    segments = pattern.split('/')
+    parts = []
+    for i, segment in enumerate(segments):
+        last = i == len(segments) - 1
+        if segment == '**':
+            parts.append('.*' if last else '(?:[^/]+/)*')
+            continue
+        j, n = 0, len(segment)
+        while j < n:
+            c = segment[j]
+            j += 1
+            if c == '*':
+                parts.append('[^/]*')
+            elif c == '?':
+                parts.append('[^/]')
+            elif c == '[':
+                start = j + 1 if segment[j:j + 1] == '!' else j
+                k = segment.find(']', start + 1 if segment[start:start + 1] == ']' else start)
+                if k == -1:
+                    parts.append(re.escape(c))
+                    continue
+                body = segment[j:k].replace('\\', '\\\\')
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                parts.append(f'(?!/)[{body}]')
+                j = k + 1
+            else:
+                parts.append(re.escape(c))
+        if not last:
+            parts.append('/')
+    return re.compile(''.join(parts) + r'\Z')
+
+
+def _iter_file_dicts(files: List[Dict[str, str]]) -> Iterator[Tuple[str, str]]:
+    """Yield (path, content) from a list of {"path", "contents"/"content"} dicts."""
+    for file_dict in files:
+        if not isinstance(file_dict, dict):
+            raise ValueError(f"Expected dict in list, got {type(file_dict)}")
+        yield file_dict.get("path", ""), file_dict.get("contents", file_dict.get("content", ""))
+
+
+def _has_magic(segment: str) -> bool:
+    return any(c in segment for c in '*?[')
+
+
+def _extension(name: str) -> str:
+    """Extension used by the glob/find index: from the last '.', or "" if there is none."""
+    i = name.rfind('.')
+    return name[i:] if i != -1 else ""
+
+
+# Content shown for VISIBLE_PATH files
+_PATH_ONLY_CONTENT = "[HIDDEN FILE CONTENTS, DO NOT EDIT]"
+
+# Names DirTree.from_filesystem skips by default (fnmatch patterns)
+DEFAULT_IGNORE = ('.git', '.hg', '.svn', '__pycache__', '*.pyc', '.venv', 'venv',
+                  'node_modules', '.mypy_cache', '.pytest_cache', '.tox', '.DS_Store')
+
+# Bytes sniffed for NUL bytes before a file is decoded
+_BINARY_SNIFF_SIZE = 8192
+
+
+def _write_file(file_obj: File, file_path: str) -> None:
+    """Write a file's content to file_path; lazy files are copied without decoding."""
+    if isinstance(file_obj, LazyFile) and not file_obj.is_loaded:
+        if os.path.abspath(file_obj.disk_path) != os.path.abspath(file_path):
+            shutil.copyfile(file_obj.disk_path, file_path)
+        return
+    with open(file_path, 'w', encoding='utf-8') as f:
+        f.write(file_obj.content)
+
+
+def _file_bytes(file_obj: File) -> bytes:
+    """Encoded content of a file as it would be written to disk."""
+    if isinstance(file_obj, LazyFile) and not file_obj.is_loaded:
+        with open(file_obj.disk_path, 'rb') as f:
+            return f.read()
+    return file_obj.content.encode('utf-8')
+
+
+def _sync_file(file_obj: File, file_path: str) -> bool:
+    """Write a file unless the target already has identical contents.
+    
+    The target is compared by size first and by SHA-256 only when sizes match;
+    the digest of an in-memory file comes from its shared Blob.
+    
+    Returns:
+        True if the file was written, False if it was skipped
+    """
+    data = _file_bytes(file_obj)
+    if isinstance(file_obj, LazyFile) and not file_obj.is_loaded:
+        digest = hashlib.sha256(data).digest()
+    else:
+        digest = file_obj.digest
+    try:
+        st = os.stat(file_path)
+    except FileNotFoundError:
+        st = None
+    
+    unchanged = False
+    if st is not None and st.st_size == len(data):
+        with open(file_path, 'rb') as f:
+            unchanged = hashlib.sha256(f.read()).digest() == digest
+    
+    if not unchanged:
+        with open(file_path, 'wb') as f:
+            f.write(data)
+    
+    # Make .sh files executable
+    if file_path.endswith('.sh'):
+        mode = st.st_mode if st is not None else os.stat(file_path).st_mode
+        if not mode & stat.S_IEXEC:
+            os.chmod(file_path, mode | stat.S_IEXEC)
+    return not unchanged
+
+
+def _read_source(path: str) -> Optional[Tuple[str, bytes]]:
+    """Read a text file for DirTree.from_filesystem.
+    
+    The first bytes are checked for NUL bytes so binary files are rejected
+    without decoding them; anything that is not valid UTF-8 counts as binary.
+    
+    Returns:
+        (content, SHA-256 digest), or None for binary files
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if b'\0' in data[:_BINARY_SNIFF_SIZE]:
+        return None
+    try:
+        content = data.decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+    return content, hashlib.sha256(data).digest()
+
+
+@dataclass
+class StoreResult:
+    """Outcome of DirTree.sync_files."""
     path: str
-    state: State = State.VISIBLE
-    children: Dict[str, 'Node_Dir'] = field(default_factory=dict)
-    files: Dict[str, File] = field(default_factory=dict)
+    written: int = 0
+    skipped: int = 0
+    dirs_created: int = 0
+    written_paths: List[str] = field(default_factory=list)
+    deleted: int = 0
+    deleted_paths: List[str] = field(default_factory=list)
+
+
+@dataclass
+class ChangeSet:
+    """Paths changed since the last store or a named checkpoint."""
+    files: List[str] = field(default_factory=list)
+    dirs: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
 
 
 class DirTree:
@@ -36,29 +708,299 @@ class DirTree:
     
     def __init__(self, root: Optional[Node_Dir] = None):
         """Initialize DirTree with optional root node."""
+        # Dirty tracking: every mutation gets a sequence number, checkpoints
+        # remember the sequence number they were taken at
+        self._seq = 0
+        self._changes: Dict[int, Tuple[int, Union[File, Node_Dir]]] = {}
+        self._removed: Dict[str, int] = {}
+        # Paths vacated by move or remove; a moved directory's old contents are
+        # only recorded through its path
+        self._unlinked: Dict[str, int] = {}
+        self._checkpoints: Dict[str, int] = {}
+        self._stored_seq = 0
+        # Optional full-text index, see enable_text_index
+        self._text_index: Optional['TextIndex'] = None
+        # Structural version, bumped when a directory is moved or removed; the
+        # path index is exact while it equals _index_version
+        self._version = 0
+        self._index_version = 0
+        
         if root is None:
             self.root = Node_Dir(path="", state=State.VISIBLE)
         else:
             self.root = root
     
-    def add_file(self, filepath: str, content: str = "", state: State = State.VISIBLE) -> None:
-        """Add a file to the tree at the given path."""
+    @property
+    def root(self) -> Node_Dir:
+        """Root directory node of the tree."""
+        return self._root
+    
+    @root.setter
+    def root(self, node: Node_Dir) -> None:
+        # Replacing the root removes every old path and dirties the new tree
+        old = getattr(self, '_root', None)
+        if old is not None:
+            old._owner = None
+            self._seq += 1
+            for path, _, _ in self._walk(old):
+                if path:
+                    self._removed[path] = self._seq
+            self._changes.clear()
+        
+        # Rebuild the path index from the new nodes
+        self._root = node
+        node._owner = self
+        self._dirs: Dict[str, Node_Dir] = {}
+        self._files: Dict[str, File] = {}
+        # Paths checked against the tree at a version, used once the index is not exact;
+        # kept per index since a file and a directory may have the same path
+        self._verified_dirs: Dict[str, int] = {}
+        self._verified_files: Dict[str, int] = {}
+        self._index_version = self._version
+        # Secondary file indexes for glob/find: extension and basename ->
+        # {id: (path, file, version the path was last checked at)}
+        self._by_ext: Dict[str, Dict[int, Tuple[str, File, int]]] = {}
+        self._by_name: Dict[str, Dict[int, Tuple[str, File, int]]] = {}
+        if self._text_index is not None:
+            self._text_index.clear()
+        self._index_subtree(node)
+        self._mark_dirty(node)
+    
+    def _mark_dirty(self, obj: Union[File, Node_Dir]) -> None:
+        """Record that a file or directory changed (called from Node_Dir._changed)."""
+        self._seq += 1
+        self._changes[id(obj)] = (self._seq, obj)
+        if self._text_index is not None and isinstance(obj, File):
+            self._text_index.add(obj)
+    
+    def _index_subtree(self, node: Node_Dir) -> None:
+        """Register a directory and everything below it in the path index."""
+        for path, obj, _ in self._walk(node):
+            if isinstance(obj, File):
+                self._register_file(path, obj)
+            else:
+                self._register_dir(path, obj)
+    
+    def _register_dir(self, path: str, node: Node_Dir) -> None:
+        """Add a directory to the path index."""
+        self._dirs[path] = node
+        if self._version != self._index_version:
+            self._verified_dirs[path] = self._version
+    
+    def _register_file(self, path: str, file_obj: File) -> None:
+        """Add a file to the path index and the extension and basename indexes."""
+        self._files[path] = file_obj
+        if self._version != self._index_version:
+            self._verified_files[path] = self._version
+        name = file_obj._name
+        entry = (path, file_obj, self._version)
+        self._by_ext.setdefault(_extension(name), {})[id(file_obj)] = entry
+        self._by_name.setdefault(name, {})[id(file_obj)] = entry
+        if self._text_index is not None:
+            self._text_index.add(file_obj)
+    
+    def _unregister_file(self, path: str, file_obj: File) -> None:
+        """Remove a file from the path, extension and basename indexes."""
+        if self._files.get(path) is file_obj:
+            del self._files[path]
+            self._verified_files.pop(path, None)
+        name = file_obj._name
+        for index, key in ((self._by_ext, _extension(name)), (self._by_name, name)):
+            bucket = index.get(key)
+            if bucket is not None and bucket.pop(id(file_obj), None) is not None and not bucket:
+                del index[key]
+        if self._text_index is not None:
+            self._text_index.remove(file_obj)
+    
+    def _new_dir(self, parent: Node_Dir, name: str, state: State) -> Node_Dir:
+        """Create a child directory under parent and register it in the index."""
+        node = Node_Dir(path=name, state=state)
+        parent._attach_dir(name, node)
+        self._register_dir(node.path, node)
+        return node
+    
+    def _put_file(self, parent: Node_Dir, name: str, file_obj: File) -> None:
+        """Insert or replace a file under parent and keep the index in sync."""
+        old = parent.files.get(name)
+        if old is not None:
+            self._changes.pop(id(old), None)
+            self._unregister_file(old.path, old)
+        parent._attach_file(name, file_obj)
+        self._register_file(file_obj.path, file_obj)
+    
+    def _find_dir(self, dirpath: str) -> Optional[Node_Dir]:
+        """Look up a directory by path in O(1), ignoring empty segments."""
+        key = '/'.join(p for p in dirpath.split('/') if p != "")
+        if not key:
+            return self.root
+        node = self._dirs.get(key)
+        if self._version == self._index_version or self._verified_dirs.get(key) == self._version:
+            return node
+        return self._revalidate(self._dirs, self._verified_dirs, key, node, lambda: self._navigate(key))
+    
+    def _find_file(self, path: str) -> Optional[File]:
+        """Look up a file by its exact path in O(1)."""
+        file_obj = self._files.get(path)
+        if self._version == self._index_version or self._verified_files.get(path) == self._version:
+            return file_obj
+        
+        def navigate() -> Optional[File]:
+            dir_path, _, name = path.rpartition('/')
+            parent = self._find_dir(dir_path)
+            return parent.files.get(name) if parent is not None else None
+        return self._revalidate(self._files, self._verified_files, path, file_obj, navigate)
+    
+    def _revalidate(self, index: Dict, verified: Dict[str, int], key: str, obj,
+                    navigate: Callable[[], object]):
+        """Check an index entry after directories were moved or removed.
+        
+        A stale entry (its node now lives elsewhere or was removed) is replaced
+        by walking the names from the root, and the result is cached for the
+        current version, so each path is checked once per structural change.
+        """
+        if obj is None or self._owned_path(obj) != key:
+            obj = navigate()
+        if obj is None:
+            index.pop(key, None)
+            verified.pop(key, None)
+        else:
+            index[key] = obj
+            verified[key] = self._version
+        return obj
+    
+    def _navigate(self, key: str) -> Optional[Node_Dir]:
+        """Find a directory by following the names of key from the root."""
+        node = self.root
+        for part in key.split('/') if key else ():
+            node = node.children.get(part)
+            if node is None:
+                return None
+        return node
+    
+    def walk(self, order: str = "pre", filter: Optional[Union[State, Iterable[State]]] = None,
+             dir: Optional[str] = None,
+             view: Optional['VisibilityView'] = None) -> Iterator[Tuple[str, Union[Node_Dir, File]]]:
+        """Iterate over the directories and files of the tree without recursion.
+        
+        Args:
+            order: "pre" yields a directory before its files and subdirectories,
+                   "post" yields it after them
+            filter: Optional state or states to include. Entries in any other
+                    state are skipped, and so is everything below a skipped directory
+            dir: Optional directory path to start from (default: root)
+            view: Optional VisibilityView whose overrides decide the states
+            
+        Yields:
+            (path, node) pairs where node is a Node_Dir or a File
+            
+        Raises:
+            ValueError: If order is not "pre"/"post" or the directory does not exist
+        """
+        if order not in ("pre", "post"):
+            raise ValueError(f"Expected order 'pre' or 'post', got '{order}'")
+        start = self.root if dir is None else self._find_dir(dir)
+        if start is None:
+            raise ValueError(f"Directory path '{dir}' does not exist")
+        if isinstance(filter, State):
+            filter = (filter,)
+        states = frozenset(filter) if filter is not None else None
+        return ((path, obj) for path, obj, _ in self._walk(start, order, states, view))
+    
+    def _walk(self, start: Node_Dir, order: str = "pre", states: Optional[frozenset] = None,
+              view: Optional['VisibilityView'] = None) -> Iterator[Tuple[str, Union[Node_Dir, File], State]]:
+        """Explicit-stack traversal behind walk and the other whole-tree operations.
+        
+        Paths are built incrementally from the parent path, so each entry costs
+        O(1) instead of walking up the parent chain.
+        
+        Yields:
+            (path, node, state) where state is the node's own state, or its
+            effective state under view when one is given
+        """
+        own = view._own if view is not None else None
+        subtree = view._subtree if view is not None else None
+        start_path = _tree_path(start)
+        inherited = view._inherited_state(start_path) if view is not None else None
+        
+        # Stack entries are (path, node, expanded, inherited, state); post order
+        # revisits expanded dirs, inherited is the nearest subtree override above
+        stack = [(start_path, start, False, inherited, None)]
+        while stack:
+            path, node, expanded, inherited, state = stack.pop()
+            if expanded:
+                yield path, node, state
+                continue
+            
+            if view is None:
+                state = node.state
+            else:
+                override = subtree.get(path)
+                if override is not None:
+                    inherited = override
+                state = own.get(path, inherited or node.state)
+            if states is not None and state not in states:
+                continue
+            
+            if order == "pre":
+                yield path, node, state
+            else:
+                stack.append((path, node, True, inherited, state))
+            
+            prefix = path + '/' if path else ""
+            for filename, file_obj in node.files.items():
+                file_path = prefix + filename
+                if view is None:
+                    file_state = file_obj.state
+                else:
+                    file_state = own.get(file_path, inherited or file_obj.state)
+                if states is None or file_state in states:
+                    yield file_path, file_obj, file_state
+            
+            # Children pushed in reverse so they are visited in insertion order
+            for name, child_dir in reversed(node.children.items()):
+                stack.append((prefix + name, child_dir, False, inherited, None))
+    
+    def _parent_for(self, filepath: str) -> tuple:
+        """Find or create the directory for filepath, returning (node, filename)."""
         parts = filepath.split('/')
         filename = parts[-1]
         dir_parts = parts[:-1] if len(parts) > 1 else []
         
-        # Navigate to or create the directory
-        current = self.root
-        for dir_name in dir_parts:
-            if dir_name == "":
-                continue
-            if dir_name not in current.children:
-                dir_path = '/'.join([current.path, dir_name]).lstrip('/')
-                current.children[dir_name] = Node_Dir(path=dir_path, state=State.VISIBLE)
-            current = current.children[dir_name]
+        # Look up the parent directory, creating missing ones on the way
+        current = self._find_dir('/'.join(dir_parts))
+        if current is None:
+            current = self.root
+            for dir_name in dir_parts:
+                if dir_name == "":
+                    continue
+                if dir_name not in current.children:
+                    self._new_dir(current, dir_name, State.VISIBLE)
+                current = current.children[dir_name]
+        return current, filename
+    
+    def _insert_file(self, filepath: str, file_obj: File) -> None:
+        """Insert or replace file_obj at filepath, creating missing parent directories."""
+        current, filename = self._parent_for(filepath)
+        self._put_file(current, filename, file_obj)
+    
+    def add_file(self, filepath: str, content: str = "", state: State = State.VISIBLE) -> None:
+        """Add a file to the tree at the given path."""
+        self._insert_file(filepath, File(path=filepath, content=content, state=state))
+    
+    def add_lazy_file(self, filepath: str, disk_path: str, state: State = State.VISIBLE) -> LazyFile:
+        """Add a file whose content is read from disk_path only when needed.
         
-        # Add the file
-        current.files[filename] = File(path=filepath, content=content, state=state)
+        Args:
+            filepath: Path of the file in the tree
+            disk_path: Path of the file on disk (size and mtime are recorded now)
+            state: State of the file (default: VISIBLE)
+            
+        Returns:
+            The created LazyFile
+        """
+        lazy = LazyFile(path=filepath, disk_path=disk_path, state=state)
+        self._insert_file(filepath, lazy)
+        return lazy
     
     def add_dir(self, name: str, state: State = State.VISIBLE, dir: Optional[str] = None) -> None:
         """Add an empty directory to the tree.
@@ -74,18 +1016,108 @@ class DirTree:
             dir_parts = [p for p in dir.split('/') if p != ""]
             for dir_name in dir_parts:
                 if dir_name not in current.children:
-                    dir_path = '/'.join([current.path, dir_name]).lstrip('/')
-                    current.children[dir_name] = Node_Dir(path=dir_path, state=State.VISIBLE)
+                    self._new_dir(current, dir_name, State.VISIBLE)
                 current = current.children[dir_name]
         
         # Add the new directory
         parts = [p for p in name.split('/') if p != ""]
         for dir_name in parts:
             if dir_name not in current.children:
-                dir_path = '/'.join([current.path, dir_name]).lstrip('/')
-                current.children[dir_name] = Node_Dir(path=dir_path, state=state)
+                self._new_dir(current, dir_name, state)
             current = current.children[dir_name]
     
+    def _find_entry(self, path: str) -> Union[File, Node_Dir]:
+        """Resolve a file or non-root directory path for move, rename and remove.
+        
+        Raises:
+            ValueError: If the path does not exist or is the root
+        """
+        obj = self._find_file(path)
+        if obj is None:
+            obj = self._find_dir(path)
+            if obj is self.root:
+                raise ValueError("Cannot move or remove the root directory")
+            if obj is None:
+                raise ValueError(f"Path '{path}' does not exist")
+        return obj
+    
+    def move(self, src: str, dst: str) -> None:
+        """Move a file or directory to a new path.
+        
+        Nodes only store their name relative to the parent, so this relinks one
+        node whatever the size of a moved directory. The path index is not
+        rewritten: entries below the moved directory are checked and re-resolved
+        when they are next looked up. Missing parent directories of dst are
+        created. For get_changes and flush the move is a removal of src and an
+        addition of dst.
+        
+        Args:
+            src: Path of the file or directory to move
+            dst: New full path
+            
+        Raises:
+            ValueError: If src does not exist or is the root, dst already exists,
+                        or dst is inside the moved directory
+        """
+        obj = self._find_entry(src)
+        key = '/'.join(p for p in dst.split('/') if p != "")
+        if not key or self._find_file(key) is not None or self._find_dir(key) is not None:
+            raise ValueError(f"Path '{dst}' already exists")
+        old_path = obj.path
+        if isinstance(obj, Node_Dir) and key.startswith(old_path + '/'):
+            raise ValueError(f"Cannot move '{src}' inside itself")
+        
+        obj.parent._detach(obj)
+        self._seq += 1
+        self._removed[old_path] = self._unlinked[old_path] = self._seq
+        if isinstance(obj, File):
+            self._unregister_file(old_path, obj)
+            parent, name = self._parent_for(key)
+            parent._attach_file(name, obj)
+            self._register_file(obj.path, obj)
+        else:
+            self._dirs.pop(old_path, None)
+            self._verified_dirs.pop(old_path, None)
+            self._version += 1
+            parent, name = self._parent_for(key)
+            parent._attach_dir(name, obj)
+            self._register_dir(obj.path, obj)
+    
+    def rename(self, path: str, new_name: str) -> None:
+        """Rename a file or directory in place, see move.
+        
+        Raises:
+            ValueError: If the path does not exist, new_name contains '/' or is taken
+        """
+        if not new_name or '/' in new_name:
+            raise ValueError(f"Invalid name '{new_name}'")
+        parent_path = _tree_path(self._find_entry(path).parent)
+        self.move(path, parent_path + '/' + new_name if parent_path else new_name)
+    
+    def remove(self, path: str) -> None:
+        """Remove a file or a directory with everything below it.
+        
+        Like move, this unlinks one node; index entries below a removed
+        directory are dropped when they are next met.
+        
+        Raises:
+            ValueError: If the path does not exist or is the root
+        """
+        obj = self._find_entry(path)
+        old_path = obj.path
+        obj.parent._detach(obj)
+        self._seq += 1
+        self._removed[old_path] = self._unlinked[old_path] = self._seq
+        self._changes.pop(id(obj), None)
+        if isinstance(obj, File):
+            self._unregister_file(old_path, obj)
+        else:
+            self._dirs.pop(old_path, None)
+            self._verified_dirs.pop(old_path, None)
+            self._version += 1
+            if self._text_index is not None:
+                self._text_index.remove_dir(obj)
+    
     def _count_words_in_file(self, file: File) -> int:
         """Count words in a file's content.
         
@@ -95,14 +1127,13 @@ class DirTree:
         Returns:
             Number of words in the file content
         """
-        if not file.content:
-            return 0
-        # Split by whitespace and count non-empty strings
-        words = file.content.split()
-        return len(words)
+        return file.stats.words
     
     def _count_words_in_dir(self, node: Node_Dir) -> int:
-        """Recursively count words in all files within a directory.
+        """Count words in all files within a directory.
+        
+        Uses the cached aggregate of the directory, so repeated calls on the
+        same subtree are O(1) until a file below it changes.
         
         Args:
             node: Directory node to count words in
@@ -110,17 +1141,145 @@ class DirTree:
         Returns:
             Total word count of all files in the directory and subdirectories
         """
-        total_words = 0
+        return node.stats.words
+    
+    def get_stats(self, dirpath: str = "") -> Stats:
+        """Get the aggregate counters (words, bytes, lines, files) of a directory.
         
-        # Count words in files in this directory
-        for file_obj in node.files.values():
-            total_words += self._count_words_in_file(file_obj)
+        Args:
+            dirpath: Path of the directory (default: root)
+            
+        Returns:
+            Stats for the directory and all its subdirectories
+            
+        Raises:
+            ValueError: If the directory path does not exist
+        """
+        node = self._find_dir(dirpath)
+        if node is None:
+            raise ValueError(f"Directory path '{dirpath}' does not exist")
+        return node.stats
+    
+    def diff(self, other: 'DirTree') -> 'TreeDiff':
+        """Compute the file changes turning this tree into other.
         
-        # Recursively count words in subdirectories
-        for child_dir in node.children.values():
-            total_words += self._count_words_in_dir(child_dir)
+        Subtrees with equal Merkle hashes are skipped, so the cost follows the
+        size of the change. File states are not compared.
         
-        return total_words
+        Args:
+            other: The newer tree (e.g. the tree built from an LLM response)
+            
+        Returns:
+            TreeDiff with added and removed file paths and line hunks per modified file
+        """
+        from .dir_tree_diff import diff_trees
+        return diff_trees(self, other)
+    
+    @staticmethod
+    def merge(base: 'DirTree', ours: 'DirTree', theirs: 'DirTree') -> 'MergeResult':
+        """Three-way merge of two trees derived from base.
+        
+        Subtrees changed on one side only are taken whole from that side,
+        skipping unchanged subtrees via their hashes. Files changed on both
+        sides are merged line by line; overlapping edits are written with
+        <<<<<<< ours / ======= / >>>>>>> theirs markers and reported as
+        conflicts, as are files deleted on one side and modified on the other
+        (the modified file is kept). When both sides change a state, ours wins.
+        
+        Args:
+            base: Common ancestor
+            ours: Our version (e.g. the current tree)
+            theirs: Their version (e.g. the tree the model produced)
+            
+        Returns:
+            MergeResult with the merged tree (sharing contents with the inputs)
+            and the conflicting paths
+        """
+        from .dir_tree_diff import merge_trees
+        return merge_trees(base, ours, theirs)
+    
+    def get_digest(self, dirpath: str = "") -> bytes:
+        """Get the cached Merkle hash of a directory subtree.
+        
+        Args:
+            dirpath: Path of the directory (default: root)
+            
+        Returns:
+            SHA-256 over the states, names and contents below the directory
+            
+        Raises:
+            ValueError: If the directory path does not exist
+        """
+        node = self._find_dir(dirpath)
+        if node is None:
+            raise ValueError(f"Directory path '{dirpath}' does not exist")
+        return node.digest
+    
+    def compare(self, other: 'DirTree') -> ChangeSet:
+        """List the paths that differ from other, descending only into subtrees whose hashes differ.
+        
+        Args:
+            other: Tree to compare against (e.g. the previous version)
+            
+        Returns:
+            ChangeSet where files are new or changed (content or state) file
+            paths, dirs are new directories or directories whose own state
+            changed, and removed are the paths that only exist in other
+        """
+        changes = ChangeSet()
+        
+        def collect(node: Node_Dir, files: List[str], dirs: List[str], path: str) -> None:
+            for entry_path, obj, _ in self._walk(node):
+                entry_path = path + entry_path[len(_tree_path(node)):]
+                (files if isinstance(obj, File) else dirs).append(entry_path)
+        
+        stack = [("", self.root, other.root)]
+        while stack:
+            path, ours, theirs = stack.pop()
+            if ours.digest == theirs.digest:
+                continue
+            if ours.state != theirs.state:
+                changes.dirs.append(path)
+            prefix = path + '/' if path else ""
+            for name, file_obj in ours.files.items():
+                old = theirs.files.get(name)
+                if old is None or old.state != file_obj.state or old.digest != file_obj.digest:
+                    changes.files.append(prefix + name)
+            changes.removed.extend(prefix + name for name in theirs.files if name not in ours.files)
+            for name, child in ours.children.items():
+                old_child = theirs.children.get(name)
+                if old_child is None:
+                    collect(child, changes.files, changes.dirs, prefix + name)
+                else:
+                    stack.append((prefix + name, child, old_child))
+            for name, old_child in theirs.children.items():
+                if name not in ours.children:
+                    collect(old_child, changes.removed, changes.removed, prefix + name)
+        changes.files.sort()
+        changes.dirs.sort()
+        changes.removed.sort()
+        return changes
+    
+    @property
+    def content_store(self) -> ContentStore:
+        """Content-addressed store holding the contents of the tree's files."""
+        return content_store
+    
+    def count_unique_contents(self, dirpath: str = "") -> int:
+        """Count the distinct file contents below a directory.
+        
+        Files with equal content share one Blob, so this is the number of
+        contents actually held in memory for the subtree (lazy files that were
+        never assigned are not counted).
+        
+        Raises:
+            ValueError: If the directory path does not exist
+        """
+        node = self._find_dir(dirpath)
+        if node is None:
+            raise ValueError(f"Directory path '{dirpath}' does not exist")
+        return len({id(obj._blob) for _, obj, _ in self._walk(node)
+                    if isinstance(obj, File) and obj._blob is not None})
     
     def _get_state_abbreviation(self, state: State) -> str:
         """Get state abbreviation for printing.
@@ -140,87 +1299,111 @@ class DirTree:
         else:
             return "?"
     
-    def _print_node(self, node: Node_Dir, prefix: str = "", is_last: bool = True, 
-                   words: bool = False, contents: bool = False, state: bool = False) -> None:
-        """Recursively print a node and its children.
+    def _format_entry(self, obj: Union[File, Node_Dir], name: str, words: bool,
+                      contents: bool, state: bool) -> str:
+        """Format the text of one tree entry (without prefix and connector).
         
         Args:
-            node: Directory node to print
-            prefix: Prefix string for tree structure
-            is_last: Whether this is the last item in its parent
-            words: If True, print word count before file/directory names
-            contents: If True, print file contents after file names
-            state: If True, print state abbreviation before file/directory names
+            obj: File or directory node
+            name: Name to display
+            words: If True, add word count before the name
+            contents: If True, add file contents after file names
+            state: If True, add state abbreviation before the name
         """
-        # Print current directory (skip root if path is empty)
-        if node.path != "":
-            connector = "└── " if is_last else "├── "
-            dir_name = node.path.split('/')[-1] if node.path else '.'
-            
-            # Build prefix components
-            prefix_parts = []
-            
-            # Add state if requested
-            if state:
-                state_abbr = self._get_state_abbreviation(node.state)
-                prefix_parts.append(f"({state_abbr})")
-            
-            # Add word count if requested
-            if words:
-                word_count = self._count_words_in_dir(node)
-                prefix_parts.append(f"({word_count})")
-            
-            # Combine prefix parts
-            item_prefix = " ".join(prefix_parts) + " " if prefix_parts else ""
+        # Build prefix components
+        prefix_parts = []
+        
+        # Add state if requested
+        if state:
+            prefix_parts.append(f"({self._get_state_abbreviation(obj.state)})")
+        
+        # Add word count if requested (cached aggregate for directories)
+        if words:
+            prefix_parts.append(f"({obj.stats.words})")
+        
+        # Combine prefix parts
+        item_prefix = " ".join(prefix_parts) + " " if prefix_parts else ""
+        
+        if isinstance(obj, Node_Dir):
+            return f"{item_prefix}{name}/"
+        
+        # Add content if requested
+        content_suffix = f', content="{obj.content}"' if contents else ""
+        return f"{item_prefix}{name}{content_suffix}"
+    
+    def _iter_entries(self, node: Node_Dir, max_entries: Optional[int]) -> Iterator[tuple]:
+        """Yield (kind, name, obj, is_last) for the sorted files, then directories, of node.
+        
+        Directories with more than max_entries entries are collapsed: after the
+        first max_entries a single ("more", count, None, True) entry is yielded.
+        """
+        file_names = sorted(node.files)
+        dir_names = sorted(node.children)
+        total = len(file_names) + len(dir_names)
+        shown = total if max_entries is None or total <= max_entries else max_entries
+        
+        for i, name in enumerate(file_names[:shown]):
+            yield 'file', name, node.files[name], i == total - 1
+        for i, name in enumerate(dir_names[:max(0, shown - len(file_names))], len(file_names)):
+            yield 'dir', name, node.children[name], i == total - 1
+        if shown < total:
+            yield 'more', total - shown, None, True
+    
+    def iter_dir_tree(self, words: bool = False, contents: bool = False, state: bool = False,
+                      max_depth: Optional[int] = None, max_entries: Optional[int] = None) -> Iterator[str]:
+        """Yield the lines of the directory tree drawn with ├──, │, └──.
+        
+        Uses an explicit stack, so rendering does not recurse and lines are
+        produced one at a time.
+        
+        Args:
+            words: If True, add word count before file/directory names (default: False)
+            contents: If True, add file contents after file names (default: False)
+            state: If True, add state abbreviation before file/directory names (default: False)
+            max_depth: If set, directories deeper than this are collapsed into a
+                       "... (N files)" line (top level entries are depth 1)
+            max_entries: If set, only the first max_entries entries of a directory
+                         are listed, followed by a "... (N more entries)" line
+        """
+        if self.root.path == "" and not self.root.children and not self.root.files:
+            yield "(empty tree)"
+            return
+        
+        # Root node is only printed if it has a path
+        prefix = ""
+        if self.root.path != "":
+            yield "└── " + self._format_entry(self.root, self.root.name.split('/')[-1], words, contents, state)
+            prefix = "    "
+        
+        stack = [(self._iter_entries(self.root, max_entries), prefix, 1)]
+        while stack:
+            entries, prefix, depth = stack[-1]
+            entry = next(entries, None)
+            if entry is None:
+                stack.pop()
+                continue
             
-            print(f"{prefix}{connector}{item_prefix}{dir_name}/")
-            prefix_update = "    " if is_last else "│   "
-        else:
-            # Root node - don't print it, but use empty prefix for children
-            prefix_update = ""
-        
-        # Collect all items (files and directories)
-        file_items = sorted(node.files.items())
-        dir_items = sorted(node.children.items())
-        
-        all_items = []
-        for name, file_obj in file_items:
-            all_items.append(('file', name, file_obj))
-        for name, dir_obj in dir_items:
-            all_items.append(('dir', name, dir_obj))
-        
-        # Print all items
-        for i, (item_type, name, obj) in enumerate(all_items):
-            is_last_item = (i == len(all_items) - 1)
-            if item_type == 'file':
-                connector = "└── " if is_last_item else "├── "
-                
-                # Build prefix components
-                prefix_parts = []
-                
-                # Add state if requested
-                if state:
-                    state_abbr = self._get_state_abbreviation(obj.state)
-                    prefix_parts.append(f"({state_abbr})")
-                
-                # Add word count if requested
-                if words:
-                    word_count = self._count_words_in_file(obj)
-                    prefix_parts.append(f"({word_count})")
-                
-                # Combine prefix parts
-                item_prefix = " ".join(prefix_parts) + " " if prefix_parts else ""
-                
-                # Add content if requested
-                content_suffix = ""
-                if contents:
-                    content_suffix = f', content="{obj.content}"'
-                
-                print(f"{prefix}{prefix_update}{connector}{item_prefix}{name}{content_suffix}")
+            kind, name, obj, is_last = entry
+            connector = "└── " if is_last else "├── "
+            if kind == 'more':
+                yield f"{prefix}{connector}... ({name} more entries)"
             else:
-                # Directory - recurse
-                new_prefix = prefix + prefix_update
-                self._print_node(obj, new_prefix, is_last_item, words, contents, state)
+                yield prefix + connector + self._format_entry(obj, name, words, contents, state)
+                if kind == 'dir':
+                    child_prefix = prefix + ("    " if is_last else "│   ")
+                    if max_depth is not None and depth >= max_depth:
+                        if obj.files or obj.children:
+                            yield f"{child_prefix}└── ... ({obj.stats.files} files)"
+                    else:
+                        stack.append((self._iter_entries(obj, max_entries), child_prefix, depth + 1))
+    
+    def write_dir_tree(self, stream: TextIO, **kwargs) -> None:
+        """Write the directory tree to a text stream, see iter_dir_tree for options."""
+        stream.writelines(line + "\n" for line in self.iter_dir_tree(**kwargs))
+    
+    def render_dir_tree(self, **kwargs) -> str:
+        """Return the directory tree as a string, see iter_dir_tree for options."""
+        return "\n".join(self.iter_dir_tree(**kwargs))
     
     def print_dir_tree(self, words: bool = False, contents: bool = False, state: bool = False) -> None:
         """Print the directory tree with tree structure using ├──, │, └──.
@@ -232,11 +1415,7 @@ class DirTree:
                    V = visible, H = hidden
         """
         print()
-        if self.root.path == "" and not self.root.children and not self.root.files:
-            print("(empty tree)")
-            return
-        
-        self._print_node(self.root, "", True, words, contents, state)
+        self.write_dir_tree(sys.stdout, words=words, contents=contents, state=state)
     
     def json_to_tree(self, files: Union[List[Dict[str, str]], Dict[str, str]], dir: Optional[str] = None) -> Node_Dir:
         """Create tree from JSON list of files or dictionary of files and return root node.
@@ -246,95 +1425,370 @@ class DirTree:
                 - List[Dict[str, str]]: List of dicts with "path" and "contents"/"content" keys
                 - Dict[str, str]: Dictionary mapping file paths to file contents
             dir: Optional directory location inside which to add all files
+            
+        Raises:
+            ValueError: If files is not a dict or a list of dicts, or a path or
+                        content is not a string
         """
         self.root = Node_Dir(path="", state=State.VISIBLE)
+        self._add_files(self._iter_json_files(files, dir))
+        return self.root
+    
+    @classmethod
+    def from_filesystem(cls, root: str, ignore: Iterable[str] = DEFAULT_IGNORE,
+                        max_file_size: int = 1_000_000, max_workers: int = 8) -> 'DirTree':
+        """Build a tree from a directory on disk.
+        
+        Directories are listed with os.scandir and ignored directories are not
+        descended into. Text files are read and decoded in a thread pool and the
+        nodes are linked directly, then indexed once. Binary files and files
+        larger than max_file_size are added as LazyFile nodes in VISIBLE_PATH
+        state: their path is shown but their content is never loaded. Symlinks
+        (to files or directories) are not followed and unreadable files are skipped.
+        
+        Args:
+            root: Directory to import; paths in the tree are relative to it
+            ignore: fnmatch patterns matched against file and directory names
+                    (default: DEFAULT_IGNORE)
+            max_file_size: Largest file size in bytes whose content is loaded
+            max_workers: Maximum number of reader threads (default: 8)
+            
+        Returns:
+            New DirTree
+            
+        Raises:
+            ValueError: If root is not a directory
+        """
+        if not os.path.isdir(root):
+            raise ValueError(f"Path is not a directory: {root}")
+        patterns = tuple(ignore)
+        
+        def ignored(name: str) -> bool:
+            return any(fnmatch.fnmatch(name, pattern) for pattern in patterns)
+        
+        root_node = Node_Dir(path="", state=State.VISIBLE)
+        pending: List[Tuple[Node_Dir, str, os.DirEntry]] = []
+        stack = [(root, root_node)]
+        while stack:
+            disk_dir, node = stack.pop()
+            try:
+                with os.scandir(disk_dir) as it:
+                    entries = sorted(it, key=lambda entry: entry.name)
+            except OSError:
+                continue
+            for entry in entries:
+                if ignored(entry.name):
+                    continue
+                name = sys.intern(entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    child = Node_Dir(path=name, state=State.VISIBLE)
+                    child.parent = node
+                    node.children[name] = child
+                    stack.append((entry.path, child))
+                elif entry.is_file(follow_symlinks=False):
+                    pending.append((node, name, entry))
+        
+        def read(entry: os.DirEntry):
+            try:
+                st = entry.stat()
+                if st.st_size > max_file_size:
+                    return st, None
+                return st, _read_source(entry.path)
+            except OSError:
+                return None, None
+        
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+            results = list(pool.map(read, (entry for _, _, entry in pending)))
+        
+        for (node, name, entry), (st, source) in zip(pending, results):
+            if st is None:
+                continue
+            if source is None:
+                file_obj = LazyFile(path=name, disk_path=entry.path, state=State.VISIBLE_PATH,
+                                    size=st.st_size, mtime=st.st_mtime)
+            else:
+                file_obj = File(path=name, content=None)
+                file_obj._blob = content_store.put(*source)
+            file_obj.parent = node
+            node.files[name] = file_obj
+        return cls(root_node)
+    
+    def add_files_to_dir_tree(self, files: Union[List[Dict[str, str]], Dict[str, str]], dir: Optional[str] = None) -> Node_Dir:
+        """Add files to an existing tree without resetting it.
+        
+        Args:
+            files: Either:
+                - List[Dict[str, str]]: List of dicts with "path" and "contents"/"content" keys
+                - Dict[str, str]: Dictionary mapping file paths to file contents
+            dir: Optional directory location inside which to add all files
+                
+        Returns:
+            The root Node_Dir of the tree
+            
+        Raises:
+            ValueError: If files is not a dict or a list of dicts, or a path or
+                        content is not a string
+        """
+        self._add_files(self._iter_json_files(files, dir))
+        return self.root
+    
+    @staticmethod
+    def _iter_json_files(files: Union[List[Dict[str, str]], Dict[str, str]],
+                         dir: Optional[str]) -> Iterator[Tuple[str, str]]:
+        """Yield (full path, content) for the files of a json_to_tree argument.
+        
+        Raises:
+            ValueError: If files is not a dict or a list of dicts, or a path or
+                        content is not a string
+        """
+        if dir is not None:
+            # Remove leading/trailing slashes and join properly
+            dir_clean = dir.strip('/')
+            prefix = dir_clean + '/' if dir_clean else ""
+        
+        # Handle dictionary format (path -> content)
+        if isinstance(files, dict):
+            items = files.items()
+        # Handle list format (list of dicts with "path" and "contents"/"content")
+        elif isinstance(files, list):
+            items = _iter_file_dicts(files)
+        else:
+            raise ValueError(f"Expected list or dict, got {type(files)}")
+        
+        for filepath, content in items:
+            if not isinstance(filepath, str):
+                raise ValueError(f"Expected string path, got {type(filepath)}")
+            if not isinstance(content, str):
+                raise ValueError(f"Expected string contents for '{filepath}', got {type(content)}")
+            yield (filepath if dir is None else prefix + filepath.lstrip('/')), content
+    
+    def _add_files(self, entries: Iterable[Tuple[str, str]]) -> None:
+        """Add (path, content) pairs with the result of one add_file call each, in one pass.
+        
+        Consecutive files in the same directory reuse its node and other
+        parents come from the path index, so paths are not split and walked
+        per file. Files are linked directly, and the cached counters and
+        hashes are dropped once per directory instead of once per file.
+        """
+        touched: Dict[int, Node_Dir] = {}
+        last_dir: Optional[str] = None
+        parent = self.root
+        try:
+            for filepath, content in entries:
+                dir_key, _, name = filepath.rpartition('/')
+                if not name or filepath[:1] == '/' or dir_key[-1:] == '/' or '//' in dir_key:
+                    # Empty segments: let add_file normalize the path
+                    self.add_file(filepath, content)
+                    last_dir = None
+                    continue
+                if dir_key != last_dir:
+                    parent = self._find_dir(dir_key)
+                    if parent is None:
+                        parent, _ = self._parent_for(filepath)
+                    touched[id(parent)] = parent
+                    last_dir = dir_key
+                
+                file_obj = File(path=name, content=content)
+                if file_obj._name in parent.files:
+                    self._put_file(parent, name, file_obj)
+                    continue
+                file_obj.parent = parent
+                parent.files[file_obj._name] = file_obj
+                self._mark_dirty(file_obj)
+                self._register_file(filepath, file_obj)
+        finally:
+            # Ancestors of a directory with dropped caches have dropped caches too
+            for node in touched.values():
+                while node is not None and (node._hash is not None or node._stats is not None):
+                    node._hash = None
+                    node._stats = None
+                    node = node.parent
+    
+    def ingester(self, dir: Optional[str] = None,
+                 on_file: Optional[Callable[[File], None]] = None) -> 'JsonIngester':
+        """Create a JsonIngester adding files from streamed JSON text to this tree.
+        
+        Feed it the response chunks as they arrive; each File is created as soon
+        as its path/contents pair is complete, instead of after the whole
+        response like add_files_to_dir_tree.
+        
+        Args:
+            dir: Optional directory location inside which to add all files
+            on_file: Optional callback called with each File as it is created
+        """
+        from .dir_tree_ingest import JsonIngester
+        return JsonIngester(self, dir, on_file)
+    
+    def ingest_stream(self, chunks: Iterable[str], dir: Optional[str] = None) -> Iterator[File]:
+        """Add files from an iterable of JSON text chunks, yielding each File once complete.
+        
+        Raises:
+            ValueError: If the text is not a supported JSON document or ends early
+        """
+        from .dir_tree_ingest import ingest_stream
+        return ingest_stream(self, chunks, dir)
+    
+    def dir_exists(self, dirpath: str) -> bool:
+        """Check if a directory exists in the tree."""
+        return self._find_dir(dirpath) is not None
+    
+    def dirs_exist(self, dirpaths: List[str]) -> List[bool]:
+        """Check a list of directory paths, returning one bool per path."""
+        return [self._find_dir(dirpath) is not None for dirpath in dirpaths]
+    
+    def glob(self, pattern: str) -> List[str]:
+        """Return the sorted paths of the files matching a glob pattern.
         
-        # Helper function to prepend dir to filepath if dir is provided
-        def get_full_path(filepath: str) -> str:
-            if dir is not None:
-                # Remove leading/trailing slashes and join properly
-                dir_clean = dir.strip('/')
-                filepath_clean = filepath.lstrip('/')
-                if dir_clean:
-                    return '/'.join([dir_clean, filepath_clean])
-                else:
-                    return filepath_clean
-            return filepath
+        '*', '?' and '[...]' match within one path segment, a '**' segment
+        matches any number of directories (e.g. "src/**/*.py", "**/README.md").
+        Patterns ending in a literal name or extension are answered from the
+        basename or extension index; others expand only the directories their
+        segments match, so the cost follows the number of candidates rather
+        than the size of the tree.
         
-        # Handle dictionary format (path -> content)
-        if isinstance(files, dict):
-            for filepath, content in files.items():
-                full_path = get_full_path(filepath)
-                self.add_file(full_path, content)
-        # Handle list format (list of dicts with "path" and "contents"/"content")
-        elif isinstance(files, list):
-            for file_dict in files:
-                if isinstance(file_dict, dict):
-                    filepath = file_dict.get("path", "")
-                    content = file_dict.get("contents", file_dict.get("content", ""))
-                    full_path = get_full_path(filepath)
-                    self.add_file(full_path, content)
-                else:
-                    raise ValueError(f"Expected dict in list, got {type(file_dict)}")
+        Args:
+            pattern: Glob pattern over file paths
+            
+        Returns:
+            Matching file paths, sorted
+        """
+        segments = [p for p in pattern.split('/') if p != ""]
+        if not segments:
+            return []
+        regex = _glob_to_regex('/'.join(segments))
+        last = segments[-1]
+        ext = _extension(last)
+        if not _has_magic(last):
+            candidates = self._by_name.get(last, {})
+        elif ext and not any(c in ext for c in '*?[]'):
+            candidates = self._by_ext.get(ext, {})
         else:
-            raise ValueError(f"Expected list or dict, got {type(files)}")
-        
-        return self.root
+            candidates = None
+        
+        # Directories are expanded from the literal prefix, unless an index
+        # bucket is smaller than the prefix directory (when its size is cached)
+        k = 0
+        while k < len(segments) - 1 and not _has_magic(segments[k]):
+            k += 1
+        start = self._find_dir('/'.join(segments[:k]))
+        if start is None:
+            return []
+        if candidates is not None and (start._stats is None or len(candidates) <= start._stats.files):
+            return sorted(path for path, _ in self._bucket_files(candidates) if regex.match(path))
+        matches = []
+        stack = [(start, _tree_path(start), k)]
+        while stack:
+            node, path, i = stack.pop()
+            prefix = path + '/' if path else ""
+            if '**' in segments[i:]:
+                # Everything below may match: check the subtree against the regex
+                matches.extend(p for p, obj, _ in self._walk(node)
+                               if isinstance(obj, File) and regex.match(p))
+                continue
+            segment = _glob_to_regex(segments[i])
+            if i == len(segments) - 1:
+                matches.extend(prefix + name for name in node.files if segment.match(name))
+                continue
+            for name, child in node.children.items():
+                if segment.match(name):
+                    stack.append((child, prefix + name, i + 1))
+        return sorted(matches)
     
-    def add_files_to_dir_tree(self, files: Union[List[Dict[str, str]], Dict[str, str]], dir: Optional[str] = None) -> Node_Dir:
-        """Add files to an existing tree without resetting it.
+    def _bucket_files(self, bucket: Dict[int, Tuple[str, File, int]]) -> Iterator[Tuple[str, File]]:
+        """Yield (path, file) for the files of an extension or basename bucket.
+        
+        The stored paths are exact until a directory is moved or removed; after
+        that they are refreshed here, and files below a removed directory are
+        dropped, so move and remove do not have to visit the subtree. Each
+        entry records the version it was checked at, so it is resolved again
+        only after the next structural change.
+        """
+        version = self._version
+        if version == self._index_version:
+            for path, file_obj, _ in bucket.values():
+                yield path, file_obj
+            return
+        for key, (path, file_obj, checked) in list(bucket.items()):
+            if checked != version:
+                path = self._owned_path(file_obj)
+                if path is None:
+                    bucket.pop(key, None)
+                    continue
+                bucket[key] = (path, file_obj, version)
+            yield path, file_obj
+    
+    def find(self, predicate: Optional[Callable[[File], bool]] = None, dir: Optional[str] = None,
+             name: Optional[str] = None, ext: Optional[str] = None) -> List[str]:
+        """Return the sorted paths of the files for which predicate is true.
+        
+        name and ext narrow the candidates through the basename and extension
+        indexes before predicate is called, so find(name="setup.py") does not
+        visit the rest of the tree.
         
         Args:
-            files: Either:
-                - List[Dict[str, str]]: List of dicts with "path" and "contents"/"content" keys
-                - Dict[str, str]: Dictionary mapping file paths to file contents
-            dir: Optional directory location inside which to add all files
-                
+            predicate: Optional function of the File (default: every candidate)
+            dir: Optional directory to search below
+            name: Optional exact file name
+            ext: Optional extension, with or without the leading '.'
+            
         Returns:
-            The root Node_Dir of the tree
+            Matching file paths, sorted
+            
+        Raises:
+            ValueError: If the directory path does not exist
         """
-        # Helper function to prepend dir to filepath if dir is provided
-        def get_full_path(filepath: str) -> str:
-            if dir is not None:
-                # Remove leading/trailing slashes and join properly
-                dir_clean = dir.strip('/')
-                filepath_clean = filepath.lstrip('/')
-                if dir_clean:
-                    return '/'.join([dir_clean, filepath_clean])
-                else:
-                    return filepath_clean
-            return filepath
-        
-        # Handle dictionary format (path -> content)
-        if isinstance(files, dict):
-            for filepath, content in files.items():
-                full_path = get_full_path(filepath)
-                self.add_file(full_path, content)
-        # Handle list format (list of dicts with "path" and "contents"/"content")
-        elif isinstance(files, list):
-            for file_dict in files:
-                if isinstance(file_dict, dict):
-                    filepath = file_dict.get("path", "")
-                    content = file_dict.get("contents", file_dict.get("content", ""))
-                    full_path = get_full_path(filepath)
-                    self.add_file(full_path, content)
-                else:
-                    raise ValueError(f"Expected dict in list, got {type(file_dict)}")
+        start = self._start_dir(dir)
+        if ext and not ext.startswith('.'):
+            ext = '.' + ext
+        if name is not None or ext is not None:
+            if name is not None:
+                candidates = self._by_name.get(name, {})
+                if ext is not None and _extension(name) != ext:
+                    candidates = {}
+            else:
+                candidates = self._by_ext.get(ext, {})
+            start_path = _tree_path(start)
+            prefix = start_path + '/' if start_path else ""
+            entries = ((path, file_obj) for path, file_obj in self._bucket_files(candidates)
+                       if path.startswith(prefix))
         else:
-            raise ValueError(f"Expected list or dict, got {type(files)}")
+            entries = ((path, obj) for path, obj, _ in self._walk(start) if isinstance(obj, File))
+        return sorted(path for path, file_obj in entries if predicate is None or predicate(file_obj))
+    
+    @property
+    def text_index(self) -> Optional['TextIndex']:
+        """Full-text index of the file contents, or None until enable_text_index."""
+        return self._text_index
+    
+    def enable_text_index(self) -> 'TextIndex':
+        """Attach an inverted full-text index kept up to date with the files.
         
-        return self.root
+        Returns:
+            The TextIndex (the existing one if already enabled)
+        """
+        if self._text_index is None:
+            from .dir_tree_search import TextIndex
+            self._text_index = TextIndex(self)
+            for _, obj, _ in self._walk(self.root):
+                if isinstance(obj, File):
+                    self._text_index.add(obj)
+        return self._text_index
     
-    def dir_exists(self, dirpath: str) -> bool:
-        """Check if a directory exists in the tree."""
-        parts = [p for p in dirpath.split('/') if p != ""]
+    def search(self, terms: Union[str, Iterable[str]], limit: Optional[int] = None,
+               dir: Optional[str] = None) -> List[Tuple[str, float]]:
+        """Rank files by TF-IDF relevance to the query terms.
         
-        current = self.root
-        for dir_name in parts:
-            if dir_name not in current.children:
-                return False
-            current = current.children[dir_name]
-        return True
+        Enables the text index on first use; see TextIndex.search.
+        
+        Args:
+            terms: Query text or a list of terms (matched case-insensitively)
+            limit: Optional maximum number of results
+            dir: Optional directory path to search below
+            
+        Returns:
+            (path, score) pairs, best first
+        """
+        return self.enable_text_index().search(terms, limit, dir)
     
     def set_dir_to_invisible(self, dirpath: str) -> None:
         """Set a directory to invisible (HIDDEN state)."""
@@ -345,38 +1799,24 @@ class DirTree:
             self.root.state = State.HIDDEN
             return
         
+        node = self._find_dir(dirpath)
+        if node is not None:
+            node.state = State.HIDDEN
+            return
+        
         current = self.root
         for dir_name in parts:
             if dir_name not in current.children:
                 # Directory doesn't exist, create it as invisible
-                dir_path = '/'.join([current.path, dir_name]).lstrip('/')
-                current.children[dir_name] = Node_Dir(path=dir_path, state=State.HIDDEN)
+                self._new_dir(current, dir_name, State.HIDDEN)
                 return
             current = current.children[dir_name]
         
         # Directory exists, set it to invisible
         current.state = State.HIDDEN
     
-    def _generate_file_dict_recursive(self, node: Node_Dir, file_dict: Dict[str, str]) -> None:
-        """Recursively collect files from visible directories."""
-        # Skip if directory is hidden
-        if node.state == State.HIDDEN:
-            return
-        
-        # Add visible files from this directory
-        for filename, file_obj in node.files.items():
-            if file_obj.state != State.HIDDEN:
-                # If file has VISIBLE_PATH state, use placeholder content
-                if file_obj.state == State.VISIBLE_PATH:
-                    file_dict[file_obj.path] = "[HIDDEN FILE CONTENTS, DO NOT EDIT]"
-                else:
-                    file_dict[file_obj.path] = file_obj.content
-        
-        # Recursively process child directories
-        for child_dir in node.children.values():
-            self._generate_file_dict_recursive(child_dir, file_dict)
-    
-    def generate_file_dict(self, dir: Optional[str] = None) -> Dict[str, str]:
+    def generate_file_dict(self, dir: Optional[str] = None,
+                           view: Optional['VisibilityView'] = None) -> Dict[str, str]:
         """Generate a dictionary with files. Does not include files set to HIDDEN, 
         or anything within a dir that's set to HIDDEN.
         
@@ -384,6 +1824,8 @@ class DirTree:
             dir: Optional directory path. If provided, only generates files from this
                  directory and its subdirectories. If None, generates files from the
                  entire tree starting from root.
+            view: Optional VisibilityView; its state overrides are used instead of
+                  the states stored in the tree
                  
         Returns:
             Dictionary mapping file paths to file contents
@@ -392,7 +1834,156 @@ class DirTree:
             ValueError: If the directory path does not exist
         """
         file_dict = {}
+        for path, file_obj, state in self._iter_shown_files(self._start_dir(dir), view):
+            if state == State.VISIBLE_PATH:
+                file_dict[path] = _PATH_ONLY_CONTENT
+            else:
+                file_dict[path] = file_obj.content
+        return file_dict
+    
+    def iter_json(self, format: str = "flat", dir: Optional[str] = None,
+                  view: Optional['VisibilityView'] = None, indent: Optional[int] = None,
+                  ensure_ascii: bool = True) -> Iterator[str]:
+        """Serialize the shown files as JSON, yielding one chunk per entry.
+        
+        Only one file's content is encoded at a time, so no dict of all files
+        or full JSON string is built. The output equals json.dumps with the
+        same indent and ensure_ascii applied to:
+        - "flat": generate_file_dict(dir, view), a path -> content object
+        - "json_dir": the nested {"files": {name: content}, "directories":
+          {name: {...}}} format, starting at dir
+        
+        Args:
+            format: "flat" or "json_dir"
+            dir: Optional directory path to start from (default: root)
+            view: Optional VisibilityView deciding which files are shown
+            indent: Indentation as in json.dumps (default: None, single line)
+            ensure_ascii: Escape non-ASCII characters as in json.dumps
+            
+        Raises:
+            ValueError: If the format is unknown or the directory path does not exist
+        """
+        if format not in ("flat", "json_dir"):
+            raise ValueError(f"Expected format 'flat' or 'json_dir', got '{format}'")
+        start_node = self._start_dir(dir)
+        if format == "flat":
+            return self._iter_json_flat(start_node, view, indent, ensure_ascii)
+        return self._iter_json_dir(start_node, view, indent, ensure_ascii)
+    
+    def write_json(self, stream: TextIO, **kwargs) -> None:
+        """Write the shown files as JSON to a text stream, see iter_json for options."""
+        for chunk in self.iter_json(**kwargs):
+            stream.write(chunk)
+    
+    @staticmethod
+    def _json_layout(indent: Optional[int]) -> tuple:
+        """Newline-and-indent function and item separator matching json.dumps."""
+        if indent is None:
+            return (lambda level: ""), ", "
+        return (lambda level: "\n" + " " * (indent * level)), ","
+    
+    def _iter_json_flat(self, start_node: Node_Dir, view: Optional['VisibilityView'],
+                        indent: Optional[int], ensure_ascii: bool) -> Iterator[str]:
+        newline, sep = self._json_layout(indent)
+        count = 0
+        for path, file_obj, state in self._iter_shown_files(start_node, view):
+            content = _PATH_ONLY_CONTENT if state == State.VISIBLE_PATH else file_obj.content
+            yield (("{" if count == 0 else sep) + newline(1) + json.dumps(path, ensure_ascii=ensure_ascii) +
+                   ": " + json.dumps(content, ensure_ascii=ensure_ascii))
+            count += 1
+        yield "{}" if count == 0 else newline(0) + "}"
+    
+    def _iter_json_dir(self, start_node: Node_Dir, view: Optional['VisibilityView'],
+                       indent: Optional[int], ensure_ascii: bool) -> Iterator[str]:
+        # The preorder walk yields a directory, then its files, then its
+        # subdirectories, so the nesting is rebuilt from the stream of entries.
+        # A directory object at level L has its "files" and "directories"
+        # objects at L + 1 and their entries at L + 2.
+        newline, sep = self._json_layout(indent)
+        
+        def close(level: int, count: int) -> str:
+            return "{}" if count == 0 else newline(level) + "}"
+        
+        stack: List[list] = []          # [path, level, directories emitted] per open dir
+        files: Optional[list] = None    # [level, files emitted] of the open "files" object
+        for path, obj, state in self._walk(start_node, states=_SHOWN_STATES, view=view):
+            if isinstance(obj, File):
+                content = _PATH_ONLY_CONTENT if state == State.VISIBLE_PATH else obj.content
+                yield (("{" if files[1] == 0 else sep) + newline(files[0] + 1) +
+                       json.dumps(obj.name, ensure_ascii=ensure_ascii) + ": " +
+                       json.dumps(content, ensure_ascii=ensure_ascii))
+                files[1] += 1
+                continue
+            
+            if files is not None:
+                yield close(files[0], files[1]) + sep + newline(files[0]) + '"directories": '
+                files = None
+            parent_path = path.rpartition('/')[0]
+            while stack and stack[-1][0] != parent_path:
+                _, level, count = stack.pop()
+                yield close(level + 1, count) + newline(level) + "}"
+            if stack:
+                parent = stack[-1]
+                yield (("{" if parent[2] == 0 else sep) + newline(parent[1] + 2) +
+                       json.dumps(obj.name, ensure_ascii=ensure_ascii) + ": ")
+                parent[2] += 1
+                level = parent[1] + 2
+            else:
+                level = 0
+            yield "{" + newline(level + 1) + '"files": '
+            stack.append([path, level, 0])
+            files = [level + 1, 0]
+        
+        if files is None and not stack:
+            # Hidden start directory
+            yield '{"files": {}, "directories": {}}' if indent is None else \
+                "{" + newline(1) + '"files": {}' + sep + newline(1) + '"directories": {}' + newline(0) + "}"
+            return
+        if files is not None:
+            yield close(files[0], files[1]) + sep + newline(files[0]) + '"directories": '
+        while stack:
+            _, level, count = stack.pop()
+            yield close(level + 1, count) + newline(level) + "}"
+    
+    def generate_budgeted_file_dict(self, budget: int, unit: Union[str, Callable[[str], int]] = "tokens",
+                                    priorities: Optional[Union[Dict[str, float], Callable[[str], float]]] = None,
+                                    dir: Optional[str] = None, view: Optional['VisibilityView'] = None,
+                                    summarize: bool = True) -> 'BudgetedFiles':
+        """Generate a file dictionary whose paths and contents fit a token or byte budget.
+        
+        Files are taken in priority order (tree order for equal priorities).
+        First every file that fits gets its path with the VISIBLE_PATH
+        placeholder, lowest priorities being dropped when even that does not
+        fit. Then the kept files are upgraded to their full content while it
+        fits; otherwise Python files are summarized to their def/class lines,
+        other files are truncated to the lines that fit, or they stay path-only.
+        
+        Args:
+            budget: Maximum total cost of the paths and contents
+            unit: "tokens" (estimated at ~4 characters per token), "bytes" (UTF-8),
+                  or a function returning the cost of a string (e.g. a tokenizer)
+            priorities: Dict of file or directory path to priority (longest match
+                        wins, default 0) or a function of the file path; higher first
+            dir: Optional directory path to start from (default: root)
+            view: Optional VisibilityView deciding which files are shown
+            summarize: Summarize Python files that do not fit before truncating
+            
+        Returns:
+            BudgetedFiles with the file dictionary, the cost used and the paths
+            that were kept in full, summarized, truncated, path-only or dropped
+            
+        Raises:
+            ValueError: If the unit is unknown or the directory path does not exist
+        """
+        from .dir_tree_budget import budget_file_dict
+        return budget_file_dict(self, budget, unit, priorities, dir, view, summarize)
+    
+    def _start_dir(self, dir: Optional[str]) -> Node_Dir:
+        """Resolve the dir argument of generate_file_dict and friends to a node.
         
+        Raises:
+            ValueError: If the directory path does not exist
+        """
         # If dir is provided, navigate to that directory
         if dir is not None:
             parts = [p for p in dir.split('/') if p != ""]
@@ -401,12 +1992,10 @@ class DirTree:
             if not parts:
                 start_node = self.root
             else:
-                # Navigate to the target directory
-                current = self.root
-                for dir_name in parts:
-                    if dir_name not in current.children:
-                        raise ValueError(f"Directory path '{dir}' does not exist")
-                    current = current.children[dir_name]
+                # Look up the target directory in the path index
+                current = self._find_dir(dir)
+                if current is None:
+                    raise ValueError(f"Directory path '{dir}' does not exist")
                 
                 # Verify the path matches exactly
                 if current.path != dir:
@@ -416,36 +2005,46 @@ class DirTree:
         else:
             # No dir specified, start from root
             start_node = self.root
-        
-        self._generate_file_dict_recursive(start_node, file_dict)
-        return file_dict
+        return start_node
     
-    def _print_simple_recursive(self, node: Node_Dir) -> None:
-        """Recursively print attributes of all nodes.
+    def _iter_shown_files(self, start_node: Node_Dir,
+                          view: Optional['VisibilityView'] = None) -> Iterator[Tuple[str, File, State]]:
+        """Yield (path, file, state) for the VISIBLE and VISIBLE_PATH files below start_node.
         
-        Args:
-            node: Directory node to print attributes for
+        Hidden directories are pruned; VISIBLE_PATH files are shown with
+        _PATH_ONLY_CONTENT instead of their content.
         """
-        # Print directory node attributes
-        print(f"Node_Dir: path='{node.path}', state={node.state.value}, "
-              f"num_children={len(node.children)}, num_files={len(node.files)}")
-        
-        # Print file attributes
-        for filename, file_obj in sorted(node.files.items()):
-            print(f"  File: path='{file_obj.path}', state={file_obj.state.value}, "
-                  f"content_length={len(file_obj.content)}")
-        
-        # Recursively print child directories
-        for child_dir in sorted(node.children.values(), key=lambda x: x.path):
-            self._print_simple_recursive(child_dir)
+        for path, obj, state in self._walk(start_node, states=_SHOWN_STATES, view=view):
+            if isinstance(obj, File):
+                yield path, obj, state
     
-    def print_simple(self) -> None:
-        """Print the attributes of each node in the tree."""
+    def iter_simple(self) -> Iterator[str]:
+        """Yield one line with the attributes of each node, in print_simple order."""
         if self.root.path == "" and not self.root.children and not self.root.files:
-            print("(empty tree)")
+            yield "(empty tree)"
             return
         
-        self._print_simple_recursive(self.root)
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            node_path = node.path
+            
+            # Directory node attributes
+            yield (f"Node_Dir: path='{node_path}', state={node.state.value}, "
+                   f"num_children={len(node.children)}, num_files={len(node.files)}")
+            
+            # File attributes
+            prefix = node_path + '/' if node_path else ""
+            for filename, file_obj in sorted(node.files.items()):
+                yield (f"  File: path='{prefix}{filename}', state={file_obj.state.value}, "
+                       f"content_length={len(file_obj.content)}")
+            
+            # Child directories in path order (pushed reversed onto the stack)
+            stack.extend(node.children[name] for name in sorted(node.children, reverse=True))
+    
+    def print_simple(self) -> None:
+        """Print the attributes of each node in the tree."""
+        sys.stdout.writelines(line + "\n" for line in self.iter_simple())
     
     def change_dir_tree_state(self, state: State) -> int:
         """Change the state of the entire dir_tree and all its subdirectories and files.
@@ -459,10 +2058,10 @@ class DirTree:
         Returns:
             Total number of states updated (for both files and dirs)
         """
-        return self._change_dir_state_recursive(self.root, state)
+        return self._change_subtree_state(self.root, state)
     
-    def _change_dir_state_recursive(self, node: Node_Dir, state: State) -> int:
-        """Recursively change the state of a directory and all its subdirectories and files.
+    def _change_subtree_state(self, node: Node_Dir, state: State) -> int:
+        """Change the state of a directory and all its subdirectories and files.
         
         When the state is VISIBLE_PATH, all files in the directory and subdirectories
         will also be set to VISIBLE_PATH state.
@@ -475,20 +2074,9 @@ class DirTree:
             Total number of states updated (directory + all subdirectories + all files)
         """
         count = 0
-        
-        # Change the state of this directory
-        node.state = state
-        count += 1
-        
-        # Change the state of all files in this directory
-        for file_obj in node.files.values():
-            file_obj.state = state
+        for _, obj, _ in self._walk(node):
+            obj.state = state
             count += 1
-        
-        # Recursively change the state of all subdirectories
-        for child_dir in node.children.values():
-            count += self._change_dir_state_recursive(child_dir, state)
-        
         return count
     
     def change_dir_state(self, path: str, state: State) -> int:
@@ -507,25 +2095,28 @@ class DirTree:
         Raises:
             ValueError: If the directory path does not exist
         """
-        parts = [p for p in path.split('/') if p != ""]
+        # Change state recursively
+        return self._change_subtree_state(self._exact_dir(path), state)
+    
+    def _exact_dir(self, path: str) -> Node_Dir:
+        """Resolve the path argument of change_dir_state; an empty path is the root.
         
-        # If empty path, change root state
+        Raises:
+            ValueError: If the directory does not exist or path is not its exact path
+        """
+        parts = [p for p in path.split('/') if p != ""]
         if not parts:
-            return self._change_dir_state_recursive(self.root, state)
+            return self.root
         
-        # Navigate to the target directory
-        current = self.root
-        for dir_name in parts:
-            if dir_name not in current.children:
-                raise ValueError(f"Directory path '{path}' does not exist")
-            current = current.children[dir_name]
+        # Look up the target directory in the path index
+        current = self._find_dir(path)
+        if current is None:
+            raise ValueError(f"Directory path '{path}' does not exist")
         
         # Verify the path matches exactly
         if current.path != path:
             raise ValueError(f"Directory path '{path}' does not match exactly. Found path: '{current.path}'")
-        
-        # Change state recursively
-        return self._change_dir_state_recursive(current, state)
+        return current
     
     def change_file_state(self, path: str, state: State) -> int:
         """Find a file by exact path and change its state, then update parent directories.
@@ -540,31 +2131,10 @@ class DirTree:
         Raises:
             ValueError: If the file path does not exist
         """
-        parts = path.split('/')
-        filename = parts[-1]
-        dir_parts = parts[:-1] if len(parts) > 1 else []
-        
-        # Navigate to the parent directory, keeping track of the path
-        current = self.root
-        parent_dirs = []  # Store parent directories in order (from root to parent of file)
-        
-        for dir_name in dir_parts:
-            if dir_name == "":
-                continue
-            if dir_name not in current.children:
-                raise ValueError(f"File path '{path}' does not exist: directory '{dir_name}' not found")
-            parent_dirs.append(current)  # Store parent before moving down
-            current = current.children[dir_name]
-        
-        # Find the file in the current directory
-        if filename not in current.files:
-            raise ValueError(f"File path '{path}' does not exist: file '{filename}' not found")
-        
-        file_obj = current.files[filename]
-        
-        # Verify the path matches exactly
-        if file_obj.path != path:
-            raise ValueError(f"File path '{path}' does not match exactly. Found path: '{file_obj.path}'")
+        # Look up the file in the path index (keys are exact file paths)
+        file_obj = self._find_file(path)
+        if file_obj is None:
+            raise ValueError(f"File path '{path}' does not exist")
         
         count = 0
         
@@ -573,57 +2143,215 @@ class DirTree:
             file_obj.state = state
             count += 1
         
-        # Recursively go up the directories and change parent directory states
+        # Go up the directories and change parent directory states
         # If file state is set to VISIBLE, all parent dirs need to be changed to VISIBLE if they were HIDDEN
         if state == State.VISIBLE:
-            # Include the immediate parent directory (the one containing the file)
-            parent_dirs.append(current)
             # Traverse up through parent directories (from immediate parent up to root)
-            for parent_dir in reversed(parent_dirs):
+            parent_dir = file_obj.parent
+            while parent_dir is not None:
                 if parent_dir.state == State.HIDDEN:
                     parent_dir.state = State.VISIBLE
                     count += 1
+                parent_dir = parent_dir.parent
         
         return count
     
-    def _store_files_recursive(self, node: Node_Dir, output_dir: str) -> None:
-        """Recursively store visible files from the tree to the filesystem.
+    def change_dir_states(self, paths: List[str], state: State) -> int:
+        """Change the state of several directories, see change_dir_state.
+        
+        Args:
+            paths: Exact paths of the directories
+            state: New state to set for each directory and all its contents
+            
+        Returns:
+            Total number of states updated across all directories
+            
+        Raises:
+            ValueError: If any directory path does not exist or does not match
+                        exactly (checked before any change)
+        """
+        nodes = [self._exact_dir(path) for path in paths]
+        return sum(self._change_subtree_state(node, state) for node in nodes)
+    
+    def change_file_states(self, paths: List[str], state: State) -> int:
+        """Change the state of several files, see change_file_state.
         
         Args:
-            node: Directory node to process
-            output_dir: Base output directory path
+            paths: Exact paths of the files
+            state: New state to set for each file
+            
+        Returns:
+            Total number of states updated across all files and parent directories
+            
+        Raises:
+            ValueError: If any file path does not exist (checked before any change)
         """
-        # Skip if directory is hidden
-        if node.state == State.HIDDEN:
-            return
+        for path in paths:
+            if self._find_file(path) is None:
+                raise ValueError(f"File path '{path}' does not exist")
+        return sum(self.change_file_state(path, state) for path in paths)
+    
+    def change_states(self, operations: Iterable[Tuple[str, State]]) -> int:
+        """Apply a sequence of state changes in one pass over the tree.
         
-        # Create directory if it's not the root and doesn't exist
-        if node.path != "":
-            dir_path = os.path.join(output_dir, node.path)
-            os.makedirs(dir_path, exist_ok=True)
-        
-        # Store visible files from this directory
-        for filename, file_obj in node.files.items():
-            if file_obj.state == State.VISIBLE:
-                # Construct full file path
-                if node.path != "":
-                    file_path = os.path.join(output_dir, node.path, filename)
-                else:
-                    file_path = os.path.join(output_dir, filename)
-                
-                # Write file content
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    f.write(file_obj.content)
-                
-                # Make .sh files executable
-                if filename.endswith('.sh'):
-                    os.chmod(file_path, os.stat(file_path).st_mode | stat.S_IEXEC)
+        Each (path, state) operation means change_file_state(path, state) if
+        path is a file, otherwise change_dir_state(path, state), and the final
+        states equal those of making the calls in order. Instead of one walk
+        per call, the directory operations are resolved in a single traversal
+        of the affected subtrees, and the unhiding of parent directories for
+        VISIBLE files is propagated once for all file operations.
         
-        # Recursively process child directories
-        for child_dir in node.children.values():
-            self._store_files_recursive(child_dir, output_dir)
+        Args:
+            operations: (path, state) pairs, later ones overriding earlier ones
+            
+        Returns:
+            Number of files and directories whose state changed
+            
+        Raises:
+            ValueError: If any path does not exist (checked before any change)
+        """
+        # Resolve every path first; keep the last operation per node as (index, state)
+        dir_ops: Dict[int, Tuple[int, State]] = {}
+        file_ops: Dict[int, Tuple[int, State]] = {}
+        dir_nodes: Dict[int, Node_Dir] = {}
+        file_nodes: Dict[int, File] = {}
+        visible_files: List[Tuple[int, File]] = []
+        for index, (path, state) in enumerate(operations):
+            file_obj = self._find_file(path)
+            if file_obj is not None:
+                file_ops[id(file_obj)] = (index, state)
+                file_nodes[id(file_obj)] = file_obj
+                if state == State.VISIBLE:
+                    visible_files.append((index, file_obj))
+                continue
+            node = self._find_dir(path)
+            if node is None or (node is not self.root and node.path != path):
+                raise ValueError(f"Path '{path}' does not exist")
+            dir_ops[id(node)] = (index, state)
+            dir_nodes[id(node)] = node
+        
+        # Latest VISIBLE file operation below each directory, walking up once per
+        # directory: operations are visited newest first, so an ancestor already
+        # recorded has a newer one
+        unhide: Dict[int, int] = {}
+        unhide_nodes: List[Node_Dir] = []
+        for index, file_obj in reversed(visible_files):
+            parent_dir = file_obj.parent
+            while parent_dir is not None and id(parent_dir) not in unhide:
+                unhide[id(parent_dir)] = index
+                unhide_nodes.append(parent_dir)
+                parent_dir = parent_dir.parent
+        
+        def has_ancestor_op(node: Node_Dir) -> bool:
+            parent_dir = node.parent
+            while parent_dir is not None:
+                if id(parent_dir) in dir_ops:
+                    return True
+                parent_dir = parent_dir.parent
+            return False
+        
+        count = 0
+        
+        def apply(obj, state: State) -> None:
+            nonlocal count
+            if obj.state != state:
+                obj.state = state
+                count += 1
+        
+        def dir_state(node: Node_Dir, op: Tuple[int, Optional[State]]) -> State:
+            index, state = op
+            if state is None:
+                state = node.state
+            if state == State.HIDDEN and unhide.get(id(node), -1) > index:
+                return State.VISIBLE
+            return state
+        
+        # One traversal per outermost directory operation, carrying the newest operation down
+        visited = set()
+        for key, node in dir_nodes.items():
+            if has_ancestor_op(node):
+                continue
+            stack = [(node, dir_ops[key])]
+            while stack:
+                current, op = stack.pop()
+                own = dir_ops.get(id(current))
+                if own is not None and own[0] > op[0]:
+                    op = own
+                apply(current, dir_state(current, op))
+                visited.add(id(current))
+                for file_obj in current.files.values():
+                    file_op = file_ops.pop(id(file_obj), None)
+                    apply(file_obj, (file_op if file_op is not None and file_op[0] > op[0] else op)[1])
+                stack.extend((child, op) for child in current.children.values())
+        
+        # Files and parent directories outside every directory operation
+        for key, (_, state) in file_ops.items():
+            apply(file_nodes[key], state)
+        for parent_dir in unhide_nodes:
+            if id(parent_dir) not in visited:
+                apply(parent_dir, dir_state(parent_dir, (-1, None)))
+        return count
+    
+    def to_array(self) -> 'ArrayDirTree':
+        """Lay the tree out in preorder arrays for fast subtree operations.
+        
+        Returns:
+            ArrayDirTree with the current structure and states; contents are shared
+        """
+        from .dir_tree_array import ArrayDirTree
+        return ArrayDirTree(self)
+    
+    def to_persistent(self) -> 'PersistentDirTree':
+        """Build an immutable, structurally shared version of the tree.
+        
+        Returns:
+            PersistentDirTree with the current structure, states and contents
+        """
+        from .dir_tree_persistent import PersistentDirTree
+        return PersistentDirTree.from_tree(self)
+    
+    def view(self) -> 'VisibilityView':
+        """Create an empty VisibilityView of this tree (no state overrides).
+        
+        Returns:
+            VisibilityView to derive per-prompt visibility from without mutating the tree
+        """
+        from .dir_tree_view import VisibilityView
+        return VisibilityView(self)
+    
+    def save_snapshot(self, path: str) -> int:
+        """Save the tree (structure, states and contents) to a binary snapshot file.
+        
+        Distinct contents are stored once. See dir_tree_snapshot for the format.
+        
+        Args:
+            path: Destination file, replaced atomically
+            
+        Returns:
+            Number of bytes written
+        """
+        from .dir_tree_snapshot import save_snapshot
+        return save_snapshot(self, path)
+    
+    @classmethod
+    def load_snapshot(cls, path: str) -> 'DirTree':
+        """Load a tree saved with save_snapshot.
+        
+        The file is memory-mapped and contents are decoded only when accessed.
+        
+        Args:
+            path: Snapshot file
+            
+        Returns:
+            New DirTree
+            
+        Raises:
+            ValueError: If path is not a supported snapshot
+        """
+        from .dir_tree_snapshot import load_snapshot
+        return load_snapshot(path)
     
-    def store_files(self, output_dir: str) -> str:
+    def store_files(self, output_dir: str, view: Optional['VisibilityView'] = None) -> str:
         """Store files and their contents into the provided output directory.
         
         Only visible files are stored. If a *.sh file is stored, it is made executable
@@ -631,16 +2359,268 @@ class DirTree:
         
         Args:
             output_dir: Directory path where files should be stored
+            view: Optional VisibilityView deciding which files are visible. Storing
+                  through a view does not reset the flush baseline
             
         Returns:
             The absolute path where files were stored
         """
         # Create output directory if it doesn't exist
         abs_output_dir = os.path.abspath(output_dir)
-        os.makedirs(abs_output_dir, exist_ok=True)
-        
-        # Recursively store all visible files
-        self._store_files_recursive(self.root, abs_output_dir)
+        base = self._store_base(abs_output_dir)
+        os.makedirs(base, exist_ok=True)
+        
+        dirs: List[str] = []
+        files: List[Tuple[str, File]] = []
+        self._collect_store_entries(self.root, dirs, files, view)
+        
+        # Create non-hidden directories, then write visible files
+        for dir_path in dirs:
+            os.makedirs(os.path.join(base, dir_path), exist_ok=True)
+        for path, file_obj in files:
+            file_path = os.path.join(base, path)
+            _write_file(file_obj, file_path)
+            
+            # Make .sh files executable
+            if path.endswith('.sh'):
+                os.chmod(file_path, os.stat(file_path).st_mode | stat.S_IEXEC)
+        if view is None:
+            self._mark_stored()
         
         return abs_output_dir
-
+    
+    def _store_base(self, abs_output_dir: str) -> str:
+        """Directory the tree's paths are stored below: a named root is a directory of its own."""
+        return os.path.join(abs_output_dir, self.root._name) if self.root._name else abs_output_dir
+    
+    def _collect_store_entries(self, node: Node_Dir, dirs: List[str], files: List[Tuple[str, File]],
+                               view: Optional['VisibilityView'] = None,
+                               unstored: Optional[List[str]] = None) -> None:
+        """Collect the directories and files store_files would write below node.
+        
+        Args:
+            node: Directory node to start from
+            dirs: Receives relative paths of non-hidden directories
+            files: Receives (relative path, File) pairs of VISIBLE files
+            view: Optional VisibilityView deciding the states
+            unstored: Optional list receiving the paths of files that are not
+                      VISIBLE and of HIDDEN directories, directly below a
+                      non-hidden directory (used without a view)
+        """
+        for path, obj, state in self._walk(node, states=_SHOWN_STATES, view=view):
+            if isinstance(obj, File):
+                if state == State.VISIBLE:
+                    files.append((path, obj))
+                elif unstored is not None:
+                    unstored.append(path)
+                continue
+            if path != "":
+                dirs.append(path)
+            if unstored is not None:
+                prefix = path + '/' if path else ""
+                unstored.extend(prefix + name for name, file_obj in obj.files.items()
+                                if file_obj.state == State.HIDDEN)
+                unstored.extend(prefix + name for name, child in obj.children.items()
+                                if child.state == State.HIDDEN)
+    
+    def sync_files(self, output_dir: str, max_workers: int = 8,
+                   view: Optional['VisibilityView'] = None) -> StoreResult:
+        """Store visible files like store_files, skipping files that are unchanged on disk.
+        
+        Existing targets are compared by size and SHA-256 and only rewritten when
+        they differ. Missing directories are created in one sorted pass before any
+        file is written, and files are written from a bounded thread pool.
+        
+        Args:
+            output_dir: Directory path where files should be stored
+            max_workers: Maximum number of writer threads (default: 8)
+            view: Optional VisibilityView deciding which files are visible. Storing
+                  through a view does not reset the flush baseline
+            
+        Returns:
+            StoreResult with the absolute path and counts of files written and skipped
+        """
+        abs_output_dir = os.path.abspath(output_dir)
+        base = self._store_base(abs_output_dir)
+        os.makedirs(base, exist_ok=True)
+        result = StoreResult(path=abs_output_dir)
+        
+        dirs: List[str] = []
+        files: List[Tuple[str, File]] = []
+        self._collect_store_entries(self.root, dirs, files, view)
+        self._write_entries(result, base, dirs, files, max_workers)
+        if view is None:
+            self._mark_stored()
+        return result
+    
+    def _write_entries(self, result: StoreResult, base: str, dirs: List[str],
+                       files: List[Tuple[str, File]], max_workers: int) -> None:
+        """Create dirs and write-if-changed files below base, updating result."""
+        # Parents sort before children, so each makedirs also covers later parents
+        for dir_path in sorted(dirs):
+            full_dir = os.path.join(base, dir_path)
+            if not os.path.isdir(full_dir):
+                os.makedirs(full_dir, exist_ok=True)
+                result.dirs_created += 1
+        
+        targets = [os.path.join(base, path) for path, _ in files]
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+            written = pool.map(_sync_file, [file_obj for _, file_obj in files], targets)
+            for (path, _), was_written in zip(files, written):
+                if was_written:
+                    result.written += 1
+                    result.written_paths.append(path)
+                else:
+                    result.skipped += 1
+    
+    def _mark_stored(self) -> None:
+        """Reset the "since last store" baseline and drop changes nobody can ask for."""
+        self._stored_seq = self._seq
+        floor = min([self._stored_seq] + list(self._checkpoints.values()))
+        self._changes = {key: entry for key, entry in self._changes.items() if entry[0] > floor}
+        self._removed = {path: seq for path, seq in self._removed.items() if seq > floor}
+        self._unlinked = {path: seq for path, seq in self._unlinked.items() if seq > floor}
+    
+    def checkpoint(self, name: str) -> None:
+        """Remember the current point in the change history under a name.
+        
+        Args:
+            name: Checkpoint name, usable as `since` in get_changes and flush
+        """
+        self._checkpoints[name] = self._seq
+    
+    def _since_seq(self, since: Optional[str]) -> int:
+        if since is None:
+            return self._stored_seq
+        if since not in self._checkpoints:
+            raise ValueError(f"Checkpoint '{since}' does not exist")
+        return self._checkpoints[since]
+    
+    def _is_stored_dir(self, node: Node_Dir) -> bool:
+        """True if store_files would create this directory (no HIDDEN ancestor)."""
+        while node is not None:
+            if node.state == State.HIDDEN:
+                return False
+            node = node.parent
+        return True
+    
+    def _owned_path(self, obj: Union[File, Node_Dir]) -> Optional[str]:
+        """Path of obj if it is still part of this tree, else None."""
+        node = obj.parent if isinstance(obj, File) else obj
+        while node is not None and node.parent is not None:
+            node = node.parent
+        if node is not self.root:
+            return None
+        return obj.path if isinstance(obj, File) else _tree_path(obj)
+    
+    def get_changes(self, since: Optional[str] = None) -> ChangeSet:
+        """List the files and directories mutated since the last store or a checkpoint.
+        
+        Args:
+            since: Checkpoint name (default: the last store_files, sync_files or flush)
+            
+        Returns:
+            ChangeSet with changed file paths, changed directory paths and removed paths
+            
+        Raises:
+            ValueError: If the checkpoint does not exist
+        """
+        base = self._since_seq(since)
+        changes = ChangeSet()
+        for seq, obj in self._changes.values():
+            if seq <= base:
+                continue
+            path = self._owned_path(obj)
+            if path is None:
+                continue
+            if isinstance(obj, File):
+                changes.files.append(path)
+            else:
+                changes.dirs.append(path)
+        # A path that exists again is not removed, unless it was vacated by
+        # move or remove: what is on disk there may not be what replaced it
+        changes.removed = [path for path, seq in self._removed.items()
+                           if seq > base and (self._unlinked.get(path, 0) > base or
+                                              self._find_file(path) is None and self._find_dir(path) is None)]
+        changes.files.sort()
+        changes.dirs.sort()
+        changes.removed.sort()
+        return changes
+    
+    def flush(self, output_dir: str, since: Optional[str] = None, max_workers: int = 8) -> StoreResult:
+        """Bring output_dir up to date by touching only paths changed since the last store.
+        
+        The result on disk matches a fresh store_files into an empty output_dir,
+        provided output_dir held that state at the baseline: removed paths and
+        files that are no longer stored are deleted, directories that became
+        hidden are removed, and changed files are written if their contents differ.
+        
+        Args:
+            output_dir: Directory path previously stored to
+            since: Checkpoint name (default: the last store_files, sync_files or flush)
+            max_workers: Maximum number of writer threads (default: 8)
+            
+        Returns:
+            StoreResult with counts of files written, skipped and deleted
+            
+        Raises:
+            ValueError: If the checkpoint does not exist
+        """
+        abs_output_dir = os.path.abspath(output_dir)
+        base = self._store_base(abs_output_dir)
+        os.makedirs(base, exist_ok=True)
+        result = StoreResult(path=abs_output_dir)
+        changes = self.get_changes(since)
+        
+        def delete(path: str) -> None:
+            full_path = os.path.join(base, path)
+            if os.path.isdir(full_path):
+                shutil.rmtree(full_path)
+            elif os.path.lexists(full_path):
+                os.remove(full_path)
+            else:
+                return
+            result.deleted += 1
+            result.deleted_paths.append(path)
+        
+        for path in changes.removed:
+            delete(path)
+        
+        # Directories whose whole subtree was handled (parents sort first)
+        covered = set()
+        
+        def is_covered(path: str) -> bool:
+            parts = path.split('/')
+            return any('/'.join(parts[:i]) in covered for i in range(len(parts)))
+        
+        dirs: List[str] = []
+        files: List[Tuple[str, File]] = []
+        # Changed files below a covered directory are skipped, so whatever in
+        # it is no longer stored has to be deleted from the directory walk
+        unstored: List[str] = []
+        for dir_path in changes.dirs:
+            if is_covered(dir_path):
+                continue
+            node = self._find_dir(dir_path)
+            if self._is_stored_dir(node):
+                self._collect_store_entries(node, dirs, files, unstored=unstored)
+            elif dir_path:
+                delete(dir_path)
+            covered.add(dir_path)
+        for path in unstored:
+            delete(path)
+        
+        for file_path in changes.files:
+            if is_covered(file_path):
+                continue
+            file_obj = self._find_file(file_path)
+            if file_obj.state == State.VISIBLE and self._is_stored_dir(file_obj.parent):
+                files.append((file_path, file_obj))
+            else:
+                delete(file_path)
+        
+        # Parent directories of written files may not exist yet
+        dirs.extend(path.rsplit('/', 1)[0] for path, _ in files if '/' in path)
+        self._write_entries(result, base, list(set(dirs)), files, max_workers)
+        self._mark_stored()
+        return result
@@ -0,0 +1,431 @@
+"""Thread-safe DirTree with lock striping by top-level directory."""
+
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+from .dir_tree_class import ChangeSet, DirTree, File, Node_Dir, State, Stats, StoreResult
+from .dir_tree_persistent import PersistentDir, PersistentDirTree, _freeze, _freeze_file
+
+
+class ConcurrentDirTree(DirTree):
+    """DirTree that several threads can write to at the same time.
+
+    Every write locks the stripes of the top-level directories it touches
+    (a fixed set of locks, picked by hashing the directory name), and the
+    root lock as well when it adds, moves or removes an entry directly under
+    the root. Writers in disjoint top-level directories, e.g. one worker per
+    generated project node, never wait for each other; the path index and
+    dirty tracking they share are updated under a short internal lock.
+    Locks are always taken in the same order (root, stripes, index), so
+    writes touching several directories cannot deadlock.
+
+    Reads of the live tree hold the stripes of the directory they read
+    (every lock for whole-tree reads such as glob, diff or store_files).
+    Iterators (walk, iter_json, iter_dir_tree, iter_simple) are collected
+    while the locks are held. Calls made from inside a locked operation by
+    the same thread do not lock again.
+
+    snapshot() returns an immutable PersistentDirTree of the last completed
+    write. It is reused, without locking, until the next write, and taking
+    a new one copies only the top-level directories written since the
+    previous snapshot.
+
+    Nodes of the live tree must only be changed through the tree's methods.
+    """
+
+    def __init__(self, root: Optional[Node_Dir] = None, stripes: int = 16):
+        """Create a thread-safe tree.
+
+        Args:
+            root: Optional root node
+            stripes: Number of top-level directory locks
+
+        Raises:
+            ValueError: If stripes is less than 1
+        """
+        if stripes < 1:
+            raise ValueError(f"Expected at least 1 stripe, got {stripes}")
+        self._root_lock = threading.RLock()
+        self._stripes = [threading.RLock() for _ in range(stripes)]
+        self._index_lock = threading.RLock()
+        # Number of locked operations the current thread is inside of
+        self._local = threading.local()
+        # Bumped after every write; the cached snapshot is valid while it matches
+        self._generation = 0
+        self._latest: Optional[Tuple[int, PersistentDirTree]] = None
+        # Frozen top-level directories of the last snapshot, by name, with the
+        # live node they were copied from; names written since then are in
+        # _dirty_tops, which is None when everything has to be copied again
+        self._frozen: Dict[str, Tuple[Node_Dir, PersistentDir]] = {}
+        self._dirty_tops: Optional[Set[str]] = None
+        super().__init__(root)
+
+    @DirTree.root.setter
+    def root(self, node: Node_Dir) -> None:
+        with self.exclusive():
+            DirTree.root.fset(self, node)
+
+    # Locking
+
+    def _stripe(self, name: str) -> int:
+        """Stripe index of a top-level directory name."""
+        return hash(name) % len(self._stripes)
+
+    def _lock_set(self, paths: List[str]) -> Tuple[bool, List[int]]:
+        """Return (root lock needed, sorted stripe indices) for a write to paths."""
+        root = self._root
+        need_root = False
+        stripes = set()
+        for path in paths:
+            parts = [p for p in path.split('/') if p != ""]
+            if not parts:
+                return True, list(range(len(self._stripes)))
+            # Entries directly under the root, and new top-level directories, change root's dicts
+            if len(parts) == 1 or parts[0] not in root.children:
+                need_root = True
+            stripes.add(self._stripe(parts[0]))
+        return need_root, sorted(stripes)
+
+    def _release(self, locks: List[threading.RLock], write: bool) -> None:
+        """Release locks, first invalidating the cached snapshot after a write."""
+        if write:
+            with self._index_lock:
+                self._generation += 1
+        for lock in reversed(locks):
+            lock.release()
+
+    def _depth(self) -> int:
+        return getattr(self._local, 'depth', 0)
+
+    @contextmanager
+    def _held(self, locks: List[threading.RLock], write: bool) -> Iterator[None]:
+        """Run the block as a locked operation of this thread, then release locks."""
+        self._local.depth = self._depth() + 1
+        try:
+            yield
+        finally:
+            self._local.depth -= 1
+            self._release(locks, write)
+
+    @contextmanager
+    def _holding(self, locks: List[threading.RLock], write: bool = True) -> Iterator[None]:
+        """Hold locks, given in lock order. A write may have changed anything."""
+        for lock in locks:
+            lock.acquire()
+        if write:
+            self._dirty_tops = None
+        with self._held(locks, write):
+            yield
+
+    @contextmanager
+    def _writing(self, paths: Iterable[str]) -> Iterator[None]:
+        """Hold the locks for a write to paths."""
+        paths = list(paths)
+        while True:
+            need_root, stripes = self._lock_set(paths)
+            locks = [self._stripes[i] for i in stripes]
+            if need_root:
+                locks.insert(0, self._root_lock)
+            for lock in locks:
+                lock.acquire()
+            # A top-level directory removed before the stripe was taken needs the root lock
+            if need_root or not self._lock_set(paths)[0]:
+                break
+            self._release(locks, write=False)
+        self._mark_tops(paths)
+        with self._held(locks, write=True):
+            yield
+
+    @contextmanager
+    def _reading(self, paths: Iterable[str]) -> Iterator[None]:
+        """Hold the stripes of the top-level directories of paths ("" is the whole tree).
+
+        Does nothing inside another locked operation of the same thread.
+        """
+        if self._depth():
+            yield
+            return
+        locks = self._read_locks(list(paths))
+        for lock in locks:
+            lock.acquire()
+        with self._held(locks, write=False):
+            yield
+
+    def _read_locks(self, paths: List[str]) -> List[threading.RLock]:
+        stripes = set()
+        for path in paths:
+            name = next((p for p in path.split('/') if p != ""), None)
+            if name is None:
+                return self._all_locks()
+            stripes.add(self._stripe(name))
+        return [self._stripes[i] for i in sorted(stripes)]
+
+    def _all_locks(self) -> List[threading.RLock]:
+        return [self._root_lock, *self._stripes]
+
+    def _mark_tops(self, paths: List[str]) -> None:
+        """Record the top-level names a write to paths changes, for the next snapshot."""
+        with self._index_lock:
+            if self._dirty_tops is None:
+                return
+            for path in paths:
+                name = next((p for p in path.split('/') if p != ""), None)
+                if name is None:
+                    self._dirty_tops = None
+                    return
+                self._dirty_tops.add(name)
+
+    def exclusive(self):
+        """Context manager holding every lock, for whole-tree operations on the live tree.
+
+        Counts as a write: the next snapshot is taken again.
+        """
+        return self._holding(self._all_locks())
+
+    def snapshot(self) -> PersistentDirTree:
+        """Return an immutable version of the tree as of the last completed write.
+
+        The version is built while holding every lock and returned again,
+        without locking, until the next write. Top-level directories not
+        written since the previous snapshot are shared with it, so the cost
+        is the size of the written top-level directories plus the root's
+        entries. File contents, counters and hashes are shared with the
+        live tree.
+        """
+        latest = self._latest
+        if latest is not None and latest[0] == self._generation:
+            return latest[1]
+        with self._holding(self._all_locks(), write=False):
+            generation = self._generation
+            root = self.root
+            dirty, frozen = self._dirty_tops, self._frozen
+            children: Dict[str, PersistentDir] = {}
+            self._frozen = {}
+            for name, child in root.children.items():
+                entry = frozen.get(name) if dirty is not None and name not in dirty else None
+                if entry is None or entry[0] is not child:
+                    entry = (child, _freeze(self, child))
+                self._frozen[name] = entry
+                children[name] = entry[1]
+            files = {name: _freeze_file(file_obj) for name, file_obj in root.files.items()}
+            frozen_root = PersistentDir(root.state, children, files)
+            frozen_root._stats, frozen_root._hash = root._stats, root._hash
+            snapshot = PersistentDirTree(frozen_root)
+            self._dirty_tops = set()
+            self._latest = (generation, snapshot)
+        return snapshot
+
+    # Shared bookkeeping, called from writers of different stripes
+
+    def _mark_dirty(self, obj: Union[File, Node_Dir]) -> None:
+        with self._index_lock:
+            super()._mark_dirty(obj)
+
+    def _register_dir(self, path: str, node: Node_Dir) -> None:
+        with self._index_lock:
+            super()._register_dir(path, node)
+
+    def _register_file(self, path: str, file_obj: File) -> None:
+        with self._index_lock:
+            super()._register_file(path, file_obj)
+
+    def _unregister_file(self, path: str, file_obj: File) -> None:
+        with self._index_lock:
+            super()._unregister_file(path, file_obj)
+
+    def _revalidate(self, index: Dict, verified: Dict[str, int], key: str, obj, navigate):
+        with self._index_lock:
+            return super()._revalidate(index, verified, key, obj, navigate)
+
+    # Reads of the live tree
+
+    def _find_dir(self, dirpath: str) -> Optional[Node_Dir]:
+        if self._depth():
+            return super()._find_dir(dirpath)
+        with self._reading((dirpath,)):
+            return super()._find_dir(dirpath)
+
+    def _find_file(self, path: str) -> Optional[File]:
+        if self._depth():
+            return super()._find_file(path)
+        with self._reading((path,)):
+            return super()._find_file(path)
+
+    def walk(self, order: str = "pre", filter: Optional[Union[State, Iterable[State]]] = None,
+             dir: Optional[str] = None,
+             view: Optional['VisibilityView'] = None) -> Iterator[Tuple[str, Union[Node_Dir, File]]]:
+        with self._reading((dir or "",)):
+            return iter(list(super().walk(order, filter, dir, view)))
+
+    def get_stats(self, dirpath: str = "") -> Stats:
+        with self._reading((dirpath,)):
+            return super().get_stats(dirpath)
+
+    def get_digest(self, dirpath: str = "") -> bytes:
+        with self._reading((dirpath,)):
+            return super().get_digest(dirpath)
+
+    def count_unique_contents(self, dirpath: str = "") -> int:
+        with self._reading((dirpath,)):
+            return super().count_unique_contents(dirpath)
+
+    def diff(self, other: DirTree) -> 'TreeDiff':
+        with self._reading(("",)):
+            return super().diff(other)
+
+    def compare(self, other: DirTree) -> ChangeSet:
+        with self._reading(("",)):
+            return super().compare(other)
+
+    def iter_dir_tree(self, words: bool = False, contents: bool = False, state: bool = False,
+                      max_depth: Optional[int] = None, max_entries: Optional[int] = None) -> Iterator[str]:
+        with self._reading(("",)):
+            return iter(list(super().iter_dir_tree(words, contents, state, max_depth, max_entries)))
+
+    def iter_simple(self) -> Iterator[str]:
+        with self._reading(("",)):
+            return iter(list(super().iter_simple()))
+
+    def dir_exists(self, dirpath: str) -> bool:
+        with self._reading((dirpath,)):
+            return super().dir_exists(dirpath)
+
+    def dirs_exist(self, dirpaths: List[str]) -> List[bool]:
+        with self._reading(dirpaths):
+            return super().dirs_exist(dirpaths)
+
+    def glob(self, pattern: str) -> List[str]:
+        with self._reading(("",)):
+            return super().glob(pattern)
+
+    def find(self, predicate: Optional[Callable[[File], bool]] = None, dir: Optional[str] = None,
+             name: Optional[str] = None, ext: Optional[str] = None) -> List[str]:
+        with self._reading((dir or "",)):
+            return super().find(predicate, dir, name, ext)
+
+    def generate_file_dict(self, dir: Optional[str] = None,
+                           view: Optional['VisibilityView'] = None) -> Dict[str, str]:
+        with self._reading((dir or "",)):
+            return super().generate_file_dict(dir, view)
+
+    def iter_json(self, format: str = "flat", dir: Optional[str] = None,
+                  view: Optional['VisibilityView'] = None, indent: Optional[int] = None,
+                  ensure_ascii: bool = True) -> Iterator[str]:
+        with self._reading((dir or "",)):
+            return iter(list(super().iter_json(format, dir, view, indent, ensure_ascii)))
+
+    def generate_budgeted_file_dict(self, budget: int, unit: Union[str, Callable[[str], int]] = "tokens",
+                                    priorities: Optional[Union[Dict[str, float], Callable[[str], float]]] = None,
+                                    dir: Optional[str] = None, view: Optional['VisibilityView'] = None,
+                                    summarize: bool = True) -> 'BudgetedFiles':
+        with self._reading((dir or "",)):
+            return super().generate_budgeted_file_dict(budget, unit, priorities, dir, view, summarize)
+
+    def enable_text_index(self) -> 'TextIndex':
+        with self._reading(("",)):
+            return super().enable_text_index()
+
+    def to_array(self) -> 'ArrayDirTree':
+        with self._reading(("",)):
+            return super().to_array()
+
+    def to_persistent(self) -> PersistentDirTree:
+        with self._reading(("",)):
+            return super().to_persistent()
+
+    def save_snapshot(self, path: str) -> int:
+        with self._reading(("",)):
+            return super().save_snapshot(path)
+
+    # Writes
+
+    def _insert_file(self, filepath: str, file_obj: File) -> None:
+        with self._writing((filepath,)):
+            super()._insert_file(filepath, file_obj)
+
+    def add_dir(self, name: str, state: State = State.VISIBLE, dir: Optional[str] = None) -> None:
+        with self._writing((dir + '/' + name if dir is not None else name,)):
+            super().add_dir(name, state, dir)
+
+    def json_to_tree(self, files: Union[List[Dict[str, str]], Dict[str, str]], dir: Optional[str] = None) -> Node_Dir:
+        with self.exclusive():
+            return super().json_to_tree(files, dir)
+
+    def add_files_to_dir_tree(self, files: Union[List[Dict[str, str]], Dict[str, str]],
+                              dir: Optional[str] = None) -> Node_Dir:
+        entries = list(self._iter_json_files(files, dir))
+        with self._writing(filepath for filepath, _ in entries):
+            self._add_files(entries)
+            return self.root
+
+    def move(self, src: str, dst: str) -> None:
+        # Moves and removes update the dirty tracking and index directly
+        with self._writing((src, dst)), self._index_lock:
+            super().move(src, dst)
+
+    def rename(self, path: str, new_name: str) -> None:
+        parts = [p for p in path.split('/') if p != ""]
+        with self._writing((path, '/'.join(parts[:-1] + [new_name]))):
+            super().rename(path, new_name)
+
+    def remove(self, path: str) -> None:
+        with self._writing((path,)), self._index_lock:
+            super().remove(path)
+
+    def set_dir_to_invisible(self, dirpath: str) -> None:
+        with self._writing((dirpath,)):
+            super().set_dir_to_invisible(dirpath)
+
+    def change_dir_tree_state(self, state: State) -> int:
+        with self.exclusive():
+            return super().change_dir_tree_state(state)
+
+    def change_dir_state(self, path: str, state: State) -> int:
+        with self._writing((path,)):
+            return super().change_dir_state(path, state)
+
+    def change_file_state(self, path: str, state: State) -> int:
+        with self._writing((path,)):
+            return super().change_file_state(path, state)
+
+    def change_dir_states(self, paths: List[str], state: State) -> int:
+        with self._writing(paths):
+            return super().change_dir_states(paths, state)
+
+    def change_file_states(self, paths: List[str], state: State) -> int:
+        with self._writing(paths):
+            return super().change_file_states(paths, state)
+
+    def change_states(self, operations: Iterable[Tuple[str, State]]) -> int:
+        operations = list(operations)
+        with self._writing(path for path, _ in operations):
+            return super().change_states(operations)
+
+    # Whole-tree operations on the live tree
+
+    def checkpoint(self, name: str) -> None:
+        with self._reading(("",)):
+            super().checkpoint(name)
+
+    def get_changes(self, since: Optional[str] = None) -> ChangeSet:
+        with self._reading(("",)):
+            return super().get_changes(since)
+
+    def store_files(self, output_dir: str, view: Optional['VisibilityView'] = None) -> str:
+        with self._reading(("",)):
+            return super().store_files(output_dir, view)
+
+    def sync_files(self, output_dir: str, max_workers: int = 8,
+                   view: Optional['VisibilityView'] = None) -> StoreResult:
+        with self._reading(("",)):
+            return super().sync_files(output_dir, max_workers, view)
+
+    def flush(self, output_dir: str, since: Optional[str] = None, max_workers: int = 8) -> StoreResult:
+        with self._reading(("",)):
+            return super().flush(output_dir, since, max_workers)
+
+    def search(self, terms: Union[str, Iterable[str]], limit: Optional[int] = None,
+               dir: Optional[str] = None) -> List[Tuple[str, float]]:
+        with self._reading(("",)):
+            return super().search(terms, limit, dir)
@@ -0,0 +1,319 @@
+"""Tree diff and three-way merge for DirTree.
+
+Both walk the trees together and skip every subtree whose Merkle hash
+(Node_Dir.digest) matches, so their cost is proportional to what changed
+rather than to the size of the trees.
+"""
+
+import copy
+import difflib
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from .dir_tree_class import DirTree, File, Node_Dir, State
+
+# Lines of context around each hunk
+_CONTEXT = 3
+
+
+@dataclass
+class Hunk:
+    """One block of line changes; starts are 1-based like unified diffs."""
+    old_start: int
+    old_count: int
+    new_start: int
+    new_count: int
+    lines: List[str] = field(default_factory=list)
+
+    def header(self) -> str:
+        return f"@@ -{self.old_start},{self.old_count} +{self.new_start},{self.new_count} @@"
+
+
+@dataclass
+class TreeDiff:
+    """File level changes from one tree to another (states are not compared)."""
+    added: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    modified: Dict[str, List[Hunk]] = field(default_factory=dict)
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.modified)
+
+    def to_unified(self) -> str:
+        """Render the modified files as a unified diff, listing added and removed files."""
+        out = [f"added: {path}" for path in self.added]
+        out.extend(f"removed: {path}" for path in self.removed)
+        for path, hunks in self.modified.items():
+            out.append(f"--- a/{path}")
+            out.append(f"+++ b/{path}")
+            for hunk in hunks:
+                out.append(hunk.header())
+                out.extend(line.rstrip('\n') for line in hunk.lines)
+        return '\n'.join(out)
+
+
+@dataclass
+class MergeResult:
+    """Outcome of DirTree.merge."""
+    tree: DirTree
+    conflicts: List[str] = field(default_factory=list)
+
+    @property
+    def clean(self) -> bool:
+        """True if the merge had no conflicts."""
+        return not self.conflicts
+
+
+def _hunks(old: str, new: str) -> List[Hunk]:
+    """Line-level hunks turning old into new."""
+    a = old.splitlines(keepends=True)
+    b = new.splitlines(keepends=True)
+    hunks = []
+    matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    for group in matcher.get_grouped_opcodes(_CONTEXT):
+        i1, i2 = group[0][1], group[-1][2]
+        j1, j2 = group[0][3], group[-1][4]
+        hunk = Hunk(i1 + 1, i2 - i1, j1 + 1, j2 - j1)
+        for tag, a1, a2, b1, b2 in group:
+            if tag == 'equal':
+                hunk.lines.extend(' ' + line for line in a[a1:a2])
+                continue
+            hunk.lines.extend('-' + line for line in a[a1:a2])
+            hunk.lines.extend('+' + line for line in b[b1:b2])
+        hunks.append(hunk)
+    return hunks
+
+
+def _file_paths(node: Node_Dir, path: str) -> List[str]:
+    """Paths of every file below node, with node at path."""
+    paths = []
+    stack = [(path, node)]
+    while stack:
+        dir_path, current = stack.pop()
+        prefix = dir_path + '/' if dir_path else ""
+        paths.extend(prefix + name for name in current.files)
+        stack.extend((prefix + name, child) for name, child in current.children.items())
+    return paths
+
+
+def diff_trees(old: DirTree, new: DirTree) -> TreeDiff:
+    """Compute the file changes turning old into new, see DirTree.diff."""
+    result = TreeDiff()
+    stack: List[Tuple[str, Optional[Node_Dir], Optional[Node_Dir]]] = [("", old.root, new.root)]
+    while stack:
+        path, a, b = stack.pop()
+        if a is None:
+            result.added.extend(_file_paths(b, path))
+            continue
+        if b is None:
+            result.removed.extend(_file_paths(a, path))
+            continue
+        if a.digest == b.digest:
+            continue
+
+        prefix = path + '/' if path else ""
+        for name, file_obj in b.files.items():
+            old_file = a.files.get(name)
+            if old_file is None:
+                result.added.append(prefix + name)
+            elif old_file.digest != file_obj.digest:
+                result.modified[prefix + name] = _hunks(old_file.content, file_obj.content)
+        result.removed.extend(prefix + name for name in a.files if name not in b.files)
+        for name in dict.fromkeys(list(a.children) + list(b.children)):
+            stack.append((prefix + name, a.children.get(name), b.children.get(name)))
+
+    result.added.sort()
+    result.removed.sort()
+    result.modified = dict(sorted(result.modified.items()))
+    return result
+
+
+def _changes(base: List[str], other: List[str]) -> List[Tuple[int, int, List[str]]]:
+    """Regions of base replaced in other, as (start, end, replacement lines)."""
+    matcher = difflib.SequenceMatcher(None, base, other, autojunk=False)
+    return [(i1, i2, other[j1:j2]) for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != 'equal']
+
+
+def _apply(base: List[str], start: int, end: int, changes: List[Tuple[int, int, List[str]]]) -> List[str]:
+    """base[start:end] with changes (sorted, inside the range) applied."""
+    out: List[str] = []
+    pos = start
+    for i1, i2, lines in changes:
+        out.extend(base[pos:i1])
+        out.extend(lines)
+        pos = i2
+    out.extend(base[pos:end])
+    return out
+
+
+def _merge_text(base: str, ours: str, theirs: str) -> Tuple[str, bool]:
+    """Three-way line merge in the style of diff3.
+
+    Changes from both sides that overlap or touch form one region; a region
+    changed on one side takes that side, a region changed identically on
+    both sides is taken once, anything else becomes a conflict block.
+
+    Returns:
+        (merged text, True if there were conflicts)
+    """
+    base_lines = base.splitlines(keepends=True)
+    tagged = sorted([(c, 0) for c in _changes(base_lines, ours.splitlines(keepends=True))] +
+                    [(c, 1) for c in _changes(base_lines, theirs.splitlines(keepends=True))],
+                    key=lambda item: (item[0][0], item[0][1]))
+    out: List[str] = []
+    conflict = False
+    pos = 0
+    k = 0
+    while k < len(tagged):
+        start = end = tagged[k][0][0]
+        sides: Tuple[list, list] = ([], [])
+        while k < len(tagged) and tagged[k][0][0] <= end:
+            change, side = tagged[k]
+            sides[side].append(change)
+            end = max(end, change[1])
+            k += 1
+
+        out.extend(base_lines[pos:start])
+        if not sides[0] or not sides[1]:
+            out.extend(_apply(base_lines, start, end, sides[0] or sides[1]))
+        else:
+            ours_region = _apply(base_lines, start, end, sides[0])
+            theirs_region = _apply(base_lines, start, end, sides[1])
+            if ours_region == theirs_region:
+                out.extend(ours_region)
+            else:
+                conflict = True
+                out.append("<<<<<<< ours\n")
+                out.extend(_terminated(ours_region))
+                out.append("=======\n")
+                out.extend(_terminated(theirs_region))
+                out.append(">>>>>>> theirs\n")
+        pos = end
+    out.extend(base_lines[pos:])
+    return ''.join(out), conflict
+
+
+def _terminated(lines: List[str]) -> List[str]:
+    if lines and not lines[-1].endswith('\n'):
+        return lines[:-1] + [lines[-1] + '\n']
+    return lines
+
+
+def _copy_file(file_obj: File, parent: Node_Dir) -> File:
+    """Copy a file node into parent, sharing its content blob."""
+    new = copy.copy(file_obj)
+    new.parent = parent
+    parent.files[new._name] = new
+    return new
+
+
+def _copy_dir(node: Node_Dir, parent: Optional[Node_Dir], name: str) -> Node_Dir:
+    """Copy a subtree under parent without recursion; contents and cached aggregates are shared."""
+    top = Node_Dir(path=name, state=node.state)
+    stack = [(node, top)]
+    while stack:
+        source, target = stack.pop()
+        target._stats = source._stats
+        target._hash = source._hash
+        for file_obj in source.files.values():
+            _copy_file(file_obj, target)
+        for child_name, child in source.children.items():
+            new_child = Node_Dir(path=child_name, state=child.state)
+            new_child.parent = target
+            target.children[new_child._name] = new_child
+            stack.append((child, new_child))
+    if parent is not None:
+        top.parent = parent
+        parent.children[top._name] = top
+    return top
+
+
+def _digest(node) -> Optional[bytes]:
+    return node.digest if node is not None else None
+
+
+def _key(file_obj: Optional[File]) -> Optional[Tuple[bytes, State]]:
+    return (file_obj.digest, file_obj.state) if file_obj is not None else None
+
+
+def _merge_state(base, ours, theirs) -> State:
+    """Three-way merge of a state; ours wins when both sides changed it."""
+    if ours is None:
+        return theirs.state
+    if base is not None and theirs is not None and ours.state == base.state:
+        return theirs.state
+    return ours.state
+
+
+def merge_trees(base: DirTree, ours: DirTree, theirs: DirTree) -> MergeResult:
+    """Three-way merge of trees, see DirTree.merge."""
+    conflicts: List[str] = []
+    root: Optional[Node_Dir] = None
+    stack = [("", None, base.root, ours.root, theirs.root)]
+    while stack:
+        path, parent, b, o, t = stack.pop()
+        name = path.rsplit('/', 1)[-1]
+        b_hash, o_hash, t_hash = _digest(b), _digest(o), _digest(t)
+
+        # Whole subtrees taken from one side
+        if o_hash == t_hash or b_hash == t_hash:
+            chosen = o
+        elif b_hash == o_hash:
+            chosen = t
+        else:
+            chosen = False
+        if chosen is not False:
+            if chosen is not None:
+                node = _copy_dir(chosen, parent, name)
+                root = root or node
+            continue
+
+        # Both sides changed the subtree: merge file by file
+        node = Node_Dir(path=name, state=_merge_state(b, o, t))
+        if parent is not None:
+            node.parent = parent
+            parent.children[node._name] = node
+        root = root or node
+        prefix = path + '/' if path else ""
+        empty: Dict = {}
+        b_files = b.files if b is not None else empty
+        o_files = o.files if o is not None else empty
+        t_files = t.files if t is not None else empty
+        for file_name in dict.fromkeys(list(o_files) + list(t_files) + list(b_files)):
+            fb, fo, ft = b_files.get(file_name), o_files.get(file_name), t_files.get(file_name)
+            kb, ko, kt = _key(fb), _key(fo), _key(ft)
+            if ko == kt or kb == kt:
+                if fo is not None:
+                    _copy_file(fo, node)
+                continue
+            if kb == ko:
+                if ft is not None:
+                    _copy_file(ft, node)
+                continue
+
+            # Changed on both sides
+            if fo is None or ft is None:
+                # Deleted on one side, modified on the other: keep the modified file
+                _copy_file(fo if fo is not None else ft, node)
+                conflicts.append(prefix + file_name)
+                continue
+            merged = _copy_file(fo, node)
+            merged.state = _merge_state(fb, fo, ft)
+            if fo.digest != ft.digest:
+                text, conflict = _merge_text(fb.content if fb is not None else "",
+                                             fo.content, ft.content)
+                merged.content = text
+                if conflict:
+                    conflicts.append(prefix + file_name)
+
+        b_children = b.children if b is not None else empty
+        o_children = o.children if o is not None else empty
+        t_children = t.children if t is not None else empty
+        for child_name in dict.fromkeys(list(o_children) + list(t_children) + list(b_children)):
+            stack.append((prefix + child_name, node, b_children.get(child_name),
+                          o_children.get(child_name), t_children.get(child_name)))
+
+    if root is None:
+        root = Node_Dir(path="", state=State.VISIBLE)
+    conflicts.sort()
+    return MergeResult(tree=DirTree(root), conflicts=conflicts)
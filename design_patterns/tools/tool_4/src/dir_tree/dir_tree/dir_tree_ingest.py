@@ -0,0 +1,222 @@
+"""Incremental DirTree construction from a streamed JSON response."""
+
+import json
+import re
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Union
+
+from .dir_tree_class import DirTree, File
+
+_WHITESPACE = re.compile(r'[ \t\r\n]*')
+_STRING_SPECIAL = re.compile(r'["\\]')
+_SCALAR_END = re.compile(r'[,\]}\s]')
+_SCALAR_START = frozenset('-0123456789tfn')
+
+
+class JsonIngester:
+    """Build File nodes from JSON text chunks as soon as each file is complete.
+
+    Accepts the same documents as add_files_to_dir_tree:
+    - an object mapping paths to contents: {"path": "contents", ...}
+    - an array of objects with "path" and "contents" (or "content") keys
+
+    Values nested deeper (e.g. extra keys of a file object) are collected
+    and handled like json_to_tree handles them. Text before the first '{'
+    or '[' (e.g. a ```json fence) and after the end of the document is
+    ignored. Contents are located with regex scans
+    instead of character by character, and decoded with json.loads once the
+    closing quote arrives.
+    """
+
+    def __init__(self, tree: DirTree, dir: Optional[str] = None,
+                 on_file: Optional[Callable[[File], None]] = None):
+        """Create an ingester adding files to tree.
+
+        Args:
+            tree: DirTree to add the files to
+            dir: Optional directory location inside which to add all files
+            on_file: Optional callback called with each File as it is created
+        """
+        self.tree = tree
+        self.dir = dir
+        self.on_file = on_file
+        self.files: List[File] = []
+        # Frames are [kind, expect, key, item]: kind is "obj" or "arr", expect
+        # the next token allowed, key the pending object key, item the dict or
+        # list being built for a nested value (None for the document itself)
+        self._stack: List[list] = []
+        self._started = False
+        self._done = False
+        self._string: Optional[List[str]] = None
+        self._escape = False
+        self._scalar: Optional[List[str]] = None
+
+    @property
+    def done(self) -> bool:
+        """True once the whole JSON document was read."""
+        return self._done
+
+    def feed(self, chunk: str) -> List[File]:
+        """Consume a chunk of JSON text.
+
+        Returns:
+            Files completed by this chunk, in document order
+
+        Raises:
+            ValueError: If the text is not a supported JSON document
+        """
+        created: List[File] = []
+        i, n = 0, len(chunk)
+        while i < n:
+            if self._string is not None:
+                i = self._scan_string(chunk, i, created)
+                continue
+            if self._scalar is not None:
+                i = self._scan_scalar(chunk, i, created)
+                continue
+            if self._done:
+                break
+            if not self._started:
+                starts = [j for j in (chunk.find('{', i), chunk.find('[', i)) if j != -1]
+                if not starts:
+                    break
+                i = min(starts)
+                self._started = True
+            i = _WHITESPACE.match(chunk, i).end()
+            if i < n:
+                i = self._structural(chunk, i, created)
+        return created
+
+    def close(self) -> List[File]:
+        """Finish the stream.
+
+        Returns:
+            All files created by this ingester
+
+        Raises:
+            ValueError: If the document is incomplete
+        """
+        if self._scalar is not None and self._stack:
+            self._value(self._scalar_value(), [])
+        if not self._done:
+            raise ValueError("Incomplete JSON document: the stream ended early")
+        return self.files
+
+    def _structural(self, chunk: str, i: int, created: List[File]) -> int:
+        """Handle the token starting at chunk[i] outside strings and scalars."""
+        c = chunk[i]
+        frame = self._stack[-1] if self._stack else None
+        expect = frame[1] if frame is not None else "value"
+        if c == '"':
+            self._string = []
+            return i + 1
+        if c in '{[' and expect in ("value", "value0"):
+            self._open(c)
+        elif c == ':' and expect == "colon":
+            frame[1] = "value"
+        elif c == ',' and expect == "next":
+            frame[1] = "key" if frame[0] == "obj" else "value"
+        elif c == '}' and frame is not None and frame[0] == "obj" and expect in ("key0", "next"):
+            self._close(created)
+        elif c == ']' and frame is not None and frame[0] == "arr" and expect in ("value0", "next"):
+            self._close(created)
+        elif c in _SCALAR_START and expect in ("value", "value0"):
+            self._scalar = []
+            return i
+        else:
+            raise ValueError(f"Unexpected {c!r} in JSON stream")
+        return i + 1
+
+    def _scan_string(self, chunk: str, i: int, created: List[File]) -> int:
+        """Consume string characters up to and including the closing quote."""
+        pieces = self._string
+        if self._escape:
+            pieces.append(chunk[i])
+            self._escape = False
+            i += 1
+        while True:
+            match = _STRING_SPECIAL.search(chunk, i)
+            if match is None:
+                pieces.append(chunk[i:])
+                return len(chunk)
+            j = match.start()
+            if chunk[j] == '\\':
+                pieces.append(chunk[i:j + 1])
+                if j + 1 == len(chunk):
+                    self._escape = True
+                    return j + 1
+                pieces.append(chunk[j + 1])
+                i = j + 2
+                continue
+            pieces.append(chunk[i:j])
+            self._string = None
+            self._token(json.loads('"' + ''.join(pieces) + '"'), created)
+            return j + 1
+
+    def _scan_scalar(self, chunk: str, i: int, created: List[File]) -> int:
+        """Consume a number, true, false or null."""
+        match = _SCALAR_END.search(chunk, i)
+        end = match.start() if match is not None else len(chunk)
+        self._scalar.append(chunk[i:end])
+        if match is not None:
+            self._value(self._scalar_value(), created)
+        return end
+
+    def _scalar_value(self):
+        text = ''.join(self._scalar)
+        self._scalar = None
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            raise ValueError(f"Invalid JSON value {text!r}") from None
+
+    def _token(self, value: str, created: List[File]) -> None:
+        """Handle a complete string: an object key or a value."""
+        frame = self._stack[-1] if self._stack else None
+        if frame is not None and frame[0] == "obj" and frame[1] in ("key0", "key"):
+            frame[2] = value
+            frame[1] = "colon"
+        else:
+            self._value(value, created)
+
+    def _value(self, value, created: List[File]) -> None:
+        """Handle a complete string or scalar value in the current frame."""
+        frame = self._stack[-1] if self._stack else None
+        if frame is None or frame[1] not in ("value", "value0"):
+            raise ValueError(f"Unexpected value {value!r} in JSON stream")
+        frame[1] = "next"
+        if frame[3] is None:
+            # A path -> contents entry or a list element of the document
+            self._emit({frame[2]: value} if frame[0] == "obj" else [value], created)
+        elif frame[0] == "obj":
+            frame[3][frame[2]] = value
+        else:
+            frame[3].append(value)
+
+    def _open(self, c: str) -> None:
+        item = None if not self._stack else ({} if c == '{' else [])
+        self._stack.append(["obj", "key0", None, item] if c == '{' else ["arr", "value0", None, item])
+
+    def _close(self, created: List[File]) -> None:
+        frame = self._stack.pop()
+        if self._stack:
+            self._value(frame[3], created)
+        else:
+            self._done = True
+
+    def _emit(self, files: Union[List[Dict], Dict], created: List[File]) -> None:
+        """Add a completed file, given in either document format, like add_files_to_dir_tree."""
+        ((filepath, content),) = DirTree._iter_json_files(files, self.dir)
+        file_obj = File(path=filepath, content=content)
+        self.tree._insert_file(filepath, file_obj)
+        self.files.append(file_obj)
+        created.append(file_obj)
+        if self.on_file is not None:
+            self.on_file(file_obj)
+
+
+def ingest_stream(tree: DirTree, chunks: Iterable[str], dir: Optional[str] = None) -> Iterator[File]:
+    """Feed chunks to a JsonIngester, yielding each File as soon as it is complete."""
+    ingester = JsonIngester(tree, dir)
+    for chunk in chunks:
+        yield from ingester.feed(chunk)
+    ingester.close()
@@ -0,0 +1,423 @@
+"""Persistent (immutable, structurally shared) DirTree versions.
+
+Every update returns a new PersistentDirTree that copies only the
+directories on the path from the root to the change and shares everything
+else with the version it was derived from. Nodes store no parent pointers
+or names (names are the keys of their parent's dicts), so one subtree can
+belong to any number of versions, and a move relinks a whole subtree by
+copying two paths.
+
+Keeping every version is O(changed directories) each; rolling back means
+keeping a reference to an older version and branching means updating it.
+Counters and Merkle hashes are cached per node and therefore shared as
+well, so diff between versions only descends into subtrees that differ.
+"""
+
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from .dir_tree_class import (Blob, DirTree, File, Node_Dir, State, Stats, _PATH_ONLY_CONTENT,
+                             _SHOWN_STATES, _fill_hashes, _fill_stats, content_store)
+
+
+class PersistentFile:
+    """Immutable file of a PersistentDirTree: a shared content blob and a state."""
+
+    __slots__ = ('_blob', '_state')
+
+    def __init__(self, blob: Blob, state: State = State.VISIBLE):
+        self._blob = blob
+        self._state = state
+
+    def __repr__(self) -> str:
+        return f"PersistentFile(content={self.content!r}, state={self._state!r})"
+
+    @property
+    def content(self) -> str:
+        return self._blob.data
+
+    @property
+    def state(self) -> State:
+        return self._state
+
+    @property
+    def digest(self) -> bytes:
+        """SHA-256 digest of the UTF-8 encoded content."""
+        return self._blob.digest
+
+    @property
+    def stats(self) -> Stats:
+        return self._blob.stats
+
+
+class PersistentDir:
+    """Immutable directory of a PersistentDirTree.
+
+    children and files map names to nodes and must not be modified once the
+    directory belongs to a version. Counters and the Merkle hash are
+    computed on first use and kept for the lifetime of the node.
+    """
+
+    __slots__ = ('_state', 'children', 'files', '_stats', '_hash')
+
+    def __init__(self, state: State = State.VISIBLE,
+                 children: Optional[Dict[str, 'PersistentDir']] = None,
+                 files: Optional[Dict[str, PersistentFile]] = None):
+        self._state = state
+        self.children: Dict[str, 'PersistentDir'] = children if children is not None else {}
+        self.files: Dict[str, PersistentFile] = files if files is not None else {}
+        self._stats: Optional[Stats] = None
+        self._hash: Optional[bytes] = None
+
+    def __repr__(self) -> str:
+        return (f"PersistentDir(state={self._state!r}, children={len(self.children)}, "
+                f"files={len(self.files)})")
+
+    @property
+    def state(self) -> State:
+        return self._state
+
+    @property
+    def stats(self) -> Stats:
+        """Aggregate counters (words, bytes, lines, files) of this subtree."""
+        if self._stats is None:
+            _fill_stats(self)
+        return self._stats
+
+    @property
+    def digest(self) -> bytes:
+        """Merkle hash of this subtree, equal to Node_Dir.digest of the same subtree."""
+        if self._hash is None:
+            _fill_hashes(self)
+        return self._hash
+
+    def _copy(self) -> 'PersistentDir':
+        """Shallow copy with its own dicts, to be edited before it joins a version."""
+        return PersistentDir(self._state, dict(self.children), dict(self.files))
+
+
+def _split(path: str) -> List[str]:
+    return [p for p in path.split('/') if p != ""]
+
+
+def _freeze_file(file_obj: File) -> PersistentFile:
+    blob = file_obj._blob if file_obj._blob is not None else content_store.put(file_obj.content)
+    return PersistentFile(blob, file_obj.state)
+
+
+def _freeze(tree: DirTree, start: Node_Dir) -> PersistentDir:
+    """Copy the subtree of tree below start into persistent nodes (contents are shared).
+
+    Counters and Merkle hashes already cached on the source directories are
+    kept, since the copy has the same contents, names and states.
+    """
+    nodes: Dict[int, PersistentDir] = {}
+    for _, obj, _ in tree._walk(start, order="post"):
+        if isinstance(obj, File):
+            continue
+        files = {name: _freeze_file(file_obj) for name, file_obj in obj.files.items()}
+        children = {name: nodes.pop(id(child)) for name, child in obj.children.items()}
+        node = PersistentDir(obj.state, children, files)
+        node._stats = obj._stats
+        node._hash = obj._hash
+        nodes[id(obj)] = node
+    return nodes[id(start)]
+
+
+class _Editor:
+    """Path copier for one update: each directory is copied at most once."""
+
+    def __init__(self, root: PersistentDir):
+        self.root = root._copy()
+        self._copies: Dict[Tuple[str, ...], PersistentDir] = {(): self.root}
+
+    def dir(self, parts: List[str]) -> PersistentDir:
+        """Return the editable copy of the directory at parts, creating missing ones."""
+        key = tuple(parts)
+        depth = len(key)
+        # Copy down from the deepest directory already copied
+        while key[:depth] not in self._copies:
+            depth -= 1
+        node = self._copies[key[:depth]]
+        for i in range(depth, len(key)):
+            child = node.children.get(key[i])
+            child = child._copy() if child is not None else PersistentDir()
+            node.children[key[i]] = child
+            self._copies[key[:i + 1]] = child
+            node = child
+        return node
+
+
+class PersistentDirTree:
+    """Immutable version of a directory tree with structurally shared nodes.
+
+    Update methods (with_file, with_files, with_file_state, with_dir_state,
+    with_moved, without) leave this version unchanged and return a new one
+    in O(depth) copied directories per changed path (with_dir_state copies
+    the directory's subtree). Reads mirror DirTree: generate_file_dict,
+    get_stats, get_digest, dir_exists, walk and diff.
+    """
+
+    __slots__ = ('root',)
+
+    def __init__(self, root: Optional[PersistentDir] = None):
+        self.root = root if root is not None else PersistentDir()
+
+    def __repr__(self) -> str:
+        return f"PersistentDirTree(files={self.root.stats.files})"
+
+    @classmethod
+    def from_tree(cls, tree: DirTree) -> 'PersistentDirTree':
+        """Build a version with the structure, states and contents of tree (contents are shared)."""
+        return cls(_freeze(tree, tree.root))
+
+    def to_tree(self) -> DirTree:
+        """Build a mutable DirTree with this version's structure, states and contents."""
+        root = Node_Dir(path="", state=self.root._state)
+        stack = [(self.root, root)]
+        while stack:
+            source, target = stack.pop()
+            for name, pfile in source.files.items():
+                file_obj = File(path=name, content=None, state=pfile._state)
+                file_obj._blob = pfile._blob
+                file_obj.parent = target
+                target.files[file_obj._name] = file_obj
+            for name, child in source.children.items():
+                node = Node_Dir(path=name, state=child._state)
+                node.parent = target
+                target.children[node._name] = node
+                stack.append((child, node))
+        return DirTree(root)
+
+    # Reads
+
+    def _lookup(self, parts: List[str]) -> Optional[PersistentDir]:
+        node = self.root
+        for name in parts:
+            node = node.children.get(name)
+            if node is None:
+                return None
+        return node
+
+    def _dir(self, dirpath: str) -> PersistentDir:
+        node = self._lookup(_split(dirpath))
+        if node is None:
+            raise ValueError(f"Directory path '{dirpath}' does not exist")
+        return node
+
+    def node(self, path: str) -> Union[PersistentDir, PersistentFile]:
+        """Return the file or directory at path.
+
+        Raises:
+            ValueError: If the path does not exist
+        """
+        parts = _split(path)
+        if not parts:
+            return self.root
+        parent = self._lookup(parts[:-1])
+        obj = None
+        if parent is not None:
+            obj = parent.files.get(parts[-1]) or parent.children.get(parts[-1])
+        if obj is None:
+            raise ValueError(f"Path '{path}' does not exist")
+        return obj
+
+    def dir_exists(self, dirpath: str) -> bool:
+        """Check if a directory exists in this version."""
+        return self._lookup(_split(dirpath)) is not None
+
+    def walk(self, dir: Optional[str] = None) -> Iterator[Tuple[str, Union[PersistentDir, PersistentFile]]]:
+        """Iterate over (path, node) in DirTree.walk preorder without recursion.
+
+        Raises:
+            ValueError: If the directory does not exist
+        """
+        start = self._dir(dir) if dir is not None else self.root
+        start_path = '/'.join(_split(dir)) if dir is not None else ""
+        stack = [(start_path, start)]
+        while stack:
+            path, node = stack.pop()
+            yield path, node
+            prefix = path + '/' if path else ""
+            for name, file_obj in node.files.items():
+                yield prefix + name, file_obj
+            for name, child in reversed(node.children.items()):
+                stack.append((prefix + name, child))
+
+    def generate_file_dict(self, dir: Optional[str] = None) -> Dict[str, str]:
+        """Same result as DirTree.generate_file_dict for this version.
+
+        Raises:
+            ValueError: If the directory path does not exist
+        """
+        file_dict = {}
+        start = self._dir(dir) if dir is not None else self.root
+        stack = [('/'.join(_split(dir)) if dir is not None else "", start)]
+        while stack:
+            path, node = stack.pop()
+            if node._state not in _SHOWN_STATES:
+                continue
+            prefix = path + '/' if path else ""
+            for name, file_obj in node.files.items():
+                if file_obj._state == State.VISIBLE:
+                    file_dict[prefix + name] = file_obj.content
+                elif file_obj._state == State.VISIBLE_PATH:
+                    file_dict[prefix + name] = _PATH_ONLY_CONTENT
+            for name, child in reversed(node.children.items()):
+                stack.append((prefix + name, child))
+        return file_dict
+
+    def get_stats(self, dirpath: str = "") -> Stats:
+        """Aggregate counters of a directory, cached per node across versions.
+
+        Raises:
+            ValueError: If the directory path does not exist
+        """
+        return self._dir(dirpath).stats
+
+    def get_digest(self, dirpath: str = "") -> bytes:
+        """Merkle hash of a directory, equal to DirTree.get_digest for the same tree.
+
+        Raises:
+            ValueError: If the directory path does not exist
+        """
+        return self._dir(dirpath).digest
+
+    def diff(self, other: 'PersistentDirTree') -> 'TreeDiff':
+        """File changes turning this version into other, like DirTree.diff.
+
+        Subtrees shared between the versions have equal cached hashes and are
+        skipped, so the cost follows the size of the change.
+        """
+        from .dir_tree_diff import diff_trees
+        return diff_trees(self, other)
+
+    # Updates
+
+    def with_file(self, path: str, content: str, state: State = State.VISIBLE) -> 'PersistentDirTree':
+        """Return a version with the file at path added or replaced.
+
+        Raises:
+            ValueError: If path is empty
+        """
+        parts = _split(path)
+        if not parts:
+            raise ValueError(f"Invalid file path '{path}'")
+        editor = _Editor(self.root)
+        editor.dir(parts[:-1]).files[parts[-1]] = PersistentFile(content_store.put(content), state)
+        return PersistentDirTree(editor.root)
+
+    def with_files(self, files: Union[List[Dict[str, str]], Dict[str, str]],
+                   dir: Optional[str] = None) -> 'PersistentDirTree':
+        """Return a version with the files of a JSON response added, like add_files_to_dir_tree.
+
+        Directories shared by several files are copied once.
+
+        Raises:
+            ValueError: If files is not a dict or a list of dicts, or a path is empty
+        """
+        editor = _Editor(self.root)
+        for filepath, content in DirTree._iter_json_files(files, dir):
+            parts = _split(filepath)
+            if not parts:
+                raise ValueError(f"Invalid file path '{filepath}'")
+            editor.dir(parts[:-1]).files[parts[-1]] = PersistentFile(content_store.put(content))
+        return PersistentDirTree(editor.root)
+
+    def with_file_state(self, path: str, state: State) -> 'PersistentDirTree':
+        """Return a version with a file set to state, like DirTree.change_file_state.
+
+        Setting VISIBLE also makes the HIDDEN parent directories VISIBLE.
+
+        Raises:
+            ValueError: If the file path does not exist
+        """
+        parts = _split(path)
+        parent = self._lookup(parts[:-1])
+        if not parts or parent is None or parts[-1] not in parent.files:
+            raise ValueError(f"File path '{path}' does not exist")
+        old = parent.files[parts[-1]]
+        if old._state == state and (state != State.VISIBLE or all(
+                self._lookup(parts[:depth])._state != State.HIDDEN for depth in range(len(parts)))):
+            return self
+        editor = _Editor(self.root)
+        editor.dir(parts[:-1]).files[parts[-1]] = PersistentFile(old._blob, state)
+        if state == State.VISIBLE:
+            for depth in range(len(parts)):
+                node = editor.dir(parts[:depth])
+                if node._state == State.HIDDEN:
+                    node._state = State.VISIBLE
+        return PersistentDirTree(editor.root)
+
+    def with_dir_state(self, path: str, state: State) -> 'PersistentDirTree':
+        """Return a version with a directory and everything below it set to state.
+
+        Like DirTree.change_dir_state; the directory's subtree is rebuilt.
+
+        Raises:
+            ValueError: If the directory path does not exist
+        """
+        parts = _split(path)
+        source = self._dir(path)
+        top = PersistentDir(state)
+        stack = [(source, top)]
+        while stack:
+            old, new = stack.pop()
+            for name, file_obj in old.files.items():
+                new.files[name] = (file_obj if file_obj._state == state
+                                   else PersistentFile(file_obj._blob, state))
+            for name, child in old.children.items():
+                new.children[name] = PersistentDir(state)
+                stack.append((child, new.children[name]))
+        if not parts:
+            return PersistentDirTree(top)
+        editor = _Editor(self.root)
+        editor.dir(parts[:-1]).children[parts[-1]] = top
+        return PersistentDirTree(editor.root)
+
+    def without(self, path: str) -> 'PersistentDirTree':
+        """Return a version without the file or directory at path.
+
+        Raises:
+            ValueError: If the path does not exist or is the root
+        """
+        parts = _split(path)
+        parent = self._lookup(parts[:-1])
+        if not parts or parent is None or (parts[-1] not in parent.files and
+                                           parts[-1] not in parent.children):
+            raise ValueError(f"Path '{path}' does not exist")
+        editor = _Editor(self.root)
+        node = editor.dir(parts[:-1])
+        if parts[-1] in node.files:
+            del node.files[parts[-1]]
+        else:
+            del node.children[parts[-1]]
+        return PersistentDirTree(editor.root)
+
+    def with_moved(self, src: str, dst: str) -> 'PersistentDirTree':
+        """Return a version with a file or directory moved to dst, sharing the moved subtree.
+
+        Missing parent directories of dst are created.
+
+        Raises:
+            ValueError: If src does not exist or is the root, dst already exists,
+                        or dst is inside the moved directory
+        """
+        src_parts, dst_parts = _split(src), _split(dst)
+        obj = self.node(src)
+        if not src_parts:
+            raise ValueError("Cannot move the root directory")
+        dst_parent = self._lookup(dst_parts[:-1])
+        if not dst_parts or (dst_parent is not None and (dst_parts[-1] in dst_parent.files or
+                                                         dst_parts[-1] in dst_parent.children)):
+            raise ValueError(f"Path '{dst}' already exists")
+        if isinstance(obj, PersistentDir) and dst_parts[:len(src_parts)] == src_parts:
+            raise ValueError(f"Cannot move '{src}' inside itself")
+        editor = _Editor(self.root)
+        source = editor.dir(src_parts[:-1])
+        if isinstance(obj, PersistentFile):
+            del source.files[src_parts[-1]]
+            editor.dir(dst_parts[:-1]).files[dst_parts[-1]] = obj
+        else:
+            del source.children[src_parts[-1]]
+            editor.dir(dst_parts[:-1]).children[dst_parts[-1]] = obj
+        return PersistentDirTree(editor.root)
@@ -0,0 +1,142 @@
+"""Inverted full-text index over DirTree file contents."""
+
+import math
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from .dir_tree_class import DirTree, File, Node_Dir
+
+# Identifiers and numbers; dotted names (os.path) split into their parts
+_TERM_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_]*|[0-9]+')
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase search terms."""
+    return [term.lower() for term in _TERM_RE.findall(text)]
+
+
+class TextIndex:
+    """Inverted index (term -> {file: term frequency}) of the files of a DirTree.
+
+    Created with DirTree.enable_text_index. The tree reports every added,
+    replaced, edited and removed file; changed files are only queued and are
+    tokenized on the next search, so bulk changes cost nothing until the
+    index is queried. Postings refer to the file nodes rather than their
+    paths, so moving or renaming directories does not touch the index, and
+    the files of a removed directory are dropped on the next query.
+    """
+
+    def __init__(self, tree: DirTree):
+        self.tree = tree
+        # Keyed by id(file); _docs holds the file and its terms, to remove its postings again
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._docs: Dict[int, Tuple[File, Counter]] = {}
+        self._pending: Dict[int, Tuple[File, bool]] = {}
+        self._removed_dirs: List[Node_Dir] = []
+
+    def __len__(self) -> int:
+        """Number of indexed files."""
+        self._apply_pending()
+        return len(self._docs)
+
+    def add(self, file_obj: File) -> None:
+        """Queue a new or changed file for indexing."""
+        self._pending[id(file_obj)] = (file_obj, True)
+
+    def remove(self, file_obj: File) -> None:
+        """Queue a removed file for removal from the index."""
+        self._pending[id(file_obj)] = (file_obj, False)
+
+    def remove_dir(self, node: Node_Dir) -> None:
+        """Queue the files of a removed directory for removal from the index."""
+        self._removed_dirs.append(node)
+
+    def clear(self) -> None:
+        """Drop every file from the index."""
+        self._postings.clear()
+        self._docs.clear()
+        self._pending.clear()
+        self._removed_dirs.clear()
+
+    def _apply_pending(self) -> None:
+        removed_dirs, self._removed_dirs = self._removed_dirs, []
+        stack = removed_dirs
+        while stack:
+            node = stack.pop()
+            for file_obj in node.files.values():
+                self._drop(id(file_obj))
+            stack.extend(node.children.values())
+        pending, self._pending = self._pending, {}
+        for key, (file_obj, present) in pending.items():
+            self._drop(key)
+            if not present or self.tree._owned_path(file_obj) is None:
+                continue
+            terms = Counter(tokenize(file_obj.content))
+            self._docs[key] = (file_obj, terms)
+            for term, count in terms.items():
+                self._postings.setdefault(term, {})[key] = count
+
+    def _drop(self, key: int) -> None:
+        doc = self._docs.pop(key, None)
+        if doc is None:
+            return
+        for term in doc[1]:
+            postings = self._postings[term]
+            del postings[key]
+            if not postings:
+                del self._postings[term]
+
+    def _path(self, key: int) -> Optional[str]:
+        """Current path of an indexed file, dropping it if it left the tree."""
+        path = self.tree._owned_path(self._docs[key][0])
+        if path is None:
+            self._drop(key)
+        return path
+
+    def postings(self, term: str) -> Dict[str, int]:
+        """Files containing term, by path, mapped to the number of occurrences."""
+        self._apply_pending()
+        result = {}
+        for key, count in list(self._postings.get(term.lower(), {}).items()):
+            path = self._path(key)
+            if path is not None:
+                result[path] = count
+        return result
+
+    def search(self, terms: Union[str, Iterable[str]], limit: Optional[int] = None,
+               dir: Optional[str] = None) -> List[Tuple[str, float]]:
+        """Rank files by TF-IDF over the query terms.
+
+        A file scores sum((1 + log tf) * log(1 + N / df)) over the terms it
+        contains, with tf its count of the term, N the number of indexed files
+        and df the number of files containing the term.
+
+        Args:
+            terms: Query text (tokenized like file contents) or a list of terms
+            limit: Optional maximum number of results
+            dir: Optional directory path; only files below it are returned
+
+        Returns:
+            (path, score) pairs, best first; ties are ordered by path
+        """
+        self._apply_pending()
+        if isinstance(terms, str):
+            terms = tokenize(terms)
+        prefix = dir.strip('/') + '/' if dir and dir.strip('/') else ""
+        total = len(self._docs)
+        scores: Dict[str, float] = {}
+        paths: Dict[int, Optional[str]] = {}
+        for term in dict.fromkeys(term.lower() for term in terms):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + total / len(postings))
+            for key, count in list(postings.items()):
+                if key not in paths:
+                    paths[key] = self._path(key)
+                path = paths[key]
+                if path is not None and path.startswith(prefix):
+                    scores[path] = scores.get(path, 0.0) + (1 + math.log(count)) * idf
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:limit] if limit is not None else ranked
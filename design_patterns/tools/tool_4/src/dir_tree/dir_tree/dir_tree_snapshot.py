@@ -0,0 +1,263 @@
+"""Binary snapshot format for DirTree, loaded through mmap.
+
+Layout (little endian):
+
+    header   magic, version, counts and section offsets (_HEADER)
+    names    every distinct node name and disk path, UTF-8, separated by NUL bytes
+    dirs     one _DIR record per directory in preorder (parents first)
+    files    one _FILE record per file
+    lazy     one _LAZY record per LazyFile whose content was never loaded:
+             disk path, size and mtime
+    blobs    one _BLOB record per distinct content: data offset, length,
+             word and line counts, SHA-256 digest
+    data     the UTF-8 encoded contents, each distinct content once
+
+Loading decodes only the names and the fixed-size records. File contents
+stay in the mapped file until they are accessed; their digest and counters
+are read from the blob records, so get_stats, equality and content dedup
+work without decoding anything. Unloaded LazyFiles are stored as references
+to their disk file, not read, and are loaded as LazyFiles again.
+"""
+
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from typing import Dict, List, Optional
+
+from .dir_tree_class import Blob, DirTree, File, LazyFile, Node_Dir, State, Stats, content_store
+
+_MAGIC = b"DTSNAP\x00\x01"
+_VERSION = 2
+# magic, version, names, dirs, files, lazy, blobs count, then names/dirs/files/lazy/blobs/data offsets
+_HEADER = struct.Struct("<8sIIIIIIQQQQQQ")
+_NAMES_LEN = struct.Struct("<Q")
+_DIR = struct.Struct("<IIB")           # name index, parent dir index, state
+_FILE = struct.Struct("<IIBI")         # name index, parent dir index, state, blob or lazy index
+_LAZY = struct.Struct("<IQd")          # disk path name index, size, mtime
+_BLOB = struct.Struct("<QQQQ32s")      # data offset, length, words, lines, digest
+_NO_PARENT = 0xFFFFFFFF
+# Set in a _FILE record's last field when it indexes the lazy records
+_LAZY_FLAG = 0x80000000
+
+_STATE_CODES = {state: code for code, state in enumerate(State)}
+_CODE_STATES = list(State)
+
+
+class SnapshotFile(File):
+    """File whose content stays in a memory-mapped snapshot until accessed.
+
+    The digest and counters come from the snapshot, so they are available
+    without decoding. The first access to `content` decodes it into the
+    shared content store; assigning `content` works as for any File.
+    """
+    __slots__ = ('_mm', '_offset', '_length', '_digest', '_snapshot_stats')
+
+    def __init__(self, path: str, mm: mmap.mmap, offset: int, length: int, digest: bytes,
+                 stats: Stats, state: State = State.VISIBLE, parent: Optional[Node_Dir] = None,
+                 blob: Optional[Blob] = None):
+        # Slots are set directly: loading creates one of these per file
+        self._name = sys.intern(path)
+        self._state = state
+        self.parent = parent
+        self._mm = mm
+        self._offset = offset
+        self._length = length
+        self._digest = digest
+        self._snapshot_stats = stats
+        # A content already held in memory is shared instead of decoded again
+        self._blob = blob
+
+    @property
+    def is_loaded(self) -> bool:
+        """True once the content was decoded or assigned."""
+        return self._blob is not None
+
+    @property
+    def content(self) -> str:
+        """Content of the file, decoded from the snapshot on first access."""
+        if self._blob is None:
+            data = self._mm[self._offset:self._offset + self._length].decode('utf-8')
+            self._blob = content_store.put(data, self._digest)
+        return self._blob.data
+
+    @content.setter
+    def content(self, value: str) -> None:
+        if self._blob is None:
+            # Compared by digest, so equal content is not a change
+            self._blob = content_store.put(value)
+            if self._blob.digest != self._digest and self.parent is not None:
+                self.parent._changed(self)
+            return
+        File.content.fset(self, value)
+
+    @property
+    def digest(self) -> bytes:
+        """SHA-256 digest of the content."""
+        if self._blob is None:
+            return self._digest
+        return self._blob.digest
+
+    @property
+    def stats(self) -> Stats:
+        """Counters of the content, read from the snapshot until it is decoded."""
+        if self._blob is None:
+            return self._snapshot_stats
+        return self._blob.stats
+
+    def raw_bytes(self) -> bytes:
+        """UTF-8 encoded content, copied from the snapshot without decoding."""
+        if self._blob is None:
+            return self._mm[self._offset:self._offset + self._length]
+        return self._blob.data.encode('utf-8')
+
+
+def save_snapshot(tree: DirTree, path: str) -> int:
+    """Write tree to path in the binary snapshot format.
+
+    The file is written to a temporary file and moved into place, so trees
+    still mapping an older snapshot at the same path keep working.
+
+    Args:
+        tree: DirTree to save
+        path: Destination file
+
+    Returns:
+        Number of bytes written
+    """
+    names: Dict[str, int] = {}
+    dir_index: Dict[int, int] = {}
+    dir_records: List[bytes] = []
+    file_records: List[bytes] = []
+    lazy_records: List[bytes] = []
+    blob_index: Dict[bytes, int] = {}
+    blob_records: List[bytes] = []
+    chunks: List[bytes] = []
+    data_size = 0
+
+    def name_index(name: str) -> int:
+        index = names.get(name)
+        if index is None:
+            index = names[name] = len(names)
+        return index
+
+    for _, obj, _ in tree._walk(tree.root):
+        parent_index = _NO_PARENT if obj.parent is None else dir_index[id(obj.parent)]
+        if isinstance(obj, Node_Dir):
+            dir_index[id(obj)] = len(dir_records)
+            dir_records.append(_DIR.pack(name_index(obj._name), parent_index, _STATE_CODES[obj.state]))
+            continue
+
+        if isinstance(obj, LazyFile) and not obj.is_loaded:
+            # The disk file is referenced, neither read nor decoded
+            file_records.append(_FILE.pack(name_index(obj._name), dir_index[id(obj.parent)],
+                                           _STATE_CODES[obj.state], _LAZY_FLAG | len(lazy_records)))
+            lazy_records.append(_LAZY.pack(name_index(obj.disk_path), obj.size, obj.mtime))
+            continue
+        if isinstance(obj, SnapshotFile) and obj._blob is None:
+            digest, data, stats = obj._digest, obj.raw_bytes(), obj._snapshot_stats
+        else:
+            digest, data, stats = obj.digest, None, obj.stats
+
+        index = blob_index.get(digest)
+        if index is None:
+            if data is None:
+                data = obj.content.encode('utf-8')
+            index = blob_index[digest] = len(blob_records)
+            blob_records.append(_BLOB.pack(data_size, len(data), stats.words, stats.lines, digest))
+            chunks.append(data)
+            data_size += len(data)
+        file_records.append(_FILE.pack(name_index(obj._name), dir_index[id(obj.parent)],
+                                       _STATE_CODES[obj.state], index))
+
+    names_data = "\0".join(names).encode('utf-8')
+    names_offset = _HEADER.size
+    dirs_offset = names_offset + _NAMES_LEN.size + len(names_data)
+    files_offset = dirs_offset + _DIR.size * len(dir_records)
+    lazy_offset = files_offset + _FILE.size * len(file_records)
+    blobs_offset = lazy_offset + _LAZY.size * len(lazy_records)
+    data_offset = blobs_offset + _BLOB.size * len(blob_records)
+    header = _HEADER.pack(_MAGIC, _VERSION, len(names), len(dir_records), len(file_records),
+                          len(lazy_records), len(blob_records), names_offset, dirs_offset,
+                          files_offset, lazy_offset, blobs_offset, data_offset)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".snapshot-")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(header)
+            f.write(_NAMES_LEN.pack(len(names_data)))
+            f.write(names_data)
+            f.write(b"".join(dir_records))
+            f.write(b"".join(file_records))
+            f.write(b"".join(lazy_records))
+            f.write(b"".join(blob_records))
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return data_offset + data_size
+
+
+def load_snapshot(path: str) -> DirTree:
+    """Load a DirTree saved with save_snapshot.
+
+    The snapshot is memory-mapped; only names and records are decoded.
+
+    Raises:
+        ValueError: If path is not a snapshot of a supported version
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < _HEADER.size:
+            raise ValueError(f"'{path}' is not a DirTree snapshot")
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    (magic, version, _, num_dirs, num_files, num_lazy, num_blobs, names_offset, dirs_offset,
+     files_offset, lazy_offset, blobs_offset, data_offset) = _HEADER.unpack_from(mm, 0)
+    if magic != _MAGIC:
+        raise ValueError(f"'{path}' is not a DirTree snapshot")
+    if version != _VERSION:
+        raise ValueError(f"Unsupported DirTree snapshot version {version}")
+
+    (names_len,) = _NAMES_LEN.unpack_from(mm, names_offset)
+    start = names_offset + _NAMES_LEN.size
+    names = [sys.intern(name) for name in mm[start:start + names_len].decode('utf-8').split("\0")]
+    view = memoryview(mm)
+
+    # Nodes are linked directly; the tree indexes them once at the end
+    dirs: List[Node_Dir] = []
+    for name_index, parent_index, code in _DIR.iter_unpack(view[dirs_offset:files_offset]):
+        node = Node_Dir(path=names[name_index], state=_CODE_STATES[code])
+        if parent_index != _NO_PARENT:
+            parent = dirs[parent_index]
+            node.parent = parent
+            parent.children[node._name] = node
+        dirs.append(node)
+
+    # Per distinct content: location, counters and the blob if it is already in memory
+    blobs = [(data_offset + offset, length, Stats(words=words, bytes=length, lines=lines, files=1),
+              digest, content_store.get(digest))
+             for offset, length, words, lines, digest in _BLOB.iter_unpack(view[blobs_offset:data_offset])]
+    lazy = list(_LAZY.iter_unpack(view[lazy_offset:blobs_offset]))
+    num_loaded = 0
+    for name_index, parent_index, code, blob_index in _FILE.iter_unpack(view[files_offset:lazy_offset]):
+        parent = dirs[parent_index]
+        name = names[name_index]
+        if blob_index & _LAZY_FLAG:
+            disk_index, size, mtime = lazy[blob_index & ~_LAZY_FLAG]
+            parent.files[name] = LazyFile(name, names[disk_index], _CODE_STATES[code],
+                                          size, mtime, parent)
+        else:
+            offset, length, stats, digest, blob = blobs[blob_index]
+            parent.files[name] = SnapshotFile(name, mm, offset, length, digest, stats,
+                                              _CODE_STATES[code], parent, blob)
+        num_loaded += 1
+    view.release()
+
+    if (len(dirs) != num_dirs or num_loaded != num_files or len(lazy) != num_lazy
+            or len(blobs) != num_blobs):
+        raise ValueError(f"Corrupt DirTree snapshot '{path}'")
+    return DirTree(dirs[0]) if dirs else DirTree()
@@ -0,0 +1,150 @@
+"""Immutable visibility overlays on top of a DirTree."""
+
+from typing import Dict, Iterator, Optional, TextIO
+
+from .dir_tree_class import DirTree, State, StoreResult, _tree_path
+
+
+class VisibilityView:
+    """Immutable set of state overrides layered over a DirTree.
+
+    A view never mutates the tree it was created from. Each with_* call returns
+    a new view holding only the overrides, so creating a view costs O(overrides)
+    instead of a copy of the tree, and several views (e.g. one per prompt) can
+    share the same tree at the same time.
+
+    Overrides mirror the semantics of DirTree.change_dir_state and
+    DirTree.change_file_state:
+    - with_dir_state applies to the directory and everything below it
+    - with_file_state applies to the file only; setting VISIBLE also unhides
+      the HIDDEN parent directories (each directory itself, not its contents)
+    """
+
+    __slots__ = ('tree', '_own', '_subtree')
+
+    def __init__(self, tree: DirTree, own: Optional[Dict[str, State]] = None,
+                 subtree: Optional[Dict[str, State]] = None):
+        """Create a view of tree.
+
+        Args:
+            tree: DirTree the view reads from
+            own: Overrides applying only to the entry at the path
+            subtree: Overrides applying to a directory and everything below it
+        """
+        self.tree = tree
+        self._own = dict(own) if own else {}
+        self._subtree = dict(subtree) if subtree else {}
+
+    def __repr__(self) -> str:
+        return (f"VisibilityView(own={len(self._own)} overrides, "
+                f"subtree={len(self._subtree)} overrides)")
+
+    @staticmethod
+    def _normalize(path: str) -> str:
+        return '/'.join(p for p in path.split('/') if p != "")
+
+    def _inherited_state(self, path: str) -> Optional[State]:
+        """Return the nearest subtree override on a strict ancestor of path."""
+        if not path or not self._subtree:
+            return None
+        parts = path.split('/')
+        for i in range(len(parts) - 1, 0, -1):
+            state = self._subtree.get('/'.join(parts[:i]))
+            if state is not None:
+                return state
+        return self._subtree.get("")
+
+    def state_of(self, path: str) -> State:
+        """Return the effective state of a file or directory under this view.
+
+        Raises:
+            ValueError: If the path does not exist in the tree
+        """
+        file_obj = self.tree._find_file(path)
+        if file_obj is not None:
+            node_state = file_obj.state
+        else:
+            node = self.tree._find_dir(path)
+            if node is None:
+                raise ValueError(f"Path '{path}' does not exist")
+            path = self._normalize(path)
+            node_state = node.state
+            if path in self._subtree:
+                return self._own.get(path, self._subtree[path])
+        return self._own.get(path, self._inherited_state(path) or node_state)
+
+    def with_dir_state(self, path: str, state: State) -> 'VisibilityView':
+        """Return a new view with a directory and all its contents set to state.
+
+        Raises:
+            ValueError: If the directory path does not exist
+        """
+        if self.tree._find_dir(path) is None:
+            raise ValueError(f"Directory path '{path}' does not exist")
+        key = self._normalize(path)
+        prefix = key + '/' if key else ""
+
+        # Overrides at or below the directory are superseded by the new one
+        def keep(p: str) -> bool:
+            return p != key and not p.startswith(prefix)
+        own = {p: s for p, s in self._own.items() if keep(p)}
+        subtree = {p: s for p, s in self._subtree.items() if keep(p)}
+        subtree[key] = state
+        return VisibilityView(self.tree, own, subtree)
+
+    def with_file_state(self, path: str, state: State) -> 'VisibilityView':
+        """Return a new view with a file set to state.
+
+        Setting a file to VISIBLE also makes its HIDDEN parent directories
+        VISIBLE, like DirTree.change_file_state.
+
+        Raises:
+            ValueError: If the file path does not exist
+        """
+        file_obj = self.tree._find_file(path)
+        if file_obj is None:
+            raise ValueError(f"File path '{path}' does not exist")
+        view = VisibilityView(self.tree, self._own, self._subtree)
+        view._own[path] = state
+        if state == State.VISIBLE:
+            parent_dir = file_obj.parent
+            while parent_dir is not None:
+                dir_path = _tree_path(parent_dir)
+                if view.state_of(dir_path) == State.HIDDEN:
+                    view._own[dir_path] = State.VISIBLE
+                parent_dir = parent_dir.parent
+        return view
+
+    def with_dir_states(self, paths, state: State) -> 'VisibilityView':
+        """Return a new view with with_dir_state applied to each path in order."""
+        view = self
+        for path in paths:
+            view = view.with_dir_state(path, state)
+        return view
+
+    def with_file_states(self, paths, state: State) -> 'VisibilityView':
+        """Return a new view with with_file_state applied to each path in order."""
+        view = self
+        for path in paths:
+            view = view.with_file_state(path, state)
+        return view
+
+    def generate_file_dict(self, dir: Optional[str] = None) -> Dict[str, str]:
+        """DirTree.generate_file_dict using this view's states."""
+        return self.tree.generate_file_dict(dir, view=self)
+
+    def iter_json(self, **kwargs) -> Iterator[str]:
+        """DirTree.iter_json using this view's states."""
+        return self.tree.iter_json(view=self, **kwargs)
+
+    def write_json(self, stream: TextIO, **kwargs) -> None:
+        """DirTree.write_json using this view's states."""
+        self.tree.write_json(stream, view=self, **kwargs)
+
+    def store_files(self, output_dir: str) -> str:
+        """DirTree.store_files using this view's states."""
+        return self.tree.store_files(output_dir, view=self)
+
+    def sync_files(self, output_dir: str, max_workers: int = 8) -> StoreResult:
+        """DirTree.sync_files using this view's states."""
+        return self.tree.sync_files(output_dir, max_workers, view=self)
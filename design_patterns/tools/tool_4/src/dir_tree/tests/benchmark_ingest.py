@@ -0,0 +1,79 @@
+"""Ingestion benchmark: per-file add_file vs the json_to_tree bulk loader.
+
+Builds the same tree of N files (default 100,000) from a JSON-style
+path -> contents dict twice and reports the time taken:
+
+1. Per-file path: a dir-prefixing get_full_path and one add_file call per
+   entry, as json_to_tree did before the bulk loader.
+2. Bulk loader: DirTree.json_to_tree, which reuses the parent directory of
+   consecutive entries and links the file nodes directly.
+
+Both trees are checked to hold the same files.
+
+Usage: PYTHONPATH=.. python3 benchmark_ingest.py [num_files]
+"""
+
+import gc
+import sys
+import time
+from typing import Dict, Optional
+
+from dir_tree import DirTree
+
+
+def make_files(num_files: int) -> Dict[str, str]:
+    """Path -> contents for a 3 level layout, files grouped by directory as in a response."""
+    files_per_dir = max(1, num_files // 2500)
+    files = {}
+    for i in range(num_files):
+        d = i // files_per_dir
+        files[f"pkg_{d // 50:02d}/module_{d % 50:02d}/file_{i % files_per_dir:04d}.py"] = f"value = {i}\n"
+    return files
+
+
+def build_per_file(files: Dict[str, str], dir: Optional[str]) -> DirTree:
+    tree = DirTree()
+
+    def get_full_path(filepath: str) -> str:
+        if dir is not None:
+            dir_clean = dir.strip('/')
+            filepath_clean = filepath.lstrip('/')
+            if dir_clean:
+                return '/'.join([dir_clean, filepath_clean])
+            else:
+                return filepath_clean
+        return filepath
+
+    for filepath, content in files.items():
+        tree.add_file(get_full_path(filepath), content)
+    return tree
+
+
+def build_bulk(files: Dict[str, str], dir: Optional[str]) -> DirTree:
+    tree = DirTree()
+    tree.json_to_tree(files, dir)
+    return tree
+
+
+def measure(label: str, build, files: Dict[str, str], dir: Optional[str], repeat: int = 3):
+    best = None
+    tree = None
+    for _ in range(repeat):
+        tree = None
+        gc.collect()
+        start = time.perf_counter()
+        tree = build(files, dir)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"  {label:<28} {best:8.3f} s {best / len(files) * 1e6:8.2f} us/file")
+    return best, tree
+
+
+if __name__ == "__main__":
+    num_files = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    files = make_files(num_files)
+    print(f"\nBuilding a tree of {num_files:,} files (best of 3)")
+    per_file, per_file_tree = measure("per-file add_file", build_per_file, files, "project")
+    bulk, bulk_tree = measure("json_to_tree bulk loader", build_bulk, files, "project")
+    assert per_file_tree.generate_file_dict() == bulk_tree.generate_file_dict()
+    print(f"\n  Bulk loader takes {bulk / per_file:.0%} of the per-file time")
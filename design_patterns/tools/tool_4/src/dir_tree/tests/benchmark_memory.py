@@ -0,0 +1,113 @@
+"""Memory benchmark: dataclass nodes with full paths vs slotted nodes.
+
+Builds the same tree of N files (default 1,000,000) twice and reports the
+memory held by the nodes, measured with tracemalloc:
+
+1. Legacy layout: @dataclass File/Node_Dir with a per-instance __dict__ and
+   the full path string stored on every node.
+2. Current layout: slotted File/Node_Dir with interned names and parent
+   pointers (paths computed on demand).
+
+The current layout is also measured through DirTree.add_file, which adds the
+path index on top of the nodes.
+
+Usage: PYTHONPATH=.. python3 benchmark_memory.py [num_files]
+"""
+
+import gc
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from typing import Dict
+
+from dir_tree import DirTree, Node_Dir, File, State
+
+
+@dataclass
+class LegacyFile:
+    """File node as stored before the slotted layout."""
+    path: str
+    content: str
+    state: State = State.VISIBLE
+
+
+@dataclass
+class LegacyNode_Dir:
+    """Directory node as stored before the slotted layout."""
+    path: str
+    state: State = State.VISIBLE
+    children: Dict[str, 'LegacyNode_Dir'] = field(default_factory=dict)
+    files: Dict[str, LegacyFile] = field(default_factory=dict)
+
+
+def iter_layout(num_files: int):
+    """Yield (top, sub, filename) for a 3 level layout with ~100 entries per level."""
+    files_per_dir = max(1, num_files // 10000)
+    count = 0
+    for top in range(100):
+        for sub in range(100):
+            for i in range(files_per_dir):
+                if count == num_files:
+                    return
+                yield f"pkg_{top:02d}", f"module_{sub:02d}", f"file_{i:04d}.py"
+                count += 1
+
+
+def build_legacy(num_files: int) -> LegacyNode_Dir:
+    root = LegacyNode_Dir(path="")
+    for top, sub, filename in iter_layout(num_files):
+        top_node = root.children.get(top)
+        if top_node is None:
+            top_node = root.children[top] = LegacyNode_Dir(path=top)
+        sub_node = top_node.children.get(sub)
+        if sub_node is None:
+            sub_node = top_node.children[sub] = LegacyNode_Dir(path=f"{top}/{sub}")
+        sub_node.files[filename] = LegacyFile(path=f"{top}/{sub}/{filename}", content="")
+    return root
+
+
+def build_slotted(num_files: int) -> Node_Dir:
+    root = Node_Dir(path="")
+    for top, sub, filename in iter_layout(num_files):
+        top_node = root.children.get(top)
+        if top_node is None:
+            top_node = Node_Dir(path=top)
+            root._attach_dir(top, top_node)
+        sub_node = top_node.children.get(sub)
+        if sub_node is None:
+            sub_node = Node_Dir(path=sub)
+            top_node._attach_dir(sub, sub_node)
+        sub_node._attach_file(filename, File(path=filename, content=""))
+    return root
+
+
+def build_dir_tree(num_files: int) -> DirTree:
+    tree = DirTree()
+    for top, sub, filename in iter_layout(num_files):
+        tree.add_file(f"{top}/{sub}/{filename}", "")
+    return tree
+
+
+def measure(label: str, build, num_files: int) -> int:
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build(num_files)
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    gc.collect()
+    print(f"  {label:<32} {current / 1e6:10.1f} MB {current / num_files:8.1f} B/file {elapsed:8.2f} s")
+    return current
+
+
+if __name__ == "__main__":
+    num_files = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    print(f"\nMemory held by a tree of {num_files:,} files (tracemalloc)")
+    legacy = measure("legacy dataclass nodes", build_legacy, num_files)
+    slotted = measure("slotted nodes", build_slotted, num_files)
+    measure("DirTree (slotted + path index)", build_dir_tree, num_files)
+    print(f"\n  Slotted nodes use {slotted / legacy:.0%} of the legacy layout "
+          f"({(legacy - slotted) / 1e6:.1f} MB saved)")
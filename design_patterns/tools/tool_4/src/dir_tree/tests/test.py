@@ -1,6 +1,18 @@
 """Tests for dir_tree module."""
 
-from dir_tree import DirTree, Node_Dir, File, State
+import dataclasses
+import gc
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import traceback
+
+from dir_tree import (DirTree, Node_Dir, File, LazyFile, SnapshotFile, State, VisibilityView, ConcurrentDirTree,
+                      PersistentDirTree)
 
 
 def test_json_to_tree():
@@ -494,22 +506,1589 @@ def test_generate_file_dict():
     print("\n✓ test_generate_file_dict PASSED")
 
 
+def test_stats():
+    """Test cached aggregate stats on directories."""
+    print("\n" + "="*60)
+    print("TEST: test_stats")
+    print("="*60)
+    
+    tree = DirTree()
+    tree.add_file("src/main.py", "print('hello')\nprint('world')\n")
+    tree.add_file("src/lib/util.py", "def helper(): pass")
+    tree.add_file("README.md", "# Project")
+    
+    stats = tree.get_stats()
+    print(f"\nRoot stats: {stats}")
+    assert stats.files == 3
+    assert stats.words == 2 + 3 + 2
+    assert stats.lines == 2 + 1 + 1
+    assert stats.bytes == len("print('hello')\nprint('world')\n") + len("def helper(): pass") + len("# Project")
+    print("  ✓ Root stats aggregate all files")
+    
+    src_stats = tree.get_stats("src")
+    assert src_stats.files == 2
+    assert src_stats.words == 5
+    print(f"  ✓ src stats: {src_stats}")
+    
+    # Replacing content updates the aggregates on the ancestor path
+    tree.root.children["src"].children["lib"].files["util.py"].content = "a b c d e f"
+    assert tree.get_stats("src/lib").words == 6
+    assert tree.get_stats("src").words == 8
+    assert tree.get_stats().words == 10
+    print("  ✓ Content replacement updates ancestor stats")
+    
+    # Adding a file updates the aggregates, replacing one does not double count
+    tree.add_files_to_dir_tree({"new.txt": "one two"}, dir="src")
+    tree.add_file("README.md", "# Project README")
+    assert tree.get_stats("src").files == 3
+    assert tree.get_stats().files == 4
+    assert tree.get_stats().words == 13
+    print("  ✓ add_file and add_files_to_dir_tree update stats")
+    
+    print("\n✓ test_stats PASSED")
+
+
+def test_path_index():
+    """Test index backed lookups and batch state changes."""
+    print("\n" + "="*60)
+    print("TEST: test_path_index")
+    print("="*60)
+    
+    tree = DirTree()
+    tree.add_file("src/main.py", "print('hello')")
+    tree.add_file("src/lib/util.py", "def helper(): pass")
+    tree.add_file("tests/test.py", "import unittest")
+    tree.add_dir("replay")
+    
+    assert tree.dirs_exist(["src", "src/lib", "replay", "missing", ""]) == [True, True, True, False, True]
+    print("  ✓ dirs_exist checks a list of paths")
+    
+    count = tree.change_dir_states(["src/lib", "tests"], State.HIDDEN)
+    assert count == 4
+    assert tree.root.children["src"].children["lib"].state == State.HIDDEN
+    assert tree.root.children["tests"].files["test.py"].state == State.HIDDEN
+    print(f"  ✓ change_dir_states updated {count} states")
+    
+    count = tree.change_file_states(["src/lib/util.py", "tests/test.py"], State.VISIBLE)
+    assert count == 4
+    assert tree.root.children["src"].children["lib"].state == State.VISIBLE
+    print(f"  ✓ change_file_states updated {count} states and unhid parents")
+    
+    try:
+        tree.change_file_states(["src/main.py", "src/missing.py"], State.HIDDEN)
+        assert False, "Expected ValueError"
+    except ValueError as e:
+        print(f"  ✓ Missing path raises ValueError: {e}")
+    assert tree.root.children["src"].files["main.py"].state == State.VISIBLE
+    try:
+        tree.change_dir_states(["tests", "src/"], State.HIDDEN)
+        assert False, "Expected ValueError"
+    except ValueError as e:
+        print(f"  ✓ Inexact directory path raises ValueError: {e}")
+    assert tree.root.children["tests"].state == State.VISIBLE
+    print("  ✓ Batch is validated before any change")
+    
+    # The index follows json_to_tree resetting the tree
+    tree.json_to_tree({"docs/index.md": "# Docs"})
+    assert not tree.dir_exists("src")
+    assert tree.generate_file_dict(dir="docs") == {"docs/index.md": "# Docs"}
+    print("  ✓ Index rebuilt after json_to_tree")
+    
+    print("\n✓ test_path_index PASSED")
+
+
+def test_compact_nodes():
+    """Test slotted nodes with paths computed from parent pointers."""
+    print("\n" + "="*60)
+    print("TEST: test_compact_nodes")
+    print("="*60)
+    
+    tree = DirTree()
+    tree.add_file("src/lib/util.py", "def helper(): pass")
+    tree.add_file("tests/lib/util.py", "import unittest")
+    
+    lib_dir = tree.root.children["src"].children["lib"]
+    util = lib_dir.files["util.py"]
+    assert not hasattr(util, "__dict__")
+    assert not hasattr(lib_dir, "__dict__")
+    print("  ✓ File and Node_Dir have no per-instance __dict__")
+    
+    assert util.path == "src/lib/util.py"
+    assert lib_dir.path == "src/lib"
+    assert util.name == "util.py"
+    assert util.parent is lib_dir
+    print(f"  ✓ Paths computed on demand: {lib_dir.path}, {util.path}")
+    
+    other = tree.root.children["tests"].children["lib"].files["util.py"]
+    assert other.name is util.name
+    print("  ✓ Name segments are interned")
+    
+    assert File(path="a.py", content="x") == File(path="a.py", content="x")
+    assert File(path="a.py", content="x") != File(path="a.py", content="y")
+    print("  ✓ Equality compares path, content and state")
+    
+    # Nodes are no longer dataclasses, and the path of an attached node is derived
+    assert not dataclasses.is_dataclass(util)
+    try:
+        util.path = "src/lib/other.py"
+        assert False, "Should have raised AttributeError"
+    except AttributeError:
+        pass
+    detached = File(path="a.py", content="x")
+    detached.path = "b.py"
+    assert detached.path == "b.py"
+    print("  ✓ path is read-only on attached nodes, settable on detached ones")
+    
+    # The name of a named root is not part of the paths below it
+    named = DirTree(Node_Dir(path="proj"))
+    named.add_file("src/a.py", "x")
+    assert named.root.path == "proj"
+    assert named.generate_file_dict() == {"src/a.py": "x"}
+    assert named.dir_exists("src")
+    assert not named.dir_exists("proj/src")
+    assert named.glob("**/*.py") == ["src/a.py"]
+    assert named.change_file_state("src/a.py", State.HIDDEN) == 1
+    assert named.generate_file_dict() == {}
+    named.change_file_state("src/a.py", State.VISIBLE)
+    temp_dir = tempfile.mkdtemp()
+    try:
+        named.store_files(temp_dir)
+        assert os.path.isfile(os.path.join(temp_dir, "proj", "src", "a.py"))
+    finally:
+        shutil.rmtree(temp_dir)
+    print("  ✓ Named root keeps paths relative and is stored as a directory")
+    
+    print("\n✓ test_compact_nodes PASSED")
+
+
+def test_lazy_file():
+    """Test files whose content is read from disk on demand."""
+    print("\n" + "="*60)
+    print("TEST: test_lazy_file")
+    print("="*60)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        disk_path = os.path.join(tmp, "big.py")
+        with open(disk_path, "w", encoding="utf-8") as f:
+            f.write("x = 1\ny = 2\n")
+        
+        tree = DirTree()
+        lazy = tree.add_lazy_file("src/big.py", disk_path)
+        print(f"\n  Added: {lazy}")
+        assert isinstance(lazy, LazyFile)
+        assert lazy.size == 12
+        assert not lazy.is_loaded
+        print("  ✓ Only size and mtime are recorded")
+        
+        assert tree.generate_file_dict() == {"src/big.py": "x = 1\ny = 2\n"}
+        assert tree.get_stats().words == 6
+        assert not lazy.is_loaded
+        print("  ✓ Content read on demand for generate_file_dict and stats")
+        
+        out_dir = os.path.join(tmp, "out")
+        tree.store_files(out_dir)
+        with open(os.path.join(out_dir, "src", "big.py"), encoding="utf-8") as f:
+            assert f.read() == "x = 1\ny = 2\n"
+        print("  ✓ store_files copies the file from disk")
+        
+        digest = lazy.digest
+        root_digest = tree.get_digest()
+        st = os.stat(disk_path)
+        with open(disk_path, "w", encoding="utf-8") as f:
+            f.write("x = 9\ny = 9\n")
+        os.utime(disk_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        assert lazy.digest == digest
+        print("  ✓ Digest cached while size and mtime are unchanged")
+        
+        with open(disk_path, "w", encoding="utf-8") as f:
+            f.write("x = 1\ny = 2\nz = 3\n")
+        os.utime(disk_path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        assert lazy.digest != digest
+        assert lazy.stats.words == 9
+        assert lazy.size == 18
+        assert tree.get_stats().words == 9
+        assert tree.get_digest() != root_digest
+        print("  ✓ Digest and stats recomputed after the disk file changed, up to the root")
+        
+        for name, data in (("a.bin", b"\xff\xfe"), ("b.bin", b"\xfd\xfe")):
+            with open(os.path.join(tmp, name), "wb") as f:
+                f.write(data)
+        a_bin = LazyFile("a.bin", os.path.join(tmp, "a.bin"))
+        b_bin = LazyFile("b.bin", os.path.join(tmp, "b.bin"))
+        assert a_bin.content == b_bin.content
+        assert a_bin.digest != b_bin.digest
+        assert lazy.digest == File("x", lazy.content).digest
+        print("  ✓ Digest covers the raw bytes on disk")
+        
+        lazy.content = "z = 3\n"
+        assert lazy.is_loaded
+        assert tree.generate_file_dict() == {"src/big.py": "z = 3\n"}
+        assert tree.get_stats().words == 3
+        print("  ✓ Assigning content keeps it in memory")
+    
+    print("\n✓ test_lazy_file PASSED")
+
+
+def test_sync_files():
+    """Test write-if-changed storing of files."""
+    print("\n" + "="*60)
+    print("TEST: test_sync_files")
+    print("="*60)
+    
+    tree = DirTree()
+    tree.add_file("src/main.py", "print('hello')")
+    tree.add_file("src/utils.py", "def helper(): pass")
+    tree.add_file("tests/run_tests.sh", "python3 test.py")
+    tree.add_file("docs/hidden.md", "# Hidden")
+    tree.add_dir("replay")
+    tree.change_dir_state("docs", State.HIDDEN)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        result = tree.sync_files(tmp, max_workers=2)
+        print(f"\n  First sync: {result.written} written, {result.skipped} skipped, "
+              f"{result.dirs_created} dirs created")
+        assert result.written == 3
+        assert result.skipped == 0
+        assert result.dirs_created == 3
+        assert os.path.isdir(os.path.join(tmp, "replay"))
+        assert not os.path.exists(os.path.join(tmp, "docs"))
+        assert os.access(os.path.join(tmp, "tests", "run_tests.sh"), os.X_OK)
+        print("  ✓ Visible files written, hidden dir skipped, .sh executable")
+        
+        tree.add_file("src/utils.py", "def helper(): return 1")
+        result = tree.sync_files(tmp)
+        print(f"  Second sync: {result.written} written, {result.skipped} skipped")
+        assert result.written_paths == ["src/utils.py"]
+        assert result.skipped == 2
+        assert result.dirs_created == 0
+        with open(os.path.join(tmp, "src", "utils.py"), encoding="utf-8") as f:
+            assert f.read() == "def helper(): return 1"
+        print("  ✓ Only the changed file is rewritten")
+    
+    print("\n✓ test_sync_files PASSED")
+
+
+def _read_dir(root):
+    """Map relative paths of files and directories below root to their contents."""
+    entries = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        rel = os.path.relpath(dirpath, root)
+        if rel != ".":
+            entries[rel + "/"] = None
+        for filename in filenames:
+            with open(os.path.join(dirpath, filename), encoding="utf-8") as f:
+                entries[os.path.normpath(os.path.join(rel, filename))] = f.read()
+    return entries
+
+
+def test_flush():
+    """Test dirty tracking and incremental flush."""
+    print("\n" + "="*60)
+    print("TEST: test_flush")
+    print("="*60)
+    
+    tree = DirTree()
+    tree.add_file("src/main.py", "print('hello')")
+    tree.add_file("src/utils.py", "def helper(): pass")
+    tree.add_file("docs/readme.md", "# Docs")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        out_dir = os.path.join(tmp, "out")
+        fresh_dir = os.path.join(tmp, "fresh")
+        tree.store_files(out_dir)
+        assert tree.get_changes().files == []
+        print("\n  ✓ Nothing is dirty after store_files")
+        
+        tree.checkpoint("round_1")
+        tree.root.children["src"].files["main.py"].content = "print('bye')"
+        tree.add_file("src/new.py", "x = 1")
+        tree.change_dir_state("docs", State.HIDDEN)
+        changes = tree.get_changes()
+        print(f"  Changes: {changes}")
+        assert changes.files == ["docs/readme.md", "src/main.py", "src/new.py"]
+        assert changes.dirs == ["docs"]
+        
+        result = tree.flush(out_dir)
+        print(f"  Flush: {result.written} written, {result.skipped} skipped, {result.deleted} deleted")
+        assert sorted(result.written_paths) == ["src/main.py", "src/new.py"]
+        assert result.deleted_paths == ["docs"]
+        tree.store_files(fresh_dir)
+        assert _read_dir(out_dir) == _read_dir(fresh_dir)
+        print("  ✓ Flush matches a fresh store_files")
+        
+        assert tree.get_changes("round_1").files == ["docs/readme.md", "src/main.py", "src/new.py"]
+        print("  ✓ Changes since a named checkpoint are kept after flush")
+        
+        # Replacing the tree removes paths that no longer exist
+        tree.json_to_tree({"src/main.py": "print('bye')", "README.md": "# Project"})
+        result = tree.flush(out_dir)
+        print(f"  Flush after json_to_tree: {result.written} written, {result.skipped} skipped, "
+              f"{result.deleted} deleted")
+        assert result.written_paths == ["README.md"]
+        assert sorted(result.deleted_paths) == ["src/new.py", "src/utils.py"]
+        shutil.rmtree(fresh_dir)
+        tree.store_files(fresh_dir)
+        assert _read_dir(out_dir) == _read_dir(fresh_dir)
+        print("  ✓ Removed paths are deleted on flush")
+        
+        # Hiding and then showing only the path of a directory between flushes
+        tree.add_file("src/a.py", "a")
+        tree.add_file("src/b.py", "b")
+        tree.store_files(out_dir)
+        tree.change_dir_state("src", State.HIDDEN)
+        tree.change_dir_state("src", State.VISIBLE_PATH)
+        result = tree.flush(out_dir)
+        assert sorted(result.deleted_paths) == ["src/a.py", "src/b.py", "src/main.py"]
+        shutil.rmtree(fresh_dir)
+        tree.store_files(fresh_dir)
+        assert _read_dir(out_dir) == _read_dir(fresh_dir)
+        print("  ✓ Files no longer stored below a changed directory are deleted")
+    
+    print("\n✓ test_flush PASSED")
+
+
+def test_render_dir_tree():
+    """Test the streaming tree renderer."""
+    print("\n" + "="*60)
+    print("TEST: test_render_dir_tree")
+    print("="*60)
+    
+    tree = DirTree()
+    tree.add_file("README.md", "# Project")
+    tree.add_file("src/main.py", "print('hello')")
+    tree.add_file("src/lib/a.py", "a")
+    tree.add_file("src/lib/b.py", "b")
+    tree.add_file("src/lib/c.py", "c")
+    
+    lines = list(tree.iter_dir_tree(words=True))
+    print("\n" + "\n".join(lines))
+    assert lines == [
+        "├── (2) README.md",
+        "└── (4) src/",
+        "    ├── (1) main.py",
+        "    └── (3) lib/",
+        "        ├── (1) a.py",
+        "        ├── (1) b.py",
+        "        └── (1) c.py",
+    ]
+    print("  ✓ iter_dir_tree yields one line per entry")
+    
+    stream = io.StringIO()
+    tree.write_dir_tree(stream, state=True)
+    assert stream.getvalue().splitlines()[0] == "├── (V) README.md"
+    assert tree.render_dir_tree() == "\n".join(tree.iter_dir_tree())
+    print("  ✓ write_dir_tree and render_dir_tree capture the output")
+    
+    lines = list(tree.iter_dir_tree(max_depth=1))
+    assert lines == ["├── README.md", "└── src/", "    └── ... (4 files)"]
+    print("  ✓ max_depth collapses deeper directories")
+    
+    lines = list(tree.iter_dir_tree(max_entries=2))
+    print("\n" + "\n".join(lines))
+    assert lines[-3:] == ["        ├── a.py", "        ├── b.py", "        └── ... (1 more entries)"]
+    print("  ✓ max_entries collapses large directories")
+    
+    print("\n✓ test_render_dir_tree PASSED")
+
+
+def test_walk():
+    """Test the iterative walk and deep trees."""
+    print("\n" + "="*60)
+    print("TEST: test_walk")
+    print("="*60)
+    
+    tree = DirTree()
+    tree.add_file("README.md", "# Project")
+    tree.add_file("src/main.py", "print('hello')")
+    tree.add_file("src/lib/util.py", "def helper(): pass")
+    tree.add_file("docs/api.md", "# API")
+    tree.change_dir_state("docs", State.HIDDEN)
+    
+    pre = [path for path, _ in tree.walk()]
+    print(f"\n  Pre-order: {pre}")
+    assert pre == ["", "README.md", "src", "src/main.py", "src/lib", "src/lib/util.py", "docs", "docs/api.md"]
+    
+    post = [path for path, _ in tree.walk(order="post")]
+    print(f"  Post-order: {post}")
+    assert post == ["README.md", "src/main.py", "src/lib/util.py", "src/lib", "src", "docs/api.md", "docs", ""]
+    print("  ✓ Pre and post order")
+    
+    visible = [path for path, _ in tree.walk(filter=State.VISIBLE, dir="src")]
+    assert visible == ["src", "src/main.py", "src/lib", "src/lib/util.py"]
+    assert "docs" not in [path for path, _ in tree.walk(filter=State.VISIBLE)]
+    print("  ✓ Filter by state prunes other subtrees")
+    
+    # Deeper than the default recursion limit
+    depth = sys.getrecursionlimit() + 100
+    deep_path = "/".join(f"d{i}" for i in range(depth)) + "/leaf.txt"
+    deep = DirTree()
+    deep.add_file(deep_path, "one two")
+    assert deep.get_stats().words == 2
+    assert deep.generate_file_dict() == {deep_path: "one two"}
+    assert deep.change_dir_tree_state(State.VISIBLE_PATH) == depth + 2
+    assert len(list(deep.iter_dir_tree())) == depth + 1
+    print(f"  ✓ Tree of depth {depth} handled without recursion")
+    
+    print("\n✓ test_walk PASSED")
+
+
+def test_visibility_view():
+    """Test immutable visibility views layered over the tree."""
+    print("\n" + "="*60)
+    print("TEST: test_visibility_view")
+    print("="*60)
+    
+    def build():
+        tree = DirTree()
+        tree.add_file("README.md", "# Project")
+        tree.add_file("src/main.py", "print('hello')")
+        tree.add_file("src/lib/util.py", "def helper(): pass")
+        tree.add_file("docs/api.md", "# API")
+        tree.add_file("docs/guide.md", "# Guide")
+        return tree
+    
+    tree = build()
+    before = tree.generate_file_dict()
+    
+    view = (tree.view()
+            .with_dir_state("", State.HIDDEN)
+            .with_file_state("src/lib/util.py", State.VISIBLE)
+            .with_dir_state("docs", State.VISIBLE_PATH))
+    
+    # Same operations applied by mutation on a second tree
+    mutated = build()
+    mutated.change_dir_state("", State.HIDDEN)
+    mutated.change_file_state("src/lib/util.py", State.VISIBLE)
+    mutated.change_dir_state("docs", State.VISIBLE_PATH)
+    
+    assert isinstance(view, VisibilityView)
+    result = view.generate_file_dict()
+    print(f"\n  View dict: {result}")
+    assert result == mutated.generate_file_dict()
+    assert sorted(result) == ["docs/api.md", "docs/guide.md", "src/lib/util.py"]
+    assert result["src/lib/util.py"] == "def helper(): pass"
+    print("  ✓ View matches the mutation-based result")
+    
+    assert tree.generate_file_dict() == before
+    assert all(node.state == State.VISIBLE for _, node in tree.walk())
+    print("  ✓ Base tree left untouched")
+    
+    assert view.state_of("src") == State.VISIBLE
+    assert view.state_of("src/main.py") == State.HIDDEN
+    assert view.state_of("docs/guide.md") == State.VISIBLE_PATH
+    assert view.generate_file_dict(dir="src") == mutated.generate_file_dict(dir="src")
+    print("  ✓ state_of and dir-scoped dicts")
+    
+    # Two views over the same tree at once
+    docs_only = tree.view().with_dir_state("src", State.HIDDEN).with_file_state("README.md", State.HIDDEN)
+    assert docs_only.generate_file_dict() == {"docs/api.md": "# API", "docs/guide.md": "# Guide"}
+    assert view.generate_file_dict() == result
+    print("  ✓ Independent views share one tree")
+    
+    try:
+        tree.view().with_dir_state("missing", State.HIDDEN)
+        assert False, "Expected ValueError"
+    except ValueError:
+        print("  ✓ Unknown paths raise ValueError")
+    
+    temp_dir = tempfile.mkdtemp()
+    try:
+        docs_only.store_files(temp_dir)
+        assert _read_dir(temp_dir) == {"docs/": None, "docs/api.md": "# API", "docs/guide.md": "# Guide"}
+        print("  ✓ store_files through a view")
+    finally:
+        shutil.rmtree(temp_dir)
+    
+    print("\n✓ test_visibility_view PASSED")
+
+
+def test_content_dedup():
+    """Test that equal file contents are stored once and shared."""
+    print("\n" + "="*60)
+    print("TEST: test_content_dedup")
+    print("="*60)
+    
+    template = {
+        "tests/test.py": "import unittest\n\nclass TestTemplate(unittest.TestCase):\n    pass\n",
+        "setup.sh": "#!/bin/bash\npip install -r requirements.txt\n",
+        "README.md": "# Template\n",
+    }
+    tree = DirTree()
+    for node in ["api", "db", "ui"]:
+        tree.add_files_to_dir_tree(files=template, dir=f"project/{node}")
+    
+    api_test = tree._files["project/api/tests/test.py"]
+    ui_test = tree._files["project/ui/tests/test.py"]
+    assert api_test._blob is ui_test._blob
+    assert api_test.content is ui_test.content
+    assert tree.count_unique_contents() == 3
+    assert tree.get_stats().files == 9
+    print(f"\n  ✓ 9 files share {tree.count_unique_contents()} contents")
+    assert tree.content_store.get(api_test.digest) is api_test._blob
+    print("  ✓ Blobs are looked up by SHA-256 digest")
+    
+    # Equality uses the digest; assigning equal content is not a change
+    assert File("a.py", "x = 1") == File("a.py", "x = 1")
+    assert File("a.py", "x = 1") != File("a.py", "x = 2")
+    tree.checkpoint("before")
+    api_test.content = template["tests/test.py"]
+    assert tree.get_changes(since="before").files == []
+    api_test.content = "changed"
+    assert tree.get_changes(since="before").files == ["project/api/tests/test.py"]
+    assert ui_test.content == template["tests/test.py"]
+    assert tree.count_unique_contents() == 4
+    print("  ✓ Digest equality and copy-on-write replacement")
+    
+    # A file created without content holds the empty string
+    empty = File("empty.py", None)
+    assert empty.content == ""
+    assert empty.stats.files == 1 and empty.stats.words == 0
+    assert empty == File("empty.py", "")
+    print("  ✓ None content is stored as an empty file")
+    
+    print("\n✓ test_content_dedup PASSED")
+
+
+def test_snapshot():
+    """Test saving and loading binary snapshots."""
+    print("\n" + "="*60)
+    print("TEST: test_snapshot")
+    print("="*60)
+    
+    tree = DirTree()
+    tree.add_file("README.md", "# Project\n")
+    tree.add_file("src/main.py", "print('héllo')\n")
+    tree.add_file("src/copy.py", "print('héllo')\n")
+    tree.add_file("src/empty.py", "")
+    tree.add_file("docs/api.md", "# API")
+    tree.add_dir("build")
+    tree.change_dir_state("docs", State.HIDDEN)
+    tree.change_file_state("README.md", State.VISIBLE_PATH)
+    
+    temp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(temp_dir, "tree.snap")
+        size = tree.save_snapshot(path)
+        assert size == os.path.getsize(path)
+        print(f"\n  ✓ Saved snapshot of {size} bytes")
+        
+        loaded = DirTree.load_snapshot(path)
+        main = loaded._files["src/main.py"]
+        assert isinstance(main, SnapshotFile)
+        assert loaded.get_stats() == tree.get_stats()
+        assert loaded.dir_exists("build")
+        assert loaded._dirs["docs"].state == State.HIDDEN
+        assert loaded._files["README.md"].state == State.VISIBLE_PATH
+        print("  ✓ Structure, states and stats restored")
+        
+        # Contents still held by the original tree are shared, not decoded
+        assert main._blob is tree._files["src/main.py"]._blob
+        assert loaded.root == tree.root
+        assert loaded.generate_file_dict() == tree.generate_file_dict()
+        print("  ✓ Contents match the original tree")
+        
+        # A fresh process has nothing in memory: contents are decoded on access
+        del tree, loaded, main
+        gc.collect()
+        fresh = DirTree.load_snapshot(path)
+        main = fresh._files["src/main.py"]
+        assert not main.is_loaded
+        assert fresh.get_stats().words == 6
+        assert main == File("src/main.py", "print('héllo')\n", State.VISIBLE)
+        assert not main.is_loaded
+        assert main.content == "print('héllo')\n"
+        assert main.is_loaded
+        assert fresh._files["src/copy.py"].content is main.content
+        print("  ✓ Lazy decoding, stats and digests without decoding")
+        
+        # Saving over the mapped snapshot keeps the loaded tree usable
+        fresh.add_file("src/new.py", "x = 1")
+        fresh.save_snapshot(path)
+        assert fresh._files["docs/api.md"].content == "# API"
+        assert DirTree.load_snapshot(path).generate_file_dict()["src/new.py"] == "x = 1"
+        print("  ✓ Re-saving over a mapped snapshot")
+        
+        # Unloaded lazy files are saved as references to their disk file
+        disk_path = os.path.join(temp_dir, "latin1.txt")
+        with open(disk_path, "wb") as f:
+            f.write("café\n".encode("latin-1"))
+        fresh.add_lazy_file("data/latin1.txt", disk_path)
+        fresh.save_snapshot(path)
+        loaded = DirTree.load_snapshot(path)
+        lazy = loaded._files["data/latin1.txt"]
+        assert isinstance(lazy, LazyFile) and not lazy.is_loaded
+        assert (lazy.disk_path, lazy.size) == (disk_path, 5)
+        out_dir = os.path.join(temp_dir, "out")
+        loaded.store_files(out_dir)
+        with open(os.path.join(out_dir, "data", "latin1.txt"), "rb") as f:
+            assert f.read() == "café\n".encode("latin-1")
+        print("  ✓ Lazy files restored as LazyFile, bytes kept as on disk")
+        
+        bad_path = os.path.join(temp_dir, "bad.snap")
+        with open(bad_path, "wb") as f:
+            f.write(b"not a snapshot" * 10)
+        try:
+            DirTree.load_snapshot(bad_path)
+            assert False, "Expected ValueError"
+        except ValueError:
+            print("  ✓ Invalid snapshots raise ValueError")
+    finally:
+        shutil.rmtree(temp_dir)
+    
+    print("\n✓ test_snapshot PASSED")
+
+
+def test_from_filesystem():
+    """Test importing a directory from disk."""
+    print("\n" + "="*60)
+    print("TEST: test_from_filesystem")
+    print("="*60)
+    
+    temp_dir = tempfile.mkdtemp()
+    try:
+        def write(relpath, data):
+            full_path = os.path.join(temp_dir, relpath)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            with open(full_path, "wb") as f:
+                f.write(data)
+        
+        write("README.md", "# Project\n".encode("utf-8"))
+        write("src/main.py", "print('héllo')\n".encode("utf-8"))
+        write("src/lib/util.py", b"def helper(): pass\n")
+        write("src/__pycache__/main.cpython-311.pyc", b"\x00\x01")
+        write(".git/HEAD", b"ref: refs/heads/main\n")
+        write("assets/logo.png", b"\x89PNG\r\n\x1a\n\x00\x00")
+        write("assets/latin1.txt", "caf\xe9".encode("latin-1"))
+        write("data/big.txt", b"x" * 2000)
+        os.makedirs(os.path.join(temp_dir, "empty"))
+        os.symlink(os.path.join(temp_dir, ".git", "HEAD"), os.path.join(temp_dir, "src", "head.txt"))
+        
+        tree = DirTree.from_filesystem(temp_dir, max_file_size=1000)
+        tree.print_dir_tree(state=True)
+        assert tree._files["src/main.py"].content == "print('héllo')\n"
+        assert tree._files["src/lib/util.py"].content == "def helper(): pass\n"
+        assert tree.dir_exists("empty")
+        print("\n  ✓ Text files and directories imported")
+        
+        assert not tree.dir_exists(".git")
+        assert not tree.dir_exists("src/__pycache__")
+        print("  ✓ Ignored directories skipped")
+        
+        assert "src/head.txt" not in tree._files
+        print("  ✓ Symlinked files not followed")
+        
+        for path in ["assets/logo.png", "assets/latin1.txt", "data/big.txt"]:
+            file_obj = tree._files[path]
+            assert isinstance(file_obj, LazyFile) and not file_obj.is_loaded
+            assert file_obj.state == State.VISIBLE_PATH
+        assert tree._files["data/big.txt"].size == 2000
+        assert tree.generate_file_dict()["assets/logo.png"] == "[HIDDEN FILE CONTENTS, DO NOT EDIT]"
+        print("  ✓ Binary and oversized files kept as path-only lazy files")
+        
+        tree = DirTree.from_filesystem(temp_dir, ignore=["*.png", "data"], max_workers=1)
+        assert "assets/logo.png" not in tree._files
+        assert not tree.dir_exists("data")
+        assert tree.dir_exists(".git")
+        assert tree._files["src/main.py"]._blob is File("x", "print('héllo')\n")._blob
+        print("  ✓ Custom ignore patterns")
+    finally:
+        shutil.rmtree(temp_dir)
+    
+    try:
+        DirTree.from_filesystem(os.path.join(tempfile.gettempdir(), "does-not-exist-dir-tree"))
+        assert False, "Expected ValueError"
+    except ValueError:
+        print("  ✓ Missing root raises ValueError")
+    
+    print("\n✓ test_from_filesystem PASSED")
+
+
+def test_merkle_hashes():
+    """Test Merkle hashes on directories and hash-guided tree comparison."""
+    print("\n" + "="*60)
+    print("TEST: test_merkle_hashes")
+    print("="*60)
+    
+    files = {
+        "README.md": "# Project",
+        "src/main.py": "print('hello')",
+        "src/lib/util.py": "def helper(): pass",
+        "docs/api.md": "# API",
+    }
+    tree = DirTree()
+    tree.add_files_to_dir_tree(files)
+    # Same files inserted in a different order
+    other = DirTree()
+    other.add_files_to_dir_tree(dict(reversed(list(files.items()))))
+    assert tree.get_digest() == other.get_digest()
+    assert tree.compare(other).files == []
+    print("\n  ✓ Equal trees have equal hashes regardless of insertion order")
+    
+    root_hash = tree.get_digest()
+    docs_hash = tree.get_digest("docs")
+    tree._files["src/lib/util.py"].content = "def helper(): return 1"
+    assert tree.root._hash is None and tree._dirs["src/lib"]._hash is None
+    assert tree._dirs["docs"]._hash == docs_hash
+    assert tree.get_digest() != root_hash
+    print("  ✓ Content change invalidates only the ancestor path")
+    
+    lib_hash = tree.get_digest("src/lib")
+    tree.change_dir_state("src/lib", State.VISIBLE_PATH)
+    assert tree.get_digest("src/lib") != lib_hash
+    tree.change_dir_state("src/lib", State.VISIBLE)
+    assert tree.get_digest("src/lib") == lib_hash
+    print("  ✓ State changes are part of the hash")
+    
+    tree.add_file("src/new.py", "x = 1")
+    tree.add_file("tests/test_main.py", "assert True")
+    tree.change_file_state("README.md", State.HIDDEN)
+    other.add_file("old/legacy.py", "pass")
+    changes = tree.compare(other)
+    print(f"  Changes: {changes}")
+    assert changes.files == ["README.md", "src/lib/util.py", "src/new.py", "tests/test_main.py"]
+    assert changes.dirs == ["tests"]
+    assert changes.removed == ["old", "old/legacy.py"]
+    print("  ✓ compare lists added, changed and removed paths")
+    
+    print("\n✓ test_merkle_hashes PASSED")
+
+
+def test_diff_and_merge():
+    """Test tree diffs with hunks and three-way merges."""
+    print("\n" + "="*60)
+    print("TEST: test_diff_and_merge")
+    print("="*60)
+    
+    base_files = {
+        "README.md": "# Project\n",
+        "src/main.py": "import os\n\ndef main():\n    pass\n\nif __name__ == '__main__':\n    main()\n",
+        "src/lib/util.py": "def helper():\n    return 1\n",
+        "docs/api.md": "# API\n",
+    }
+    
+    def build(changes=None, removed=()):
+        tree = DirTree()
+        files = dict(base_files, **(changes or {}))
+        tree.add_files_to_dir_tree({p: c for p, c in files.items() if p not in removed})
+        return tree
+    
+    base = build()
+    ours = build({"src/main.py": base_files["src/main.py"].replace("import os", "import sys")})
+    theirs = build({"src/main.py": base_files["src/main.py"].replace("    pass", "    print('hi')"),
+                    "src/new.py": "x = 1\n"},
+                   removed=("docs/api.md",))
+    
+    diff = base.diff(theirs)
+    print(f"\n{diff.to_unified()}")
+    assert diff.added == ["src/new.py"]
+    assert diff.removed == ["docs/api.md"]
+    assert list(diff.modified) == ["src/main.py"]
+    hunk = diff.modified["src/main.py"][0]
+    assert "-    pass\n" in hunk.lines and "+    print('hi')\n" in hunk.lines
+    assert not base.diff(build())
+    print("  ✓ diff reports added, removed and modified files with hunks")
+    
+    result = DirTree.merge(base, ours, theirs)
+    assert result.clean
+    merged = result.tree.generate_file_dict()
+    assert merged["src/main.py"].startswith("import sys\n")
+    assert "print('hi')" in merged["src/main.py"]
+    assert merged["src/new.py"] == "x = 1\n"
+    assert "docs/api.md" not in merged
+    assert merged["src/lib/util.py"] == base_files["src/lib/util.py"]
+    assert result.tree._files["src/lib/util.py"]._blob is base._files["src/lib/util.py"]._blob
+    print("  ✓ Non-overlapping changes merge cleanly")
+    
+    ours = build({"src/lib/util.py": "def helper():\n    return 2\n", "docs/api.md": "# API v2\n"})
+    theirs = build({"src/lib/util.py": "def helper():\n    return 3\n"}, removed=("docs/api.md",))
+    theirs.change_dir_state("src", State.VISIBLE_PATH)
+    result = DirTree.merge(base, ours, theirs)
+    print(f"  Conflicts: {result.conflicts}")
+    assert result.conflicts == ["docs/api.md", "src/lib/util.py"]
+    util = result.tree._files["src/lib/util.py"].content
+    assert "<<<<<<< ours\n    return 2\n=======\n    return 3\n>>>>>>> theirs\n" in util
+    assert result.tree._files["docs/api.md"].content == "# API v2\n"
+    assert result.tree._dirs["src"].state == State.VISIBLE_PATH
+    print("  ✓ Overlapping edits and delete/modify reported as conflicts")
+    
+    print("\n✓ test_diff_and_merge PASSED")
+
+
+def test_budgeted_file_dict():
+    """Test packing files into a token or byte budget."""
+    print("\n" + "="*60)
+    print("TEST: test_budgeted_file_dict")
+    print("="*60)
+    
+    main_py = "".join(f"def func_{i}():\n    return {i}\n\n" for i in range(12))
+    notes = "".join(f"note line {i}\n" for i in range(50))
+    tree = DirTree()
+    tree.add_file("src/main.py", main_py)
+    tree.add_file("src/util.py", "def helper():\n    pass\n")
+    tree.add_file("docs/notes.md", notes)
+    tree.add_file("docs/api.md", "# API\n")
+    tree.add_file("secret/key.txt", "hidden")
+    tree.add_file("data/schema.json", "{}")
+    tree.change_dir_state("secret", State.HIDDEN)
+    tree.change_dir_state("data", State.VISIBLE_PATH)
+    
+    # A budget that fits everything returns generate_file_dict
+    result = tree.generate_budgeted_file_dict(budget=10**6)
+    assert result.files == tree.generate_file_dict()
+    assert result.dropped == [] and result.truncated == []
+    print(f"\n  ✓ Large budget: {len(result.full)} full files, {result.used} tokens")
+    
+    # Bytes budget: the Python file is summarized, notes are truncated
+    result = tree.generate_budgeted_file_dict(
+        budget=500, unit="bytes", priorities={"src": 2, "docs/api.md": 1})
+    print(f"  Full: {result.full}, summarized: {result.summarized}, "
+          f"truncated: {result.truncated}, path only: {result.path_only}")
+    assert result.used <= 500
+    assert result.full == ["src/util.py", "docs/api.md"]
+    assert result.summarized == ["src/main.py"]
+    assert result.files["src/main.py"].startswith("def func_0():\ndef func_1():")
+    assert result.truncated == ["docs/notes.md"]
+    assert result.files["docs/notes.md"].startswith("note line 0\n")
+    assert "MORE LINES" in result.files["docs/notes.md"]
+    assert result.path_only == ["data/schema.json"]
+    assert "secret/key.txt" not in result.files
+    assert list(result.files) == list(tree.generate_file_dict())
+    print("  ✓ Priorities, summaries, truncation and path-only fallback")
+    
+    # Too small for every path: the lowest priority files are dropped
+    result = tree.generate_budgeted_file_dict(budget=30, priorities=lambda path: path.startswith("docs"))
+    print(f"  Dropped: {result.dropped}")
+    assert result.used <= 30
+    assert set(result.dropped) | set(result.files) == set(tree.generate_file_dict())
+    assert "docs/api.md" in result.files and "src/main.py" in result.dropped
+    print("  ✓ Dropped files are reported")
+    
+    try:
+        tree.generate_budgeted_file_dict(budget=100, unit="words")
+        assert False, "Should have raised ValueError"
+    except ValueError as e:
+        assert "Unknown unit 'words'" in str(e)
+    print("  ✓ Unknown unit raises ValueError")
+    
+    print("\n✓ test_budgeted_file_dict PASSED")
+
+
+def test_json_serializer():
+    """Test streaming the shown files as flat and json_dir JSON."""
+    print("\n" + "="*60)
+    print("TEST: test_json_serializer")
+    print("="*60)
+    
+    tree = DirTree()
+    tree.add_file("README.md", "# Project\n")
+    tree.add_file("src/main.py", "print(\"héllo\")\n")
+    tree.add_file("src/lib/util.py", "def helper(): pass")
+    tree.add_file("secret/key.txt", "hidden")
+    tree.add_dir("build")
+    tree.change_dir_state("secret", State.HIDDEN)
+    tree.change_file_state("README.md", State.VISIBLE_PATH)
+    
+    for indent in (None, 2):
+        text = "".join(tree.iter_json(indent=indent))
+        assert text == json.dumps(tree.generate_file_dict(), indent=indent)
+    print("\n  ✓ Flat format matches json.dumps(generate_file_dict())")
+    
+    stream = io.StringIO()
+    tree.write_json(stream, format="json_dir", indent=2)
+    print(stream.getvalue())
+    assert json.loads(stream.getvalue()) == {
+        "files": {"README.md": "[HIDDEN FILE CONTENTS, DO NOT EDIT]"},
+        "directories": {
+            "src": {"files": {"main.py": "print(\"héllo\")\n"},
+                    "directories": {"lib": {"files": {"util.py": "def helper(): pass"},
+                                            "directories": {}}}},
+            "build": {"files": {}, "directories": {}},
+        },
+    }
+    print("  ✓ Nested json_dir format written to a stream")
+    
+    chunks = list(tree.iter_json(dir="src"))
+    assert len(chunks) == 3
+    assert json.loads("".join(chunks)) == {"src/main.py": "print(\"héllo\")\n",
+                                           "src/lib/util.py": "def helper(): pass"}
+    view = tree.view().with_dir_state("src/lib", State.HIDDEN)
+    assert json.loads("".join(view.iter_json(format="json_dir", dir="src"))) == {
+        "files": {"main.py": "print(\"héllo\")\n"}, "directories": {}}
+    print("  ✓ One chunk per file, dir and view support")
+    
+    print("\n✓ test_json_serializer PASSED")
+
+
+def test_stream_ingester():
+    """Test building files from a streamed JSON response."""
+    print("\n" + "="*60)
+    print("TEST: test_stream_ingester")
+    print("="*60)
+    
+    files = {
+        "src/main.py": "print(\"héllo\")\n",
+        "tests/test.py": "import unittest\n\tpass\n",
+        "README.md": "# Project",
+    }
+    response = "```json\n" + json.dumps(files, indent=2) + "\n```"
+    
+    # Feed the response in small chunks, as an LLM stream would deliver it
+    tree = DirTree()
+    seen = []
+    ingester = tree.ingester(dir="project", on_file=lambda f: seen.append(f.path))
+    completed_after = {}
+    for i in range(0, len(response), 7):
+        for file_obj in ingester.feed(response[i:i + 7]):
+            completed_after[file_obj.path] = i + 7
+    ingester.close()
+    print(f"\n  Files completed after chars: {completed_after}")
+    assert seen == ["project/src/main.py", "project/tests/test.py", "project/README.md"]
+    assert completed_after["project/src/main.py"] < len(response) // 2
+    assert tree.generate_file_dict() == {"project/" + path: content for path, content in files.items()}
+    print("  ✓ Files created as soon as each pair is complete")
+    
+    # List format, consumed through the generator
+    items = [{"path": path, "contents": content} for path, content in files.items()]
+    text = json.dumps(items)
+    tree = DirTree()
+    paths = [f.path for f in tree.ingest_stream(text[i:i + 5] for i in range(0, len(text), 5))]
+    assert paths == list(files)
+    assert tree.generate_file_dict() == files
+    print("  ✓ List of path/contents objects")
+    
+    for bad in ['{"a.py": {"nested": 1}}', '{"a.py": "x"', '{"a.py": 5}', '[{"path": 5, "contents": "x"}]']:
+        try:
+            list(DirTree().ingest_stream([bad]))
+            assert False, "Expected ValueError"
+        except ValueError as e:
+            print(f"  ✓ {bad!r} raises ValueError: {e}")
+        if bad != '{"a.py": "x"':
+            try:
+                DirTree().json_to_tree(json.loads(bad), dir="project")
+                assert False, "Expected ValueError"
+            except ValueError:
+                print("  ✓ json_to_tree raises the same ValueError")
+    
+    # Nested values in file objects are accepted like json_to_tree accepts them
+    items = [
+        {"path": "a.py", "contents": "x = 1\n", "meta": {"tags": ["py", {"kind": "src"}], "size": 6}},
+        {"path": "b.md", "content": "# B", "history": [[1, 2], {"by": None}]},
+        {"contents": "", "path": "c/d.txt", "extra": {}},
+    ]
+    text = json.dumps(items)
+    expected = DirTree()
+    expected.json_to_tree(json.loads(text), dir="project")
+    tree = DirTree()
+    ingester = tree.ingester(dir="project")
+    for i in range(0, len(text), 3):
+        ingester.feed(text[i:i + 3])
+    assert [f.path for f in ingester.close()] == ["project/a.py", "project/b.md", "project/c/d.txt"]
+    assert tree.generate_file_dict() == expected.generate_file_dict()
+    print("  ✓ Nested extra keys match json_to_tree")
+    
+    print("\n✓ test_stream_ingester PASSED")
+
+
+def test_glob_and_find():
+    """Test glob patterns and indexed find queries."""
+    print("\n" + "="*60)
+    print("TEST: test_glob_and_find")
+    print("="*60)
+    
+    tree = DirTree()
+    tree.json_to_tree({
+        "setup.py": "setup()",
+        "README.md": "# Project",
+        "src/main.py": "import util",
+        "src/util.py": "def f(): pass",
+        "src/pkg/core.py": "class Core: pass",
+        "src/pkg/data.json": "{}",
+        "docs/README.md": "# Docs",
+        "docs/guide.txt": "guide",
+    })
+    
+    assert tree.glob("**/*.py") == ["setup.py", "src/main.py", "src/pkg/core.py", "src/util.py"]
+    assert tree.glob("src/**/*.py") == ["src/main.py", "src/pkg/core.py", "src/util.py"]
+    assert tree.glob("*.py") == ["setup.py"]
+    assert tree.glob("**/README.md") == ["README.md", "docs/README.md"]
+    assert tree.glob("src/*/*") == ["src/pkg/core.py", "src/pkg/data.json"]
+    assert tree.glob("docs/gu?de.[abt]xt") == ["docs/guide.txt"]
+    assert tree.glob("missing/**/*.py") == []
+    print("  ✓ glob matches *, ?, [...] and ** like path globs")
+    
+    assert tree.find(ext="py", dir="src") == ["src/main.py", "src/pkg/core.py", "src/util.py"]
+    assert tree.find(name="README.md") == ["README.md", "docs/README.md"]
+    assert tree.find(lambda f: f.content.startswith("#")) == ["README.md", "docs/README.md"]
+    assert tree.find(lambda f: "class" in f.content, ext=".py") == ["src/pkg/core.py"]
+    print("  ✓ find filters by predicate, name, extension and directory")
+    
+    # Indexes follow replacements, additions and root changes
+    tree.add_file("src/util.py", "changed")
+    tree.add_file("src/pkg/extra.py", "x")
+    assert tree.glob("src/pkg/*.py") == ["src/pkg/core.py", "src/pkg/extra.py"]
+    assert tree.find(lambda f: f.content == "changed") == ["src/util.py"]
+    assert len(tree._by_ext[".py"]) == 5
+    tree.json_to_tree({"a.txt": "a"})
+    assert tree.glob("**/*.py") == [] and tree.find(ext="txt") == ["a.txt"]
+    print("  ✓ Indexes stay in sync with the tree")
+    
+    print("\n✓ test_glob_and_find PASSED")
+
+
+def test_text_search():
+    """Test the inverted full-text index and TF-IDF search."""
+    print("\n" + "="*60)
+    print("TEST: test_text_search")
+    print("="*60)
+    
+    tree = DirTree()
+    tree.json_to_tree({
+        "src/parser.py": "import re\ndef parse_config(text):\n    return parse_tokens(text)\ndef parse_tokens(text):\n    pass",
+        "src/main.py": "from parser import parse_config\nimport os\nparse_config(os.environ)",
+        "src/util.py": "import os\nimport re",
+        "README.md": "Run main.py",
+    })
+    assert tree.text_index is None
+    
+    results = tree.search("parse_config")
+    print(f"\n  Results: {results}")
+    assert [path for path, _ in results] == ["src/main.py", "src/parser.py"]
+    assert tree.text_index is not None and len(tree.text_index) == 4
+    assert tree.text_index.postings("import") == {"src/parser.py": 1, "src/main.py": 2, "src/util.py": 2}
+    print("  ✓ Files ranked by TF-IDF, index created on first search")
+    
+    # Rare terms weigh more than common ones
+    ranked = [path for path, _ in tree.search(["os", "tokens", "parse_tokens"])]
+    assert ranked[0] == "src/parser.py"
+    assert tree.search("README") == [] and tree.search("Main", limit=1)[0][0] == "README.md"
+    assert [path for path, _ in tree.search("import", dir="src")] == ["src/main.py", "src/util.py", "src/parser.py"]
+    print("  ✓ Case-insensitive terms, limit and dir filters")
+    
+    # Additions, replacements and edits update the index
+    tree.add_file("src/new.py", "def parse_config(): pass")
+    tree.add_file("src/main.py", "print('hello')")
+    tree._files["src/util.py"].content = "parse_config = None"
+    assert [path for path, _ in tree.search("parse_config")] == ["src/new.py", "src/parser.py", "src/util.py"]
+    tree.json_to_tree({"a.py": "x = 1"})
+    assert tree.search("parse_config") == [] and len(tree.text_index) == 1
+    print("  ✓ Index follows added, replaced, edited and removed files")
+    
+    print("\n✓ test_text_search PASSED")
+
+
+def test_change_states_batch():
+    """Test applying mixed state operations in one batch."""
+    print("\n" + "="*60)
+    print("TEST: test_change_states_batch")
+    print("="*60)
+    
+    files = {
+        "src/main.py": "main",
+        "src/lib/util.py": "util",
+        "tests/test_main.py": "test",
+        "docs/guide.md": "guide",
+    }
+    operations = [
+        ("", State.HIDDEN),
+        ("src/main.py", State.VISIBLE),
+        ("src/lib", State.VISIBLE_PATH),
+        ("tests", State.VISIBLE),
+        ("tests/test_main.py", State.VISIBLE_PATH),
+    ]
+    
+    # Reference: the same operations one call at a time
+    expected = DirTree()
+    expected.json_to_tree(files)
+    for path, state in operations:
+        if path in expected._files:
+            expected.change_file_state(path, state)
+        else:
+            expected.change_dir_state(path, state)
+    
+    tree = DirTree()
+    tree.json_to_tree(files)
+    count = tree.change_states(operations)
+    print(f"\n  States changed: {count}")
+    assert [(p, o.state) for p, o in tree.walk()] == [(p, o.state) for p, o in expected.walk()]
+    assert tree.generate_file_dict() == expected.generate_file_dict()
+    assert tree.root.state == State.VISIBLE and tree._dirs["docs"].state == State.HIDDEN
+    print("  ✓ Same states as the calls in order, parents unhidden once")
+    
+    # Only actual changes are counted; repeating the batch changes nothing
+    assert count == 5
+    assert tree.change_states(operations) == 0
+    print("  ✓ Count of changed states")
+    
+    try:
+        tree.change_states([("src", State.HIDDEN), ("missing/file.py", State.VISIBLE)])
+        assert False, "Expected ValueError"
+    except ValueError:
+        pass
+    assert tree._dirs["src"].state == State.VISIBLE
+    print("  ✓ Unknown paths rejected before any change")
+    
+    print("\n✓ test_change_states_batch PASSED")
+
+
+def test_array_layout():
+    """Test the array-backed preorder layout against the node tree, with and without NumPy."""
+    print("\n" + "="*60)
+    print("TEST: test_array_layout")
+    print("="*60)
+    
+    from dir_tree import dir_tree_array
+    backends = [("lists", None)]
+    try:
+        import numpy
+        backends.insert(0, ("numpy", numpy))
+    except ImportError:
+        print("\n  (numpy not installed, only the list backend is tested)")
+    saved = dir_tree_array.np
+    for backend, module in backends:
+        print(f"\n  Backend: {backend}")
+        dir_tree_array.np = module
+        try:
+            _check_array_layout()
+        finally:
+            dir_tree_array.np = saved
+    
+    print("\n✓ test_array_layout PASSED")
+
+
+def _check_array_layout():
+    tree = DirTree()
+    tree.json_to_tree({
+        "src/main.py": "import util\nmain()",
+        "src/lib/util.py": "def util(): pass",
+        "src/lib/data.txt": "one two three",
+        "docs/guide.md": "guide",
+        "README.md": "# Project",
+    })
+    layout = tree.to_array()
+    assert len(layout) == len(list(tree.walk()))
+    assert layout.generate_file_dict() == tree.generate_file_dict()
+    assert layout.get_stats() == tree.get_stats() and layout.get_stats("src/lib") == tree.get_stats("src/lib")
+    print("  ✓ Same files and subtree counters as the tree")
+    
+    # The same state changes on both sides
+    for target in (tree, layout):
+        assert target.change_dir_state("src", State.HIDDEN) == 5
+        assert target.change_dir_state("src/lib", State.VISIBLE_PATH) == 3
+        assert target.change_file_state("src/main.py", State.VISIBLE) == 2
+        assert target.change_file_state("src/lib/util.py", State.VISIBLE) == 1
+    assert layout.generate_file_dict() == tree.generate_file_dict()
+    assert layout.generate_file_dict("src") == tree.generate_file_dict("src")
+    print("  ✓ Slice state changes match change_dir_state and change_file_state")
+    
+    # Node views over the arrays
+    lib = layout.node("src/lib")
+    assert not lib.is_file and lib.state == State.VISIBLE_PATH
+    assert set(lib.files) == {"util.py", "data.txt"} and lib.parent.path == "src"
+    assert set(layout.root.children) == {"src", "docs"}
+    assert layout.node("src/lib/data.txt").content == "one two three"
+    assert lib.stats == tree.get_stats("src/lib")
+    assert layout.node("/src//lib/util.py/").path == "src/lib/util.py"
+    print("  ✓ Node views expose name, path, state, children, files and content")
+    
+    # Back to a DirTree with the layout's states
+    rebuilt = layout.to_tree()
+    assert [(p, o.state) for p, o in rebuilt.walk()] == [(p, o.state) for p, o in tree.walk()]
+    assert rebuilt.generate_file_dict() == tree.generate_file_dict()
+    try:
+        layout.change_dir_state("missing", State.HIDDEN)
+        assert False, "Expected ValueError"
+    except ValueError:
+        pass
+    print("  ✓ to_tree rebuilds the tree with current states")
+    
+    # Nested hidden directories cover overlapping intervals
+    for target in (tree, layout):
+        target.change_dir_state("src", State.HIDDEN)
+        target.change_dir_state("src/lib", State.HIDDEN)
+    assert layout.generate_file_dict() == tree.generate_file_dict() == {"README.md": "# Project", "docs/guide.md": "guide"}
+    for target in (tree, layout):
+        assert target.change_file_state("src/lib/util.py", State.VISIBLE) == 3
+    assert layout.generate_file_dict() == tree.generate_file_dict()
+    print("  ✓ Nested hidden directories")
+
+
+def test_move_rename_remove():
+    """Test moving, renaming and removing files and directories."""
+    print("\n" + "="*60)
+    print("TEST: test_move_rename_remove")
+    print("="*60)
+    
+    tree = DirTree()
+    tree.json_to_tree({
+        "pkg/core/engine.py": "def run(): pass",
+        "pkg/core/util.py": "def helper(): pass",
+        "pkg/api.py": "from pkg.core import engine",
+        "README.md": "# Project",
+    })
+    tree.enable_text_index()
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        out_dir = os.path.join(tmp, "out")
+        fresh_dir = os.path.join(tmp, "fresh")
+        tree.store_files(out_dir)
+        
+        # Renaming a directory relinks one node; lookups below it resolve lazily
+        tree.rename("pkg", "project")
+        assert not tree.dir_exists("pkg") and tree.dir_exists("project/core")
+        assert tree.root.children["project"].files["api.py"].path == "project/api.py"
+        assert tree.glob("**/*.py") == ["project/api.py", "project/core/engine.py", "project/core/util.py"]
+        # Bucket entries are resolved once per structural change
+        assert all(checked == tree._version for _, _, checked in tree._by_ext[".py"].values())
+        assert [path for path, _ in tree.search("helper")] == ["project/core/util.py"]
+        assert tree.change_file_state("project/core/util.py", State.VISIBLE_PATH) == 1
+        print("\n  ✓ rename keeps indexes, glob and search consistent")
+        
+        # Moving creates missing parents; the old path is reported as removed
+        tree.move("project/core/engine.py", "lib/engine.py")
+        tree.move("project/core", "lib/core")
+        changes = tree.get_changes()
+        print(f"  Changes: {changes}")
+        assert changes.removed == ["pkg", "project/core", "project/core/engine.py"]
+        assert "lib/engine.py" in changes.files and "lib/core" in changes.dirs
+        assert tree.find(name="engine.py") == ["lib/engine.py"]
+        
+        tree.remove("README.md")
+        tree.remove("lib/core")
+        assert not tree.dir_exists("lib/core") and tree.glob("**/util.py") == []
+        assert tree.search("helper") == []
+        assert tree.get_stats().files == 2
+        for src, dst in (("missing.py", "x.py"), ("lib", "lib/inner"), ("lib/engine.py", "project/api.py")):
+            try:
+                tree.move(src, dst)
+                assert False, "Expected ValueError"
+            except ValueError:
+                pass
+        print("  ✓ move and remove update stats, queries and change tracking")
+        
+        # Flushing applies moves and removals as deletions plus writes
+        tree.flush(out_dir)
+        tree.store_files(fresh_dir)
+        assert _read_dir(out_dir) == _read_dir(fresh_dir)
+        assert tree.generate_file_dict() == {"project/api.py": "from pkg.core import engine",
+                                             "lib/engine.py": "def run(): pass"}
+        print("  ✓ flush matches a fresh store_files")
+    
+    # A file registered at the old path of a moved directory does not make
+    # the stale directory entry look verified
+    tree = DirTree()
+    tree.add_file("d/e.md/a.py", "a")
+    tree.move("d", "old")
+    tree.add_file("d/e.md", "file")
+    tree.add_file("d/e.md/b.py", "b")
+    assert tree.generate_file_dict() == {"old/e.md/a.py": "a", "d/e.md": "file", "d/e.md/b.py": "b"}
+    print("  ✓ A file and a directory at the same path are revalidated separately")
+    
+    print("\n✓ test_move_rename_remove PASSED")
+
+
+def test_bulk_ingest():
+    """Test that json_to_tree and add_files_to_dir_tree build the same tree as add_file"""
+    print("\n" + "="*60)
+    print("TEST: test_bulk_ingest")
+    print("="*60)
+
+    files = {
+        "src/a.py": "import os\n",
+        "src/b.py": "x = 1\n",
+        "src/util/c.py": "def f(): pass\n",
+        "README.md": "# readme\n",
+        "src/d.py": "y = 2\n",
+        "docs/guide.md": "guide text\n",
+    }
+    expected = DirTree()
+    for filepath, content in files.items():
+        expected.add_file("project/" + filepath, content)
+
+    tree = DirTree()
+    tree.json_to_tree(files, "/project/")
+    assert tree.generate_file_dict() == expected.generate_file_dict()
+    assert list(tree.generate_file_dict()) == list(expected.generate_file_dict())
+    assert tree.get_stats("project/src") == expected.get_stats("project/src")
+    assert tree.glob("project/**/*.py") == expected.glob("project/**/*.py")
+    print("  ✓ Bulk loaded tree matches per-file add_file, in the same order")
+
+    # Adding to an existing tree replaces files and refreshes cached stats
+    before = tree.get_stats()
+    tree.add_files_to_dir_tree([
+        {"path": "src/a.py", "contents": "import os\nimport sys\n"},
+        {"path": "src/new/e.py", "contents": "z = 3\n"},
+    ], "project")
+    expected.add_file("project/src/a.py", "import os\nimport sys\n")
+    expected.add_file("project/src/new/e.py", "z = 3\n")
+    assert tree.generate_file_dict() == expected.generate_file_dict()
+    assert tree.get_stats() == expected.get_stats()
+    assert tree.get_stats().files == before.files + 1
+    assert tree.generate_file_dict("project/src/new") == {"project/src/new/e.py": "z = 3\n"}
+    print("  ✓ Bulk add replaces existing files and invalidates cached stats")
+
+    # Irregular paths still go through add_file
+    tree.add_files_to_dir_tree({"/top.txt": "t", "a//b.txt": "b"})
+    assert tree.generate_file_dict()["top.txt"] == "t"
+    assert tree.generate_file_dict()["a/b.txt"] == "b"
+    print("  ✓ Leading slashes and empty path parts are normalized")
+
+    print("\n✓ test_bulk_ingest PASSED")
+
+
+def test_concurrent_dir_tree():
+    """Test ConcurrentDirTree writers in parallel with live-tree and snapshot reads"""
+    print("\n" + "="*60)
+    print("TEST: test_concurrent_dir_tree")
+    print("="*60)
+
+    tree = ConcurrentDirTree(stripes=8)
+    tree.add_file("README.md", "# project\n")
+    errors = []
+
+    def worker(w):
+        try:
+            for i in range(200):
+                tree.add_file(f"node_{w}/src/f{i}.py", f"x = {i}\n")
+            tree.add_files_to_dir_tree({f"t{i}.py": "assert True\n" for i in range(20)}, f"node_{w}/tests")
+            tree.move(f"node_{w}/src/f0.py", f"node_{w}/main.py")
+            tree.remove(f"node_{w}/src/f1.py")
+            tree.change_dir_state(f"node_{w}/tests", State.VISIBLE_PATH)
+        except Exception as e:
+            errors.append(e)
+
+    sizes = []
+
+    def snapshot_reader():
+        try:
+            for _ in range(20):
+                snapshot = tree.snapshot()
+                files = snapshot.generate_file_dict()
+                assert snapshot.get_stats().files == len(files)
+                sizes.append(len(files))
+        except Exception as e:
+            errors.append(e)
+
+    def live_reader():
+        # Whole-tree and per-directory reads of the live tree while it is written
+        try:
+            for _ in range(20):
+                files = tree.generate_file_dict()
+                assert len(list(tree.walk(filter=State.VISIBLE))) >= 1
+                assert json.loads("".join(tree.iter_json())).keys() >= {"README.md"}
+                tree.glob("node_*/src/*.py")
+                tree.find(ext=".py", dir="node_1") if tree.dir_exists("node_1") else None
+                tree.render_dir_tree(words=True)
+                tree.get_stats()
+                tree.get_digest()
+                sizes.append(len(files))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(w,)) for w in range(6)]
+    threads += [threading.Thread(target=snapshot_reader) for _ in range(2)]
+    threads += [threading.Thread(target=live_reader) for _ in range(2)]
+    # Switch threads often so that unlocked reads would hit concurrent writes
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert not errors, errors
+
+    snapshot = tree.snapshot()
+    files = snapshot.generate_file_dict()
+    assert len(files) == 1 + 6 * (200 - 1 + 20)
+    assert files["node_3/main.py"] == "x = 0\n"
+    assert "node_3/src/f1.py" not in files
+    assert files["node_3/tests/t5.py"] == "[HIDDEN FILE CONTENTS, DO NOT EDIT]"
+    assert files == tree.generate_file_dict()
+    assert len(tree.glob("node_2/src/*.py")) == 198
+    # Reads may see a worker's files before its remove
+    assert all(size <= 1 + 6 * (200 + 20) for size in sizes)
+    print(f"  ✓ 6 writers in parallel, {len(sizes)} snapshot and live-tree reads")
+
+    # Counters and hashes cached by readers during the writes are not stale
+    rebuilt = snapshot.to_tree()
+    assert tree.get_stats() == snapshot.get_stats() == rebuilt.get_stats()
+    assert tree.get_digest() == snapshot.get_digest() == rebuilt.get_digest()
+    print("  ✓ Cached counters and hashes match a fresh computation")
+
+    # Snapshots are immutable versions, reused until the next write
+    assert isinstance(snapshot, PersistentDirTree)
+    assert tree.snapshot() is snapshot
+    tree.add_file("node_0/new.py", "y = 1\n")
+    assert "node_0/new.py" not in snapshot.generate_file_dict()
+    latest = tree.snapshot()
+    assert "node_0/new.py" in latest.generate_file_dict()
+    # Only the written top-level directory is copied again
+    assert latest.root.children["node_1"] is snapshot.root.children["node_1"]
+    assert latest.root.children["node_0"] is not snapshot.root.children["node_0"]
+    print("  ✓ Snapshots stay unchanged and share unwritten top-level directories")
+
+    # A writer holding one top-level directory does not block another one
+    other = next(f"node_{w}" for w in range(1, 100) if tree._stripe(f"node_{w}") != tree._stripe("node_0"))
+    tree.add_dir(other)
+    done = {}
+
+    def write(path):
+        tree.add_file(path, "z\n")
+        done[path] = True
+
+    with tree._writing(["node_0/held.py"]):
+        disjoint = threading.Thread(target=write, args=(f"{other}/free.py",))
+        same = threading.Thread(target=write, args=("node_0/blocked.py",))
+        disjoint.start()
+        same.start()
+        disjoint.join(timeout=5)
+        same.join(timeout=0.2)
+        assert done.get(f"{other}/free.py")
+        assert not done.get("node_0/blocked.py")
+    same.join(timeout=5)
+    assert done.get("node_0/blocked.py")
+    print("  ✓ Disjoint top-level directories are written in parallel")
+
+    print("\n✓ test_concurrent_dir_tree PASSED")
+
+
+def test_persistent_versions():
+    """Test PersistentDirTree path copying, version history, diff and conversion"""
+    print("\n" + "="*60)
+    print("TEST: test_persistent_versions")
+    print("="*60)
+
+    tree = DirTree()
+    tree.json_to_tree({
+        "src/app.py": "import os\n",
+        "src/util/helpers.py": "def helper():\n    pass\n",
+        "docs/guide.md": "guide\n",
+    })
+    v1 = tree.to_persistent()
+    assert v1.generate_file_dict() == tree.generate_file_dict()
+    assert v1.get_digest() == tree.get_digest()
+    assert v1.get_stats() == tree.get_stats()
+    print("  ✓ to_persistent keeps files, stats and Merkle hash")
+
+    # An update copies only the directories on the changed path
+    v2 = v1.with_file("src/util/helpers.py", "def helper():\n    return 1\n")
+    assert v2.root is not v1.root
+    assert v2.node("src") is not v1.node("src")
+    assert v2.node("src/util") is not v1.node("src/util")
+    assert v2.node("docs") is v1.node("docs")
+    assert v2.node("src/app.py") is v1.node("src/app.py")
+    assert v1.node("src/util/helpers.py").content == "def helper():\n    pass\n"
+    print("  ✓ Updates copy the root-to-change path and share the rest")
+
+    v3 = v2.with_files({"tests/test_app.py": "assert True\n", "app.py": "x = 1\n"}, "src")
+    v4 = v3.without("docs").with_moved("src/util", "lib/util")
+    v5 = v4.with_dir_state("lib", State.HIDDEN).with_file_state("lib/util/helpers.py", State.VISIBLE)
+    versions = [v1, v2, v3, v4, v5]
+    assert sorted(v3.generate_file_dict()) == ["docs/guide.md", "src/app.py", "src/tests/test_app.py",
+                                               "src/util/helpers.py"]
+    assert sorted(v4.generate_file_dict()) == ["lib/util/helpers.py", "src/app.py", "src/tests/test_app.py"]
+    assert v4.node("lib/util/helpers.py") is v3.node("src/util/helpers.py")
+    assert v5.node("lib").state == State.VISIBLE
+    assert v5.node("lib/util").state == State.VISIBLE
+    assert v1.generate_file_dict() == tree.generate_file_dict()
+    print("  ✓ Every version stays readable after later updates")
+
+    # The same operations on a mutable tree give the same hashes
+    tree.add_file("src/util/helpers.py", "def helper():\n    return 1\n")
+    tree.add_files_to_dir_tree({"tests/test_app.py": "assert True\n", "app.py": "x = 1\n"}, "src")
+    tree.remove("docs")
+    tree.move("src/util", "lib/util")
+    tree.change_dir_state("lib", State.HIDDEN)
+    tree.change_file_state("lib/util/helpers.py", State.VISIBLE)
+    assert v5.get_digest() == tree.get_digest()
+    assert v5.generate_file_dict() == tree.generate_file_dict()
+    assert v5.to_tree().get_digest() == tree.get_digest()
+    print("  ✓ Versions match the equivalent DirTree operations")
+
+    # Diff, roll back and branch
+    diff = v1.diff(v4)
+    assert sorted(diff.added) == ["lib/util/helpers.py", "src/tests/test_app.py"]
+    assert sorted(diff.removed) == ["docs/guide.md", "src/util/helpers.py"]
+    assert list(diff.modified) == ["src/app.py"]
+    assert list(v1.diff(v2).modified) == ["src/util/helpers.py"]
+    branch = versions[1].with_file("README.md", "# branch\n")
+    assert "README.md" not in v5.generate_file_dict()
+    assert sorted(branch.generate_file_dict()) == ["README.md", "docs/guide.md", "src/app.py",
+                                                   "src/util/helpers.py"]
+    print("  ✓ Versions can be diffed, rolled back to and branched")
+
+    try:
+        v1.without("missing.py")
+        assert False, "Should have raised ValueError"
+    except ValueError:
+        pass
+    try:
+        v1.with_moved("src", "src/inner")
+        assert False, "Should have raised ValueError"
+    except ValueError:
+        pass
+    print("  ✓ Invalid updates raise ValueError")
+
+    print("\n✓ test_persistent_versions PASSED")
+
+
 if __name__ == "__main__":
     print("\n" + "="*60)
     print("RUNNING ALL TESTS")
     print("="*60)
     
-    test_json_to_tree()
-    test_dir_exists()
-    test_file_attributes()
-    test_node_dir_attributes()
-    test_add_file()
-    test_add_dir()
-    test_print_dir_tree()
-    test_set_dir_to_invisible()
-    test_generate_file_dict()
+    tests = [
+        test_json_to_tree,
+        test_dir_exists,
+        test_file_attributes,
+        test_node_dir_attributes,
+        test_add_file,
+        test_add_dir,
+        test_print_dir_tree,
+        test_set_dir_to_invisible,
+        test_generate_file_dict,
+        test_stats,
+        test_path_index,
+        test_compact_nodes,
+        test_lazy_file,
+        test_sync_files,
+        test_flush,
+        test_render_dir_tree,
+        test_walk,
+        test_visibility_view,
+        test_content_dedup,
+        test_snapshot,
+        test_from_filesystem,
+        test_merkle_hashes,
+        test_diff_and_merge,
+        test_budgeted_file_dict,
+        test_json_serializer,
+        test_stream_ingester,
+        test_glob_and_find,
+        test_text_search,
+        test_change_states_batch,
+        test_array_layout,
+        test_move_rename_remove,
+        test_bulk_ingest,
+        test_concurrent_dir_tree,
+        test_persistent_versions,
+    ]
+    
+    # Keep going after a failure so every test runs, then report the failures
+    failed = []
+    for test in tests:
+        try:
+            test()
+        except Exception:
+            traceback.print_exc()
+            failed.append(test.__name__)
     
     print("\n" + "="*60)
+    if failed:
+        print(f"{len(failed)} OF {len(tests)} TESTS FAILED: {', '.join(failed)}")
+        print("="*60 + "\n")
+        sys.exit(1)
     print("ALL TESTS PASSED! ✓")
     print("="*60 + "\n")
-